@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Каталог отправленных резервных копий
+
+Хранится в отдельной базе SQLite рядом с локальной базовой копией (BACKUP_DIR),
+чтобы не попадать в сами резервные копии. Для каждой копии записываются время,
+тип (full/delta), размеры, контрольные суммы и идентификаторы сообщений и файлов
+в Telegram, по которым копию можно скачать при восстановлении.
+"""
+import json
+import sqlite3
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+class BackupCatalog:
+    """Каталог резервных копий с политикой хранения"""
+
+    def __init__(self, catalog_path: str):
+        self.catalog_path = catalog_path
+        self.init_catalog()
+
+    def init_catalog(self):
+        """Создание таблицы каталога"""
+        with sqlite3.connect(self.catalog_path) as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS backups (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    created_at DATETIME NOT NULL,
+                    kind TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    base_filename TEXT,
+                    original_size INTEGER,
+                    compressed_size INTEGER,
+                    sha256 TEXT NOT NULL,
+                    db_sha256 TEXT NOT NULL,
+                    parts INTEGER NOT NULL DEFAULT 1,
+                    message_ids TEXT,
+                    file_ids TEXT
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_backups_created ON backups (created_at)')
+            conn.commit()
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> dict:
+        entry = dict(row)
+        entry['message_ids'] = json.loads(entry['message_ids'] or '[]')
+        entry['file_ids'] = json.loads(entry['file_ids'] or '[]')
+        return entry
+
+    def add(self, created_at: datetime, kind: str, filename: str, sha256: str, db_sha256: str,
+            original_size: int = None, compressed_size: int = None, parts: int = 1,
+            message_ids: List[int] = (), file_ids: List[str] = (), base_filename: str = None) -> int:
+        """
+        Запись об отправленной копии
+
+        Args:
+            sha256: Контрольная сумма архива (всех частей подряд)
+            db_sha256: Контрольная сумма восстановленной базы
+            base_filename: Для разностной копии - архив базовой копии
+        """
+        with sqlite3.connect(self.catalog_path) as conn:
+            cursor = conn.execute('''
+                INSERT INTO backups (created_at, kind, filename, base_filename, original_size,
+                                     compressed_size, sha256, db_sha256, parts, message_ids, file_ids)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (created_at.isoformat(timespec='seconds'), kind, filename, base_filename, original_size,
+                  compressed_size, sha256, db_sha256, parts, json.dumps(list(message_ids)),
+                  json.dumps(list(file_ids))))
+            conn.commit()
+            return cursor.lastrowid
+
+    def list(self, limit: int = 50) -> List[dict]:
+        """Последние копии, новые первыми"""
+        with sqlite3.connect(self.catalog_path) as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute('SELECT * FROM backups ORDER BY created_at DESC, id DESC LIMIT ?', (limit,))
+            return [self._to_dict(row) for row in rows]
+
+    def get(self, entry_id: int) -> Optional[dict]:
+        with sqlite3.connect(self.catalog_path) as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute('SELECT * FROM backups WHERE id = ?', (entry_id,)).fetchone()
+            return self._to_dict(row) if row else None
+
+    def latest(self) -> Optional[dict]:
+        entries = self.list(limit=1)
+        return entries[0] if entries else None
+
+    def find_by_filename(self, filename: str) -> Optional[dict]:
+        with sqlite3.connect(self.catalog_path) as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute(
+                'SELECT * FROM backups WHERE filename = ? ORDER BY id DESC LIMIT 1', (filename,)
+            ).fetchone()
+            return self._to_dict(row) if row else None
+
+    def apply_retention(self, keep_daily_days: int, keep_weekly_weeks: int, now: datetime = None) -> List[dict]:
+        """
+        Применяет политику хранения и удаляет лишние записи из каталога
+
+        Хранятся: все копии за последние keep_daily_days дней, последняя копия
+        каждой недели за keep_weekly_weeks недель, последняя полная копия и
+        базовые копии всех оставленных разностных копий.
+
+        Returns:
+            Удаленные записи
+        """
+        now = now or datetime.now()
+        entries = sorted(self.list(limit=-1), key=lambda entry: (entry['created_at'], entry['id']))
+        if not entries:
+            return []
+
+        daily_since = now - timedelta(days=keep_daily_days)
+        weekly_since = now - timedelta(weeks=keep_weekly_weeks)
+        keep = set()
+        weekly_latest = {}
+        for entry in entries:
+            created_at = datetime.fromisoformat(entry['created_at'])
+            if created_at >= daily_since:
+                keep.add(entry['id'])
+            if created_at >= weekly_since:
+                weekly_latest[created_at.isocalendar()[:2]] = entry['id']
+        keep.update(weekly_latest.values())
+
+        fulls = [entry for entry in entries if entry['kind'] == 'full']
+        if fulls:
+            keep.add(fulls[-1]['id'])
+
+        # Разностная копия бесполезна без своей базовой
+        by_filename = {entry['filename']: entry for entry in entries}
+        for entry in entries:
+            if entry['id'] in keep and entry['base_filename'] in by_filename:
+                keep.add(by_filename[entry['base_filename']]['id'])
+
+        removed = [entry for entry in entries if entry['id'] not in keep]
+        if removed:
+            with sqlite3.connect(self.catalog_path) as conn:
+                conn.executemany('DELETE FROM backups WHERE id = ?', [(entry['id'],) for entry in removed])
+                conn.commit()
+        return removed
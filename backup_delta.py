@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Разностные резервные копии базы SQLite на уровне страниц
+
+Снимок, снятый через backup API, постранично совпадает с базой, поэтому
+разница между базовой полной копией и текущим снимком - это только
+изменившиеся страницы. Разностная копия всегда считается от базовой копии
+(differential), поэтому для восстановления нужны базовая копия и последняя
+разностная.
+
+Формат файла: заголовок HEADER, затем записи (номер страницы, содержимое страницы).
+
+Использование:
+  python backup_delta.py rebuild BASE OUT [DELTA]   - собрать базу из базовой и разностной копии
+  python backup_delta.py diff BASE SNAPSHOT DELTA   - построить разностную копию
+Файлы могут быть сжаты (.gz, .zst).
+"""
+import os
+import sys
+import gzip
+import struct
+import sqlite3
+import hashlib
+
+MAGIC = b'NDODELTA'
+VERSION = 1
+# magic, версия, размер страницы, число страниц в новом снимке, число записей, sha256 базовой копии
+HEADER = struct.Struct('<8sHIIQ32s')
+PAGE_NUMBER = struct.Struct('<I')
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+def read_page_size(path):
+    """Размер страницы из заголовка файла SQLite"""
+    with open(path, 'rb') as f:
+        header = f.read(100)
+    if not header.startswith(b'SQLite format 3\x00'):
+        raise ValueError(f"Файл не является базой SQLite: {path}")
+    page_size = int.from_bytes(header[16:18], 'big')
+    return 65536 if page_size == 1 else page_size
+
+def file_sha256(path):
+    """Контрольная сумма файла"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def open_archive(path):
+    """Открывает файл на чтение с потоковой распаковкой по расширению"""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.zst'):
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return open(path, 'rb')
+
+def write_delta(base_path, snapshot_path, delta_path, base_sha256=None):
+    """
+    Строит разностную копию snapshot относительно base
+
+    Returns:
+        (число изменившихся страниц, число страниц в снимке)
+    """
+    page_size = read_page_size(snapshot_path)
+    if read_page_size(base_path) != page_size:
+        raise ValueError("Размер страницы снимка отличается от базовой копии")
+
+    base_digest = bytes.fromhex(base_sha256 or file_sha256(base_path))
+    page_count = os.path.getsize(snapshot_path) // page_size
+    changed = 0
+
+    with open(base_path, 'rb') as base, open(snapshot_path, 'rb') as snapshot, open(delta_path, 'wb') as delta:
+        delta.write(HEADER.pack(MAGIC, VERSION, page_size, page_count, 0, base_digest))
+        for page_number in range(page_count):
+            page = snapshot.read(page_size)
+            if page != base.read(page_size):
+                delta.write(PAGE_NUMBER.pack(page_number))
+                delta.write(page)
+                changed += 1
+        # Число записей известно только в конце - переписываем заголовок
+        delta.seek(0)
+        delta.write(HEADER.pack(MAGIC, VERSION, page_size, page_count, changed, base_digest))
+
+    return changed, page_count
+
+def rebuild(base_path, out_path, delta_path=None):
+    """
+    Собирает базу из базовой копии и (необязательно) разностной копии
+
+    Результат проверяется PRAGMA integrity_check и атомарно помещается в out_path.
+
+    Returns:
+        Число примененных страниц
+    """
+    tmp_path = f"{out_path}.rebuild"
+    digest = hashlib.sha256()
+    with open_archive(base_path) as base, open(tmp_path, 'wb') as out:
+        for chunk in iter(lambda: base.read(COPY_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            out.write(chunk)
+
+    applied = 0
+    try:
+        if delta_path:
+            with open_archive(delta_path) as delta, open(tmp_path, 'r+b') as out:
+                magic, version, page_size, page_count, records, base_digest = HEADER.unpack(delta.read(HEADER.size))
+                if magic != MAGIC or version != VERSION:
+                    raise ValueError(f"Неизвестный формат разностной копии: {delta_path}")
+                if base_digest != digest.digest():
+                    raise ValueError("Разностная копия снята не от этой базовой копии")
+
+                out.truncate(page_count * page_size)
+                for _ in range(records):
+                    page_number, = PAGE_NUMBER.unpack(delta.read(PAGE_NUMBER.size))
+                    out.seek(page_number * page_size)
+                    out.write(delta.read(page_size))
+                    applied += 1
+
+        with sqlite3.connect(tmp_path) as conn:
+            result = conn.execute("PRAGMA integrity_check").fetchall()
+        if result != [('ok',)]:
+            raise ValueError(f"Собранная база повреждена: {result[:5]}")
+
+        os.replace(tmp_path, out_path)
+        return applied
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def main():
+    if len(sys.argv) >= 4 and sys.argv[1] == 'rebuild':
+        base_path, out_path = sys.argv[2], sys.argv[3]
+        delta_path = sys.argv[4] if len(sys.argv) > 4 else None
+        applied = rebuild(base_path, out_path, delta_path)
+        print(f"✅ База собрана: {out_path} (применено страниц: {applied})")
+    elif len(sys.argv) == 5 and sys.argv[1] == 'diff':
+        changed, total = write_delta(sys.argv[2], sys.argv[3], sys.argv[4])
+        print(f"✅ Разностная копия: {changed} из {total} страниц")
+    else:
+        print(__doc__)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,15 +3,77 @@
 This script is used to backup the database of the NaumovaDO_biznesscouch bot.
 """
 import os
+import re
+import sys
+import json
+import asyncio
+import hashlib
+import logging
 import time
-import requests
-from datetime import datetime, date
+import uuid
+import zlib
+import shutil
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
+from backup_delta import write_delta, file_sha256
+from backup_catalog import BackupCatalog
+from metrics import BACKUP_SIZE_BYTES, BACKUP_SECONDS, BACKUP_FAILURES
+from logging_setup import setup_logging
+
 # Загрузка переменных окружения
 load_dotenv()
 
-DB_PATH = "/opt/telegram_bots/NaumovaDO_biznesscouch/naumovado.db"
+logger = logging.getLogger(__name__)
+
+# База бота: DB_PATH, как у хранилища бота (storage.create_storage); без него - путь установки службы
+DB_PATH = os.getenv('DB_PATH') or "/opt/telegram_bots/NaumovaDO_biznesscouch/naumovado.db"
+
+# Bot API отправляет документы до 50 МБ, но отдает через getFile только файлы до 20 МБ:
+# часть больше нельзя будет скачать при восстановлении. Локальный сервер Bot API
+# (BOT_API_BASE_URL) отдает файлы любого размера - там части до 45 МБ
+TELEGRAM_DOWNLOAD_LIMIT = 20 * 1024 * 1024
+LOCAL_API_PART_SIZE = 45 * 1024 * 1024
+DEFAULT_PART_SIZE = LOCAL_API_PART_SIZE if os.getenv('BOT_API_BASE_URL') else TELEGRAM_DOWNLOAD_LIMIT
+
+# Размер блока чтения снимка при сжатии
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+def format_size(size):
+    """Человекочитаемый размер в байтах"""
+    for unit in ('Б', 'КБ', 'МБ'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'Б' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} ГБ"
+
+class _ArchiveParts:
+    """Делит поток сжатых блоков на части не больше part_size байт"""
+    
+    def __init__(self, chunks, part_size):
+        self._chunks = iter(chunks)
+        self._pending = b''
+        self.part_size = part_size
+    
+    def has_more(self):
+        """Остались ли еще данные (при необходимости дожимает следующий блок)"""
+        while not self._pending:
+            try:
+                self._pending = next(self._chunks)
+            except StopIteration:
+                return False
+        return True
+    
+    def iter_part(self):
+        """Отдает блоки очередной части"""
+        sent = 0
+        while sent < self.part_size and self.has_more():
+            piece = self._pending[:self.part_size - sent]
+            self._pending = self._pending[len(piece):]
+            sent += len(piece)
+            yield piece
 
 class BackupService:
     """Сервис для создания и отправки резервных копий базы данных"""
@@ -20,106 +82,512 @@ class BackupService:
         self.bot_token = bot_token
         self.backup_to = backup_to
         self.db_path = db_path
-        self.bot_url = f"https://api.telegram.org/bot{bot_token}"
+        self.bot_url = f"{os.getenv('BOT_API_BASE_URL', 'https://api.telegram.org/bot')}{bot_token}"
+        # Снимок копируется порциями страниц с паузами, чтобы не задерживать запись в базу
+        self.pages_per_step = int(os.getenv('BACKUP_PAGES_PER_STEP', '256'))
+        self.step_pause = float(os.getenv('BACKUP_STEP_PAUSE', '0.005'))
+        # Сжатие архива: auto (zstd при наличии, иначе gzip), zstd или gzip
+        self.compression = os.getenv('BACKUP_COMPRESSION', 'auto').lower()
+        self.part_size = int(os.getenv('BACKUP_PART_SIZE', str(DEFAULT_PART_SIZE)))
+        if not os.getenv('BOT_API_BASE_URL') and self.part_size > TELEGRAM_DOWNLOAD_LIMIT:
+            logger.warning(f"⚠️ BACKUP_PART_SIZE больше 20 МБ: такие части Bot API не отдаст при восстановлении, "
+                           f"части будут по {format_size(TELEGRAM_DOWNLOAD_LIMIT)}")
+            self.part_size = TELEGRAM_DOWNLOAD_LIMIT
+        self.last_backup = None
+        # Локальная базовая копия для разностных копий и состояние копирования
+        self.backup_dir = os.getenv('BACKUP_DIR') or os.path.join(os.path.dirname(os.path.abspath(db_path)), 'backups')
+        self.base_path = os.path.join(self.backup_dir, 'base.db')
+        self.state_path = os.path.join(self.backup_dir, 'backup_state.json')
+        self.catalog_path = os.path.join(self.backup_dir, 'backup_catalog.db')
+        # Политика хранения: все копии за N дней и по одной в неделю за M недель
+        self.keep_daily_days = int(os.getenv('BACKUP_KEEP_DAILY_DAYS', '14'))
+        self.keep_weekly_weeks = int(os.getenv('BACKUP_KEEP_WEEKLY_WEEKS', '8'))
+        self.full_every_days = int(os.getenv('BACKUP_FULL_EVERY_DAYS', '7'))
+        # Расписание в формате cron или "ЧЧ:ММ" (местное время сервера)
+        self.schedule_expression = os.getenv('BACKUP_SCHEDULE', '0 21 * * *')
+        self.upload_retries = int(os.getenv('BACKUP_UPLOAD_RETRIES', '5'))
+        # Бот и его цикл событий задаются при запуске копирования из очереди задач бота
+        self.bot = None
+        self.loop = None
+    
+    def create_snapshot(self, snapshot_path):
+        """
+        Создает согласованный снимок базы через SQLite backup API
+        
+        Копирование идет порциями по pages_per_step страниц с паузами между ними.
+        На источнике держится транзакция чтения: в режиме WAL она фиксирует снимок
+        на момент начала (включая данные из -wal) и не мешает писателям, а SQLite
+        не перезапускает копирование из-за их коммитов.
+        """
+        def yield_to_writers(status, remaining, total):
+            time.sleep(self.step_pause)
+        
+        source = sqlite3.connect(self.db_path, isolation_level=None)
+        snapshot = sqlite3.connect(snapshot_path)
+        try:
+            source.execute("BEGIN")
+            source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            source.backup(snapshot, pages=self.pages_per_step, progress=yield_to_writers)
+            source.execute("COMMIT")
+            # Снимок должен быть самодостаточным файлом без -wal
+            snapshot.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            snapshot.close()
+            source.close()
+    
+    @staticmethod
+    def verify_snapshot(snapshot_path):
+        """Проверяет целостность снимка через PRAGMA integrity_check"""
+        with sqlite3.connect(snapshot_path) as conn:
+            result = conn.execute("PRAGMA integrity_check").fetchall()
+        if result == [('ok',)]:
+            return True
+        logger.error(f"❌ Снимок базы поврежден: {result[:5]}")
+        return False
+    
+    def _get_compressor(self):
+        """
+        Возвращает (объект потокового сжатия, расширение архива)
+        
+        zstd используется, если установлен пакет zstandard, иначе gzip.
+        """
+        if self.compression in ('auto', 'zstd'):
+            try:
+                import zstandard
+                return zstandard.ZstdCompressor(level=10).compressobj(), 'zst'
+            except ImportError:
+                if self.compression == 'zstd':
+                    logger.warning("⚠️ Библиотека zstandard не установлена, используется gzip")
+        # wbits=31 - формат gzip
+        return zlib.compressobj(6, zlib.DEFLATED, 31), 'gz'
+    
+    @staticmethod
+    def _iter_compressed(path, compressor, stats, digests):
+        """Читает файл порциями и отдает сжатые блоки, подсчитывая размеры и контрольные суммы"""
+        with open(path, 'rb') as source:
+            while True:
+                chunk = source.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                stats['original_size'] += len(chunk)
+                digests['source'].update(chunk)
+                compressed = compressor.compress(chunk)
+                if compressed:
+                    stats['compressed_size'] += len(compressed)
+                    digests['archive'].update(compressed)
+                    yield compressed
+        tail = compressor.flush()
+        if tail:
+            stats['compressed_size'] += len(tail)
+            digests['archive'].update(tail)
+            yield tail
+    
+    def _upload_part(self, filename, data_chunks, caption):
+        """Отправка части архива: через бота, если копирование запущено из бота, иначе напрямую"""
+        if self.bot is not None:
+            return self._upload_part_via_bot(filename, data_chunks, caption)
+        return self._upload_part_streaming(filename, data_chunks, caption)
+    
+    def _upload_part_via_bot(self, filename, data_chunks, caption):
+        """
+        Отправка части архива общим HTTP-клиентом бота с повторами
+        
+        Вызывается из рабочего потока: часть (не больше part_size) сначала
+        дописывается во временный файл, затем отправляется в цикле событий бота.
+        """
+        from telegram.error import NetworkError, RetryAfter
+        
+        with tempfile.TemporaryFile() as part_file:
+            for chunk in data_chunks:
+                part_file.write(chunk)
+            part_caption = caption()
+            
+            for attempt in range(1, self.upload_retries + 1):
+                part_file.seek(0)
+                upload = self.bot.send_document(
+                    chat_id=self.backup_to,
+                    document=part_file,
+                    filename=filename,
+                    caption=part_caption,
+                    read_timeout=300,
+                    write_timeout=300
+                )
+                try:
+                    message = asyncio.run_coroutine_threadsafe(upload, self.loop).result()
+                    return {'message_id': message.message_id, 'file_id': message.document.file_id}
+                except RetryAfter as e:
+                    delay = e.retry_after
+                except NetworkError as e:
+                    delay = min(2 ** attempt, 300)
+                    logger.warning(f"⚠️ Ошибка отправки {filename} (попытка {attempt}): {e}")
+                if attempt < self.upload_retries:
+                    time.sleep(delay)
+        
+        logger.error(f"❌ Не удалось отправить {filename} за {self.upload_retries} попыток")
+        return None
+    
+    def _upload_part_streaming(self, filename, data_chunks, caption):
+        """
+        Потоковая отправка документа через sendDocument
+        
+        Тело multipart/form-data формируется на лету; подпись идет после файла,
+        чтобы в нее попали размеры, известные только после сжатия.
+        """
+        boundary = uuid.uuid4().hex
+        
+        def body():
+            yield (
+                f"--{boundary}\r\n"
+                f'Content-Disposition: form-data; name="chat_id"\r\n\r\n{self.backup_to}\r\n'
+                f"--{boundary}\r\n"
+                f'Content-Disposition: form-data; name="document"; filename="{filename}"\r\n'
+                f"Content-Type: application/octet-stream\r\n\r\n"
+            ).encode('utf-8')
+            yield from data_chunks
+            yield (
+                f"\r\n--{boundary}\r\n"
+                f'Content-Disposition: form-data; name="caption"\r\n\r\n{caption()}\r\n'
+                f"--{boundary}--\r\n"
+            ).encode('utf-8')
+        
+        # HTTP-клиент нужен только при отправке копии - не замедляет запуск бота
+        import requests
+        
+        response = requests.post(
+            f"{self.bot_url}/sendDocument",
+            data=body(),
+            headers={'Content-Type': f'multipart/form-data; boundary={boundary}'}
+        )
+        if response.status_code != 200:
+            logger.error(f"❌ Ошибка при отправке: {response.status_code} - {response.text}")
+            return None
+        message = response.json()['result']
+        return {'message_id': message['message_id'], 'file_id': message['document']['file_id']}
+    
+    def _send_archive(self, source_path, archive_name, title, started, details=()):
+        """
+        Сжимает файл на лету и отправляет его одной или несколькими частями
+        
+        Returns:
+            Словарь с размерами, контрольными суммами, числом частей и
+            идентификаторами отправленных сообщений или None при ошибке отправки
+        """
+        compressor, extension = self._get_compressor()
+        archive_name = f"{archive_name}.{extension}"
+        stats = {'original_size': 0, 'compressed_size': 0}
+        digests = {'source': hashlib.sha256(), 'archive': hashlib.sha256()}
+        parts = _ArchiveParts(self._iter_compressed(source_path, compressor, stats, digests), self.part_size)
+        # Сжатый архив не больше исходного файла, поэтому маленький файл - всегда одна часть
+        split = os.path.getsize(source_path) > self.part_size
+        
+        uploads = []
+        part_number = 0
+        while part_number == 0 or parts.has_more():
+            part_number += 1
+            filename = f"{archive_name}.part{part_number:03d}" if split else archive_name
+            
+            def caption(part_number=part_number):
+                lines = [title]
+                last = not parts.has_more()
+                if split:
+                    lines.append(f"Часть {part_number}" + (f" из {part_number}" if last else ""))
+                if last:
+                    ratio = stats['compressed_size'] / stats['original_size'] * 100 if stats['original_size'] else 0
+                    lines.extend(details)
+                    lines.append(f"Исходный размер: {format_size(stats['original_size'])}")
+                    lines.append(f"Сжатый размер: {format_size(stats['compressed_size'])} ({ratio:.0f}%)")
+                    lines.append(f"Время: {time.monotonic() - started:.1f} с")
+                    # Для восстановления без каталога: restore_backup.py restore-files --sha256
+                    lines.append(f"SHA-256: {digests['source'].hexdigest()}")
+                return "\n".join(lines)
+            
+            upload = self._upload_part(filename, parts.iter_part(), caption)
+            if not upload:
+                return None
+            uploads.append(upload)
+        
+        result = dict(
+            stats,
+            filename=archive_name,
+            parts=part_number,
+            elapsed=time.monotonic() - started,
+            sha256=digests['archive'].hexdigest(),
+            source_sha256=digests['source'].hexdigest(),
+            message_ids=[upload['message_id'] for upload in uploads],
+            file_ids=[upload['file_id'] for upload in uploads]
+        )
+        logger.info(
+            f"✅ Резервная копия успешно отправлена: {archive_name} "
+            f"({format_size(stats['original_size'])} -> {format_size(stats['compressed_size'])}, "
+            f"частей: {part_number}, {result['elapsed']:.1f} с)"
+        )
+        return result
+    
+    def _load_state(self):
+        """Состояние инкрементального резервного копирования"""
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+    
+    def _save_state(self, state):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.state_path)
+    
+    def _record(self, result, kind, db_sha256, base_filename=None):
+        """Учет отправленной копии: метрики, запись в каталог и политика хранения"""
+        BACKUP_SIZE_BYTES.labels(kind, 'original').set(result['original_size'])
+        BACKUP_SIZE_BYTES.labels(kind, 'compressed').set(result['compressed_size'])
+        BACKUP_SECONDS.labels(kind).observe(result['elapsed'])
+        try:
+            catalog = BackupCatalog(self.catalog_path)
+            catalog.add(
+                datetime.now(), kind, result['filename'], result['sha256'], db_sha256,
+                original_size=result['original_size'], compressed_size=result['compressed_size'],
+                parts=result['parts'], message_ids=result['message_ids'], file_ids=result['file_ids'],
+                base_filename=base_filename
+            )
+            removed = catalog.apply_retention(self.keep_daily_days, self.keep_weekly_weeks)
+            if removed:
+                logger.info(f"🧹 По политике хранения удалено записей из каталога: {len(removed)}")
+        except Exception as e:
+            # Копия уже отправлена - ошибка каталога не должна ее отменять
+            logger.warning(f"⚠️ Ошибка записи в каталог резервных копий: {e}")
+    
+    def has_changes(self):
+        """Менялась ли база с момента последней отправленной копии"""
+        counter = get_change_counter(self.db_path)
+        last_counter = self._load_state().get('last_counter')
+        logger.debug(f"Счетчик изменений базы: {counter}, в последней копии: {last_counter}")
+        return counter is None or counter != last_counter
+    
+    def _make_snapshot_dir(self):
+        """
+        Временный каталог снимка внутри каталога копий
+        
+        Снимок потом переименовывается в base.db, а переименование работает только
+        в пределах одной файловой системы: системный /tmp у службы отдельный
+        (PrivateTmp) и может быть на другом разделе.
+        """
+        os.makedirs(self.backup_dir, exist_ok=True)
+        return tempfile.mkdtemp(prefix="naumovado_backup_", dir=self.backup_dir)
+    
+    def _take_snapshot(self, snapshot_dir, filename):
+        """Снимок базы во временном каталоге; None, если снимок поврежден"""
+        snapshot_path = os.path.join(snapshot_dir, filename)
+        self.create_snapshot(snapshot_path)
+        return snapshot_path if self.verify_snapshot(snapshot_path) else None
     
     def send_backup(self):
-        """Отправляет резервную копию базы данных"""
+        """Отправляет полную резервную копию базы данных и делает ее новой базовой копией"""
+        snapshot_dir = None
+        started = time.monotonic()
         try:
             # Проверяем существование файла базы данных
             if not os.path.exists(self.db_path):
-                print(f"❌ Файл базы данных не найден: {self.db_path}")
+                logger.error(f"❌ Файл базы данных не найден: {self.db_path}")
                 return False
             
             # Создаем имя файла с временной меткой
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             backup_filename = f"naumovado_backup_{timestamp}.db"
             
-            # Отправляем файл через Telegram Bot API
-            with open(self.db_path, 'rb') as db_file:
-                files = {'document': (backup_filename, db_file, 'application/x-sqlite3')}
-                data = {'chat_id': self.backup_to}
-                
-                response = requests.post(
-                    f"{self.bot_url}/sendDocument",
-                    files=files,
-                    data=data
-                )
-                
-                if response.status_code == 200:
-                    print(f"✅ Резервная копия успешно отправлена: {backup_filename}")
-                    return True
-                else:
-                    print(f"❌ Ошибка при отправке: {response.status_code} - {response.text}")
-                    return False
+            # Снимаем согласованную копию вместо чтения живого файла
+            snapshot_dir = self._make_snapshot_dir()
+            snapshot_path = self._take_snapshot(snapshot_dir, backup_filename)
+            if not snapshot_path:
+                return False
+            
+            # Сжимаем снимок на лету прямо в тело запроса, без промежуточного архива на диске
+            result = self._send_archive(snapshot_path, backup_filename, f"💾 Резервная копия {timestamp}", started)
+            if not result:
+                return False
+            self.last_backup = dict(result, kind='full')
+            
+            # Снимок становится базовой копией для следующих разностных копий
+            os.replace(snapshot_path, self.base_path)
+            state = self._load_state()
+            state.update({
+                'base_name': backup_filename,
+                'base_archive': result['filename'],
+                'base_created': datetime.now().isoformat(timespec='seconds'),
+                'base_sha256': result['source_sha256'],
+                'last_counter': get_change_counter(self.base_path),
+            })
+            self._save_state(state)
+            self._record(result, 'full', result['source_sha256'])
+            return True
                     
         except Exception as e:
-            print(f"❌ Ошибка при создании резервной копии: {e}")
+            logger.error(f"❌ Ошибка при создании резервной копии: {e}")
             return False
+        finally:
+            if snapshot_dir:
+                shutil.rmtree(snapshot_dir, ignore_errors=True)
     
-    def start_scheduler(self):
-        """Запускает планировщик резервных копий"""
+    def send_incremental_backup(self):
+        """
+        Отправляет разностную копию относительно базовой
+        
+        Полная копия отправляется, если базовой копии нет или она старше
+        full_every_days дней.
+        """
+        state = self._load_state()
+        base_created = state.get('base_created')
+        if (not base_created or not os.path.exists(self.base_path)
+                or datetime.now() - datetime.fromisoformat(base_created) >= timedelta(days=self.full_every_days)):
+            logger.info("🔄 Создание полной резервной копии...")
+            return self.send_backup()
+        
+        snapshot_dir = None
+        started = time.monotonic()
         try:
-            import schedule
-            import threading
-            import time
-            
-            def backup_job():
-                """Задача для создания резервной копии"""
-                if was_db_changed_today(self.db_path):
-                    print("🔄 Создание автоматической резервной копии...")
-                    self.send_backup()
-                else:
-                    print("ℹ️ База данных не изменялась сегодня, резервная копия не требуется")
-            
-            # Планируем резервное копирование каждый день в 23:00
-            schedule.every().day.at("23:00").do(backup_job)
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            snapshot_dir = self._make_snapshot_dir()
+            snapshot_path = self._take_snapshot(snapshot_dir, f"naumovado_snapshot_{timestamp}.db")
+            if not snapshot_path:
+                return False
             
-            # Запускаем планировщик в отдельном потоке
-            def run_scheduler():
-                while True:
-                    schedule.run_pending()
-                    time.sleep(60)  # Проверяем каждую минуту
+            delta_filename = f"naumovado_delta_{timestamp}.bin"
+            delta_path = os.path.join(snapshot_dir, delta_filename)
+            changed, total = write_delta(self.base_path, snapshot_path, delta_path, state['base_sha256'])
             
-            scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
-            scheduler_thread.start()
+            result = self._send_archive(
+                delta_path, delta_filename, f"🧩 Разностная копия {timestamp}", started,
+                details=(f"Базовая копия: {state['base_name']}", f"Изменено страниц: {changed} из {total}")
+            )
+            if not result:
+                return False
+            self.last_backup = dict(result, kind='delta', changed_pages=changed)
             
-            print("✅ Планировщик резервных копий запущен (ежедневно в 23:00)")
+            state['last_counter'] = get_change_counter(snapshot_path)
+            self._save_state(state)
+            # База, собранная из базовой и этой разностной копии, побайтно совпадает со снимком
+            self._record(result, 'delta', file_sha256(snapshot_path), base_filename=state.get('base_archive'))
             return True
             
-        except ImportError:
-            print("⚠️ Библиотека schedule не установлена, планировщик не запущен")
-            return False
         except Exception as e:
-            print(f"❌ Ошибка при запуске планировщика: {e}")
+            logger.error(f"❌ Ошибка при создании разностной копии: {e}")
             return False
+        finally:
+            if snapshot_dir:
+                shutil.rmtree(snapshot_dir, ignore_errors=True)
+    
+    def run_backup(self):
+        """Резервное копирование по расписанию: только если база менялась"""
+        if not self.has_changes():
+            logger.info("ℹ️ База данных не изменялась с последней копии, резервная копия не требуется")
+            success = True
+        else:
+            logger.info("🔄 Создание автоматической резервной копии...")
+            success = self.send_incremental_backup()
+        
+        if not success:
+            BACKUP_FAILURES.inc()
+        else:
+            # Время последнего успешного запуска - для догоняющего запуска после простоя
+            state = self._load_state()
+            state['last_run'] = datetime.now().astimezone().isoformat(timespec='seconds')
+            os.makedirs(self.backup_dir, exist_ok=True)
+            self._save_state(state)
+        return success
+    
+    def _get_trigger(self):
+        """Cron-триггер расписания резервного копирования (местное время сервера)"""
+        from apscheduler.triggers.cron import CronTrigger
+        
+        expression = self.schedule_expression
+        # Допускается сокращенная запись "ЧЧ:ММ" - ежедневно в указанное время
+        if re.fullmatch(r'\d{1,2}:\d{2}', expression):
+            hour, minute = expression.split(':')
+            expression = f"{int(minute)} {int(hour)} * * *"
+        return CronTrigger.from_crontab(expression)
+    
+    def next_run_time(self):
+        """Время следующего запуска по расписанию"""
+        return self._get_trigger().get_next_fire_time(None, datetime.now().astimezone())
+    
+    def _missed_run(self, trigger):
+        """Был ли пропущен запуск по расписанию (например, бот не работал в это время)"""
+        last_run = self._load_state().get('last_run')
+        if not last_run:
+            return False
+        expected = trigger.get_next_fire_time(None, datetime.fromisoformat(last_run).astimezone())
+        return expected is not None and expected <= datetime.now().astimezone()
+    
+    async def _backup_job(self, context):
+        """Задача очереди бота: копирование в рабочем потоке, отправка через клиент бота"""
+        self.bot = context.bot
+        self.loop = asyncio.get_running_loop()
+        await asyncio.to_thread(self.run_backup)
+    
+    def schedule(self, application):
+        """
+        Планирует резервное копирование в очереди задач бота
+        
+        Расписание задается BACKUP_SCHEDULE в формате cron ("0 21 * * *") или "ЧЧ:ММ".
+        Если запуск был пропущен из-за простоя, копия создается вскоре после старта.
+        """
+        job_queue = application.job_queue
+        if job_queue is None:
+            logger.warning("⚠️ Очередь задач недоступна (нужен python-telegram-bot[job-queue]), планировщик не запущен")
+            return False
+        
+        try:
+            trigger = self._get_trigger()
+        except ValueError as e:
+            logger.error(f"❌ Некорректное расписание BACKUP_SCHEDULE={self.schedule_expression}: {e}")
+            return False
+        
+        job_queue.run_custom(
+            self._backup_job,
+            job_kwargs={'trigger': trigger, 'coalesce': True, 'misfire_grace_time': 3600},
+            name="database_backup"
+        )
+        
+        if self._missed_run(trigger):
+            logger.info("⏰ Пропущен запуск резервного копирования, догоняющая копия через минуту")
+            job_queue.run_once(self._backup_job, when=60, name="database_backup_catchup")
+        
+        logger.info(f"✅ Планировщик резервных копий запущен ({self.schedule_expression}, "
+              f"следующий запуск: {self.next_run_time():%d.%m.%Y %H:%M})")
+        return True
 
-def was_db_changed_today(db_path):
-    """Проверяет, была ли база данных изменена сегодня"""
+def get_change_counter(db_path):
+    """
+    Счетчик изменений строк базы (таблица change_counter, ведется триггерами)
+    
+    В отличие от времени изменения файла, счетчик надежен в режиме WAL.
+    Возвращает None, если файла или счетчика нет.
+    """
     if not os.path.exists(db_path):
-        print("❌ Файл базы данных не найден")
-        return False
-    mtime = os.path.getmtime(db_path)
-    mdate = datetime.fromtimestamp(mtime).date()
-    today = date.today()
-    print(f"Дата последнего изменения базы: {mdate}, сегодня: {today}")
-    return mdate == today
+        logger.error("❌ Файл базы данных не найден")
+        return None
+    try:
+        with sqlite3.connect(db_path) as conn:
+            row = conn.execute("SELECT changes FROM change_counter WHERE id = 1").fetchone()
+            return row[0] if row else None
+    except sqlite3.Error:
+        return None
 
 def main():
     """Основная функция для запуска из командной строки"""
-    if was_db_changed_today(DB_PATH):
-        print("✅ База была изменена сегодня, отправляем бэкап...")
-        
-        bot_token = os.getenv('BOT_TOKEN')
-        backup_to = os.getenv('BACKUPTO')
-        
-        if not bot_token or not backup_to:
-            print("❌ Не заданы переменные окружения BOT_TOKEN или BACKUPTO")
-            return
-        
-        backup_service = BackupService(bot_token, backup_to, DB_PATH)
+    setup_logging()
+    bot_token = os.getenv('BOT_TOKEN')
+    backup_to = os.getenv('BACKUPTO')
+    
+    if not bot_token or not backup_to:
+        print("❌ Не заданы переменные окружения BOT_TOKEN или BACKUPTO")
+        return
+    
+    backup_service = BackupService(bot_token, backup_to, DB_PATH)
+    if len(sys.argv) > 1 and sys.argv[1] == 'full':
         backup_service.send_backup()
     else:
-        print("ℹ️ База не менялась сегодня, бэкап не отправляется.")
+        backup_service.run_backup()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест бота на локальной замене Telegram Bot API
+
+Запускает настоящее приложение из simple_bot.build_application с подставленным
+HTTP-клиентом, который отвечает на вызовы Bot API в памяти процесса (с
+настраиваемой задержкой). Синтетические пользователи приходят с заданной
+интенсивностью (пуассоновский поток) и проходят сценарий
+/start -> контакт -> запрос -> кнопка "Завершить"; каждый следующий шаг
+отправляется после ответа бота на предыдущий.
+
+Отчет: пропускная способность (регистраций в секунду), p50/p95/p99 задержки
+ответа по шагам и частота записи в базу.
+
+Использование:
+  python bench_bot_load.py --users 500 --rate 50
+  python bench_bot_load.py --users 2000 --rate 200 --api-latency 0.05 --output load.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import statistics
+import contextlib
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+BENCH_TOKEN = "123456:bench"
+STEPS = ('start', 'contact', 'request', 'finish')
+
+class FakeBotApiRequest(BaseRequest):
+    """
+    Замена HTTP-клиента бота: отвечает на вызовы Bot API без сети
+
+    Ответы с chat_id (sendMessage, editMessageText) передаются ожидающим
+    синтетическим пользователям через replies.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+        self.replies = {}
+        self._message_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if api_method == 'getMe':
+            result = {'id': 123456, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        elif 'chat_id' in params:
+            self._message_id += 1
+            chat_id = int(params['chat_id'])
+            result = {
+                'message_id': params.get('message_id', self._message_id),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': params.get('text', ''),
+            }
+            waiter = self.replies.pop(chat_id, None)
+            if waiter and not waiter.done():
+                waiter.set_result(result)
+        else:
+            # answerCallbackQuery, setMyCommands и прочие вызовы без ответного сообщения
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+class LoadGenerator:
+    """Синтетические пользователи, проходящие сценарий регистрации"""
+
+    def __init__(self, application, api: FakeBotApiRequest):
+        self.application = application
+        self.api = api
+        self.latencies = {step: [] for step in STEPS}
+        self.completed = 0
+        self.failed = 0
+        self._update_id = 0
+
+    def _update(self, payload: dict) -> Update:
+        self._update_id += 1
+        return Update.de_json(dict(payload, update_id=self._update_id), self.application.bot)
+
+    async def _send(self, step: str, user_id: int, payload: dict, timeout: float) -> dict:
+        waiter = asyncio.get_running_loop().create_future()
+        self.api.replies[user_id] = waiter
+        started = time.perf_counter()
+        await self.application.update_queue.put(self._update(payload))
+        reply = await asyncio.wait_for(waiter, timeout)
+        self.latencies[step].append(time.perf_counter() - started)
+        return reply
+
+    async def run_user(self, user_id: int, timeout: float):
+        sender = {'id': user_id, 'is_bot': False, 'first_name': f"Имя{user_id}"}
+        chat = {'id': user_id, 'type': 'private'}
+        message = {'date': int(time.time()), 'chat': chat, 'from': sender}
+        try:
+            await self._send('start', user_id, {'message': dict(
+                message, message_id=1, text='/start', entities=[{'type': 'bot_command', 'offset': 0, 'length': 6}]
+            )}, timeout)
+            await self._send('contact', user_id, {'message': dict(
+                message, message_id=2,
+                contact={'phone_number': f"+7900{user_id:07d}", 'first_name': f"Имя{user_id}", 'user_id': user_id}
+            )}, timeout)
+            reply = await self._send('request', user_id, {'message': dict(
+                message, message_id=3, text=f"Нужна консультация по бизнесу, пользователь {user_id}"
+            )}, timeout)
+            await self._send('finish', user_id, {'callback_query': {
+                'id': str(user_id), 'from': sender, 'chat_instance': str(user_id), 'data': 'finish',
+                'message': dict(reply, **{'from': {'id': 123456, 'is_bot': True, 'first_name': 'Bench'}}),
+            }}, timeout)
+            self.completed += 1
+        except asyncio.TimeoutError:
+            self.failed += 1
+
+def percentiles(values) -> dict:
+    if not values:
+        return {}
+    if len(values) == 1:
+        values = values * 2
+    cuts = statistics.quantiles(values, n=100, method='inclusive')
+    return {'p50': round(cuts[49] * 1000, 3), 'p95': round(cuts[94] * 1000, 3), 'p99': round(cuts[98] * 1000, 3)}
+
+async def run_load(args) -> dict:
+    import simple_bot
+    from metrics import DB_QUERY_SECONDS
+
+    simple_bot.startup()
+    api = FakeBotApiRequest(latency=args.api_latency)
+    application = simple_bot.build_application(BENCH_TOKEN, request=api, get_updates_request=FakeBotApiRequest())
+    generator = LoadGenerator(application, api)
+    writes = [DB_QUERY_SECONDS.labels(query) for query in ('add_user', 'update_user_request')]
+    writes_before = sum(sum(child.counts) for child in writes)
+    rng = random.Random(args.seed)
+
+    await application.initialize()
+    await application.start()
+    started = time.perf_counter()
+    users = []
+    for index in range(args.users):
+        users.append(asyncio.create_task(generator.run_user(1_000_000 + index, args.timeout)))
+        # Пуассоновский поток прихода пользователей
+        await asyncio.sleep(rng.expovariate(args.rate))
+    await asyncio.gather(*users)
+    elapsed = time.perf_counter() - started
+    await application.stop()
+    await application.shutdown()
+
+    db_writes = sum(sum(child.counts) for child in writes) - writes_before
+    all_latencies = [value for step in STEPS for value in generator.latencies[step]]
+    return {
+        'users': args.users,
+        'arrival_rate': args.rate,
+        'api_latency': args.api_latency,
+        'completed': generator.completed,
+        'failed': generator.failed,
+        'seconds': round(elapsed, 3),
+        'registrations_per_second': round(generator.completed / elapsed, 2),
+        'db_writes_per_second': round(db_writes / elapsed, 2),
+        'api_calls': api.calls,
+        'reply_latency_ms': percentiles(all_latencies),
+        'reply_latency_ms_by_step': {step: percentiles(generator.latencies[step]) for step in STEPS},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота")
+    parser.add_argument('--users', type=int, default=500, help="число синтетических пользователей")
+    parser.add_argument('--rate', type=float, default=50.0, help="пользователей в секунду (средняя интенсивность)")
+    parser.add_argument('--api-latency', type=float, default=0.0, help="задержка ответа Bot API, секунды")
+    parser.add_argument('--timeout', type=float, default=30.0, help="ожидание ответа бота, секунды")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="файл для JSON-результатов")
+    args = parser.parse_args()
+
+    # База создается в simple_bot.startup() в текущем каталоге - работаем во временном.
+    # Пустые значения не дают load_dotenv подставить настройки из .env
+    output = os.path.abspath(args.output) if args.output else None
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="naumovado_load_") as tmp_dir:
+        os.chdir(tmp_dir)
+        os.environ['BOT_TOKEN'] = BENCH_TOKEN
+        os.environ['ADMINS'] = ''
+        os.environ['BACKUPTO'] = ''
+        # Логи и отладочный вывод обработчиков мешают читать результаты
+        logging.disable(logging.INFO)
+        print(f"⏱  {args.users} пользователей, {args.rate:g}/с...", file=sys.stderr)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            result = asyncio.run(run_load(args))
+        os.chdir(cwd)
+
+    report = json.dumps(dict({'benchmark': 'bot_load'}, **result), ensure_ascii=False, indent=2)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(report)
+    print(report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк методов Database на базах реалистичного размера
+
+Для каждого размера создает базу той же схемы, что и naumovado.db (через
+Database.init_database), заполняет ее пользователями с запросами и датами
+регистрации за последний год и замеряет:
+  add_user, update_user_request, get_user         - по одной операции, p50/p95/p99
+  get_all_users, get_today_registrations          - полная выборка
+  export_all, export_range                        - выборка для выгрузки (iter_users)
+  find_phone, find_name                           - поиск /find по телефону и фамилии
+  upgrade_seconds                                 - перевод базы на текущую схему (E.164, ключи поиска)
+  concurrent                                      - смешанная нагрузка из нескольких потоков
+
+Результаты выводятся в JSON вместе с коммитом, чтобы сравнивать прогоны.
+
+Использование:
+  python bench_db.py                                  - размеры 10000,100000,1000000
+  python bench_db.py --sizes 10000 --threads 8 --output db_bench.json
+  python bench_db.py --sizes 10000 --compare db_bench.json   - сравнить p50 с прошлым прогоном
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import platform
+import threading
+import statistics
+import subprocess
+import contextlib
+from datetime import datetime, timedelta
+
+from database import Database
+
+REQUEST_TYPES = ('text', 'text', 'text', 'photo', 'voice', 'video_note')
+
+def seed_users(db_path: str, count: int, rng: random.Random):
+    """Заполнение базы пользователями, зарегистрированными за последний год"""
+    now = datetime.utcnow()
+
+    def rows():
+        for i in range(count):
+            registered = now - timedelta(seconds=rng.randrange(365 * 24 * 3600))
+            request_type = rng.choice(REQUEST_TYPES)
+            # Телефон в национальном формате, как до нормализации - его переводит Database._upgrade
+            yield (1_000_000 + i, f"Имя{i}", f"Фамилия{i}", f"8900{i:07d}",
+                   registered.strftime('%Y-%m-%d %H:%M:%S'),
+                   f"Текст: запрос номер {i} " + "о развитии бизнеса " * rng.randrange(1, 8),
+                   request_type, None if request_type == 'text' else f"file_{i}")
+
+    with sqlite3.connect(db_path) as conn:
+        conn.executemany('''
+            INSERT INTO users (telegram_id, first_name, last_name, phone, registration_timestamp,
+                               request, request_type, file_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows())
+        conn.commit()
+        # Переносим данные из WAL в файл базы - как у давно работающего бота
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+def summarize(latencies) -> dict:
+    """Сводка по длительностям отдельных операций, миллисекунды"""
+    if len(latencies) < 2:
+        latencies = list(latencies) * 2
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+    total = sum(latencies)
+    return {
+        'ops': len(latencies),
+        'ops_per_second': round(len(latencies) / total, 1) if total else None,
+        'p50_ms': round(cuts[49] * 1000, 4),
+        'p95_ms': round(cuts[94] * 1000, 4),
+        'p99_ms': round(cuts[98] * 1000, 4),
+        'max_ms': round(max(latencies) * 1000, 4),
+    }
+
+def timed(func, repeat: int) -> list:
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+def run_concurrent(db: Database, count: int, threads: int, ops_per_thread: int, seed: int) -> dict:
+    """Смешанная нагрузка бота: регистрация, запрос и чтение из нескольких потоков"""
+    latencies = {'add_user': [], 'update_user_request': [], 'get_user': []}
+    failures = []
+    lock = threading.Lock()
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        local = {name: [] for name in latencies}
+        failed = 0
+        for op in range(ops_per_thread):
+            new_id = 50_000_000 + index * ops_per_thread + op
+            for name, call in (
+                ('add_user', lambda: db.add_user(new_id, "Имя", "Фамилия", "+79000000000")),
+                ('update_user_request', lambda: db.update_user_request(new_id, "Текст: запрос", "text")),
+                ('get_user', lambda: db.get_user(1_000_000 + rng.randrange(count))),
+            ):
+                started = time.perf_counter()
+                ok = call()
+                local[name].append(time.perf_counter() - started)
+                failed += not ok
+        with lock:
+            for name, values in local.items():
+                latencies[name].extend(values)
+            failures.append(failed)
+
+    workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    total_ops = sum(len(values) for values in latencies.values())
+    return {
+        'threads': threads,
+        'seconds': round(elapsed, 3),
+        'ops_per_second': round(total_ops / elapsed, 1),
+        'failed_ops': sum(failures),
+        'operations': {name: summarize(values) for name, values in latencies.items()},
+    }
+
+def run_size(count: int, args) -> dict:
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory(prefix="naumovado_bench_") as tmp_dir:
+        db = Database(os.path.join(tmp_dir, "naumovado.db"))
+        started = time.perf_counter()
+        seed_users(db.db_path, count, rng)
+        seed_seconds = time.perf_counter() - started
+        # Заполненная база - как база предыдущей версии: перевод на текущую схему при открытии
+        with sqlite3.connect(db.db_path) as conn:
+            conn.execute('PRAGMA user_version = 0')
+        started = time.perf_counter()
+        db = Database(db.db_path)
+        upgrade_seconds = time.perf_counter() - started
+        # Очередь синхронизации после заполнения не нужна
+        db.delete_outbox_entries()
+        result = {'users': count, 'seed_seconds': round(seed_seconds, 2),
+                  'upgrade_seconds': round(upgrade_seconds, 2), 'db_size': os.path.getsize(db.db_path)}
+
+        existing = [1_000_000 + rng.randrange(count) for _ in range(args.ops)]
+        new_ids = iter(range(10_000_000, 10_000_000 + args.ops))
+        ids = iter(existing)
+        scan_repeat = max(1, min(args.scan_repeat, 2_000_000 // count))
+        date_to = datetime.utcnow().date()
+        date_from = date_to - timedelta(days=30)
+
+        operations = {
+            'add_user': timed(lambda: db.add_user(next(new_ids), "Имя", "Фамилия", "+79000000000"), args.ops),
+            'update_user_request': timed(lambda: db.update_user_request(next(ids), "Текст: новый запрос", "text"),
+                                         args.ops),
+            'get_user': timed(lambda: db.get_user(rng.choice(existing)), args.ops),
+            'get_all_users': timed(db.get_all_users, scan_repeat),
+            'get_today_registrations': timed(db.get_today_registrations, args.ops // 10 or 1),
+            'find_phone': timed(lambda: db.find_users(f"+7900{rng.randrange(count):07d}"), args.ops),
+            'find_name': timed(lambda: db.find_users(f"Фамилия{rng.randrange(count)}"), args.ops),
+            'export_all': timed(lambda: sum(1 for _ in db.iter_users()), scan_repeat),
+            'export_range': timed(lambda: sum(1 for _ in db.iter_users(date_from.isoformat(), date_to.isoformat())),
+                                  scan_repeat),
+        }
+        result['single_thread'] = {name: summarize(values) for name, values in operations.items()}
+        result['concurrent'] = run_concurrent(db, count, args.threads, args.ops // args.threads or 1, args.seed)
+        return result
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except Exception:
+        return None
+
+def compare(previous: dict, current: dict):
+    """Печать изменения p50 относительно прошлого прогона (в stderr)"""
+    old_results = {result['users']: result for result in previous['results']}
+    print(f"📊 Сравнение с {previous.get('commit')} ({previous.get('created_at')}), p50 мс:", file=sys.stderr)
+    for result in current['results']:
+        old = old_results.get(result['users'])
+        if not old:
+            continue
+        for name, stats in result['single_thread'].items():
+            old_stats = old['single_thread'].get(name)
+            if old_stats:
+                change = (stats['p50_ms'] / old_stats['p50_ms'] - 1) * 100 if old_stats['p50_ms'] else 0
+                print(f"  {result['users']:>8} {name:24} {old_stats['p50_ms']:>10.3f} -> {stats['p50_ms']:>10.3f} "
+                      f"({change:+.0f}%)", file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк методов Database")
+    parser.add_argument('--sizes', default='10000,100000,1000000', help="размеры базы через запятую")
+    parser.add_argument('--ops', type=int, default=1000, help="число точечных операций каждого вида")
+    parser.add_argument('--scan-repeat', type=int, default=5, help="повторы полных выборок")
+    parser.add_argument('--threads', type=int, default=4, help="потоков в конкурентном замере")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="файл для JSON-результатов")
+    parser.add_argument('--compare', help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    results = []
+    for count in [int(size) for size in args.sizes.split(',') if size]:
+        print(f"⏱  {count} пользователей...", file=sys.stderr)
+        # Отладочный вывод методов Database мешает читать результаты
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            results.append(run_size(count, args))
+
+    report = {
+        'benchmark': 'database',
+        'commit': git_commit(),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'ops': args.ops,
+        'results': results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    print(text)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(json.load(f), report)
+
+if __name__ == "__main__":
+    main()
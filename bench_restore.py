@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк восстановления базы из резервной копии
+
+Создает базу заданного размера, сжимает ее так же, как BackupService,
+записывает копию в каталог и восстанавливает через restore_backup.restore
+с замером этапов (проверка архива, распаковка, integrity_check, подмена).
+
+Использование:
+  python bench_restore.py                            - база ~300 МБ
+  python bench_restore.py --size-mb 500 --output result.json
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import tempfile
+from datetime import datetime
+
+from backup_catalog import BackupCatalog
+from backup_service import BackupService
+from restore_backup import restore
+
+# Размер одной синтетической записи - примерно как пользователь с длинным запросом
+ROW_PAYLOAD = 900
+
+def seed_database(db_path, size_mb):
+    """Заполнение базы синтетическими пользователями до нужного размера"""
+    rows_needed = size_mb * 1024 * 1024 // (ROW_PAYLOAD + 100)
+    with sqlite3.connect(db_path) as conn:
+        conn.execute('''
+            CREATE TABLE users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                telegram_id INTEGER UNIQUE NOT NULL,
+                first_name TEXT,
+                phone TEXT,
+                request TEXT
+            )
+        ''')
+        conn.executemany(
+            'INSERT INTO users (telegram_id, first_name, phone, request) VALUES (?, ?, ?, ?)',
+            ((1_000_000 + i, f"Имя{i}", f"+7900{i:07d}", os.urandom(ROW_PAYLOAD // 2).hex())
+             for i in range(rows_needed))
+        )
+        conn.commit()
+    return rows_needed
+
+def make_archive(db_path, archive_dir):
+    """Сжатие базы тем же компрессором, что и при отправке копии"""
+    service = BackupService(None, None, db_path)
+    compressor, extension = service._get_compressor()
+    archive_path = os.path.join(archive_dir, f"bench_backup.db.{extension}")
+    stats = {'original_size': 0, 'compressed_size': 0}
+    digests = {'source': hashlib.sha256(), 'archive': hashlib.sha256()}
+    with open(archive_path, 'wb') as archive:
+        for chunk in service._iter_compressed(db_path, compressor, stats, digests):
+            archive.write(chunk)
+    return archive_path, stats, digests
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк восстановления из резервной копии")
+    parser.add_argument('--size-mb', type=int, default=300, help="размер базы, МБ")
+    parser.add_argument('--output', help="файл для JSON-результатов")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="naumovado_bench_") as tmp_dir:
+        source_path = os.path.join(tmp_dir, "source.db")
+        print(f"⏱  Создание базы ~{args.size_mb} МБ...", file=sys.stderr)
+        rows = seed_database(source_path, args.size_mb)
+
+        started = time.perf_counter()
+        archive_path, stats, digests = make_archive(source_path, tmp_dir)
+        compress_seconds = time.perf_counter() - started
+
+        catalog = BackupCatalog(os.path.join(tmp_dir, "backup_catalog.db"))
+        entry_id = catalog.add(
+            datetime.now(), 'full', os.path.basename(archive_path), digests['archive'].hexdigest(),
+            digests['source'].hexdigest(), original_size=stats['original_size'],
+            compressed_size=stats['compressed_size']
+        )
+
+        # Восстанавливаем поверх существующей базы, как при реальном откате
+        target_path = os.path.join(tmp_dir, "naumovado.db")
+        with sqlite3.connect(target_path) as conn:
+            conn.execute('CREATE TABLE users (id INTEGER PRIMARY KEY)')
+
+        print("⏱  Восстановление...", file=sys.stderr)
+        timings = restore(catalog, catalog.get(entry_id), target_path, local_files=[archive_path])
+
+    report = json.dumps({
+        'benchmark': 'restore',
+        'rows': rows,
+        'original_size': stats['original_size'],
+        'compressed_size': stats['compressed_size'],
+        'compress_seconds': round(compress_seconds, 3),
+        'restore_seconds': {stage: round(value, 3) for stage, value in timings.items()},
+        'restore_mb_per_second': round(stats['original_size'] / 1024 / 1024 / timings['total'], 1),
+    }, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report)
+    print(report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк экспорта в Google Sheets на локальной замене API
+
+Для каждого размера базы измеряет время и число вызовов API:
+  full_export    - первый экспорт в пустую таблицу (export_users_to_sheets)
+  repeat_export  - повторный экспорт без новых пользователей
+  outbox_sync    - синхронизация изменений 1% пользователей через outbox
+
+Использование:
+  python bench_sheets_export.py                       - размеры 1000,10000,100000
+  python bench_sheets_export.py --sizes 1000 --latency 0.05 --output result.json
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import tempfile
+import logging
+
+from database import Database
+from fake_sheets_server import FakeSheetsServer
+from google_sheets_service import GoogleSheetsService
+from sheets_sync import SheetsSyncService
+
+def seed_users(db_path: str, count: int):
+    """Заполнение базы синтетическими пользователями"""
+    rows = (
+        (1_000_000 + i, f"Имя{i}", f"Фамилия{i}", f"+7900{i:07d}",
+         f"Текст: запрос номер {i}", "text", None)
+        for i in range(count)
+    )
+    with sqlite3.connect(db_path) as conn:
+        conn.executemany('''
+            INSERT INTO users (telegram_id, first_name, last_name, phone, request, request_type, file_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        conn.commit()
+
+def measure(server: FakeSheetsServer, func) -> dict:
+    """Время выполнения func и вызовы API, сделанные за это время"""
+    server.reset_counters()
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    return {
+        'ok': bool(result),
+        'seconds': round(elapsed, 4),
+        'api_calls': dict(server.calls),
+        'api_calls_total': sum(server.calls.values()),
+        'injected_errors': {str(code): count for code, count in server.errors.items()},
+    }
+
+def run_size(count: int, args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp_dir, \
+            FakeSheetsServer(latency=args.latency, error_rate=args.error_rate, seed=42) as server:
+        os.environ['GoogleSheetsID'] = f"bench-{count}"
+        db = Database(os.path.join(tmp_dir, "bench.db"))
+        seed_users(db.db_path, count)
+        # Сиды не должны попадать в замер синхронизации
+        db.delete_outbox_entries()
+
+        sheets = GoogleSheetsService(api_endpoint=server.url)
+        result = {'users': count}
+        result['full_export'] = measure(server, lambda: sheets.export_users_to_sheets(db.get_all_users()))
+        result['repeat_export'] = measure(server, lambda: sheets.export_users_to_sheets(db.get_all_users()))
+
+        changed = max(1, count // 100)
+        with sqlite3.connect(db.db_path) as conn:
+            conn.execute("UPDATE users SET request = request || ' (изменен)' WHERE id <= ?", (changed,))
+            conn.commit()
+
+        sync = SheetsSyncService(db, interval=1, batch_size=args.batch_size)
+        sync.sheets_service = GoogleSheetsService(api_endpoint=server.url)
+
+        def drain():
+            while sync.sync_once():
+                pass
+            return not db.get_outbox_batch(1)
+
+        result['outbox_sync'] = measure(server, drain)
+        result['outbox_sync']['changed_users'] = changed
+        return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк экспорта в Google Sheets")
+    parser.add_argument('--sizes', default='1000,10000,100000', help="размеры базы через запятую")
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка ответа API, секунды")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="доля ответов 429/500")
+    parser.add_argument('--batch-size', type=int, default=500, help="размер пачки outbox")
+    parser.add_argument('--output', help="файл для JSON-результатов")
+    args = parser.parse_args()
+
+    # Логи сервисов мешают читать результаты
+    logging.disable(logging.INFO)
+
+    results = []
+    for count in [int(size) for size in args.sizes.split(',') if size]:
+        print(f"⏱  {count} пользователей...", file=sys.stderr)
+        results.append(run_size(count, args))
+
+    report = json.dumps({'benchmark': 'sheets_export', 'latency': args.latency,
+                         'error_rate': args.error_rate, 'results': results},
+                        ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report)
+    print(report)
+
+if __name__ == "__main__":
+    main()
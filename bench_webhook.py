@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Пропускная способность режима webhook в зависимости от числа процессов
+
+Для каждого значения --workers запускается webhook_supervisor.py против
+локальной замены Bot API, на webhook отправляются обновления /start от
+--users разных пользователей (--connections параллельных соединений) и
+замеряется время до ответа бота каждому из них.
+
+Использование:
+  python bench_webhook.py --workers 1,2,4 --users 2000
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from check_startup import BOT_DIR, bot_env
+
+class FakeBotApi(BaseHTTPRequestHandler):
+    """Замена Bot API: отвечает на вызовы и считает сообщения бота пользователям"""
+
+    protocol_version = 'HTTP/1.1'
+    # Заголовки и тело уходят отдельными записями - без этого ответы ждут подтверждения TCP
+    disable_nagle_algorithm = True
+    lock = threading.Lock()
+    get_me = 0
+    replied = set()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode()
+        api_method = self.path.rsplit('/', 1)[-1]
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            params = json.loads(body or '{}')
+        else:
+            params = {key: values[0] for key, values in parse_qs(body).items()}
+        if api_method == 'getMe':
+            with FakeBotApi.lock:
+                FakeBotApi.get_me += 1
+            result = {'id': 123456, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        elif 'chat_id' in params:
+            chat_id = int(params['chat_id'])
+            with FakeBotApi.lock:
+                FakeBotApi.replied.add(chat_id)
+            result = {'message_id': 1, 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'private'},
+                      'text': params.get('text', '')}
+        else:
+            result = True
+        response = json.dumps({'ok': True, 'result': result}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_update(update_id: int, user_id: int) -> bytes:
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}
+    return json.dumps({'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': int(time.time()), 'chat': {'id': user_id, 'type': 'private'},
+        'from': user, 'text': '/start', 'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}]
+    }}).encode()
+
+def post_updates(port: int, updates: list):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    for body in updates:
+        connection.request('POST', '/telegram', body, {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError(f"webhook ответил {response.status}")
+    connection.close()
+
+def run(workers: int, users: int, connections: int, api_url: str, timeout: float) -> dict:
+    FakeBotApi.get_me = 0
+    FakeBotApi.replied = set()
+    port = free_port()
+    with tempfile.TemporaryDirectory(prefix="naumovado_webhook_") as work_dir:
+        env = bot_env(BOT_API_BASE_URL=api_url, WEBHOOK_WORKERS=str(workers), WEBHOOK_PORT=str(port),
+                      WEBHOOK_URL='', WEBHOOK_SECRET='', LOG_LEVEL='WARNING',
+                      DB_PATH=os.path.join(work_dir, 'bench.db'))
+        process = subprocess.Popen([sys.executable, os.path.join(BOT_DIR, 'webhook_supervisor.py')],
+                                   cwd=work_dir, env=env)
+        try:
+            deadline = time.monotonic() + timeout
+            while FakeBotApi.get_me < workers:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("процессы-обработчики не запустились")
+                time.sleep(0.05)
+            time.sleep(0.5)
+
+            user_ids = list(range(10_000_000, 10_000_000 + users))
+            chunks = [[start_update(i + 1, user_id) for i, user_id in enumerate(user_ids)][n::connections]
+                      for n in range(connections)]
+            started = time.perf_counter()
+            senders = [threading.Thread(target=post_updates, args=(port, chunk)) for chunk in chunks]
+            for sender in senders:
+                sender.start()
+            for sender in senders:
+                sender.join()
+            accepted = time.perf_counter() - started
+            while len(FakeBotApi.replied) < users:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"ответов {len(FakeBotApi.replied)} из {users} за {timeout:g} с")
+                time.sleep(0.01)
+            elapsed = time.perf_counter() - started
+        finally:
+            process.terminate()
+            process.wait(timeout=60)
+    return {'workers': workers, 'users': users, 'accepted_seconds': accepted, 'seconds': elapsed,
+            'updates_per_second': users / elapsed}
+
+def main():
+    parser = argparse.ArgumentParser(description="Пропускная способность webhook по числу процессов")
+    parser.add_argument('--workers', default='1,2', help="числа процессов через запятую")
+    parser.add_argument('--users', type=int, default=1000, help="обновлений /start (разных пользователей)")
+    parser.add_argument('--connections', type=int, default=8, help="параллельных соединений к webhook")
+    parser.add_argument('--timeout', type=float, default=300.0, help="ограничение одного прогона, секунды")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeBotApi)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = f"http://127.0.0.1:{server.server_port}/bot"
+
+    print(f"Ядер: {os.cpu_count()}")
+    baseline = None
+    for workers in (int(value) for value in args.workers.split(',')):
+        result = run(workers, args.users, args.connections, api_url, args.timeout)
+        baseline = baseline or result['updates_per_second']
+        print(f"Процессов {workers}: {result['updates_per_second']:.0f} обновлений/с "
+              f"(x{result['updates_per_second'] / baseline:.2f}), прием {result['accepted_seconds']:.2f} с, "
+              f"всего {result['seconds']:.2f} с")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -4,15 +4,18 @@
 """
 
 import os
-import schedule
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from backup_service import BackupService
+from logging_setup import setup_logging
+from backup_service import BackupService, DB_PATH
 
 # Загрузка переменных окружения
 load_dotenv()
 
+# Сообщения сервиса резервных копий идут в лог
+setup_logging()
+
 def check_time():
     """Проверка текущего времени"""
     now = datetime.now()
@@ -20,20 +23,13 @@ def check_time():
     print(f"📅 День недели: {now.strftime('%A')}")
     print(f"🌍 Часовой пояс: {time.tzname[0] if time.daylight == 0 else time.tzname[1]}")
     
-    # Проверяем, близко ли время к 21:00
-    target_hour = 21
-    current_hour = now.hour
-    current_minute = now.minute
-    
-    if current_hour == target_hour:
-        print(f"✅ Сейчас время резервного копирования (21:00)!")
-    elif current_hour == target_hour - 1 and current_minute >= 55:
-        print(f"⏰ До резервного копирования осталось {60 - current_minute} минут")
-    elif current_hour == target_hour + 1 and current_minute <= 5:
-        print(f"⏰ Резервное копирование было {current_minute} минут назад")
-    else:
-        hours_until = (target_hour - current_hour) % 24
-        print(f"⏰ До резервного копирования осталось примерно {hours_until} часов")
+    # Расписание берется из BACKUP_SCHEDULE, как и в боте
+    backup_service = BackupService(os.getenv('BOT_TOKEN'), os.getenv('BACKUPTO'), DB_PATH)
+    next_run = backup_service.next_run_time()
+    until = next_run - now.astimezone()
+    print(f"📋 Расписание резервного копирования: {backup_service.schedule_expression}")
+    print(f"⏰ Следующее резервное копирование: {next_run.strftime('%d.%m.%Y %H:%M')} "
+          f"(через {until.seconds // 3600 + until.days * 24} ч {until.seconds % 3600 // 60} мин)")
 
 def test_scheduler():
     """Тестирование планировщика"""
@@ -52,24 +48,16 @@ def test_scheduler():
     print(f"📱 ID для резервных копий: {backup_to}")
     
     # Создаем сервис резервных копий
-    backup_service = BackupService(bot_token, backup_to)
+    backup_service = BackupService(bot_token, backup_to, DB_PATH)
     
     # Планируем задачу на 1 минуту вперед для тестирования
-    test_time = datetime.now().replace(second=0, microsecond=0)
-    test_time = test_time.replace(minute=test_time.minute + 1)
+    test_time = (datetime.now() + timedelta(minutes=1)).replace(second=0, microsecond=0)
     
     print(f"⏰ Планируем тестовую отправку на {test_time.strftime('%H:%M')}")
     
-    # Планируем тестовую задачу
-    schedule.every().day.at(test_time.strftime("%H:%M")).do(backup_service.send_backup)
-    
-    # Запускаем планировщик на 2 минуты
-    print("🔄 Запускаем планировщик на 2 минуты...")
-    start_time = time.time()
-    
-    while time.time() - start_time < 120:  # 2 минуты
-        schedule.run_pending()
-        time.sleep(1)
+    # Ждем назначенного времени и отправляем полную копию
+    time.sleep(max(0, (test_time - datetime.now()).total_seconds()))
+    backup_service.send_backup()
     
     print("✅ Тест планировщика завершен")
 
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Проверка скорости запуска бота
+
+1. Импорт simple_bot (python -X importtime): время импорта в пределах бюджета,
+   тяжелые подсистемы (клиент Google API, HTTP-клиент резервных копий, модули
+   журнала событий и команд выгрузки/статистики) не загружаются, а база данных не создается - это делает startup().
+2. Холодный запуск: simple_bot.py запускается отдельным процессом против
+   локальной замены Bot API, замеряется время до первого getUpdates.
+
+Каждый замер повторяется --runs раз, с бюджетом сравнивается медиана.
+Код возврата 1, если бюджет превышен.
+
+Использование:
+  python check_startup.py
+  python check_startup.py --import-budget-ms 700 --start-budget-ms 2000 --runs 5
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+CHECK_TOKEN = "123456:startup"
+
+# Модули, которые не должны загружаться при запуске бота
+LAZY_MODULES = ('googleapiclient', 'google.oauth2', 'requests', 'backup_service', 'google_sheets_service',
+                'asyncpg', 'postgres_storage', 'event_journal', 'file_export', 'media_export', 'registration_stats')
+
+def bot_env(**extra) -> dict:
+    # Пустые значения не дают load_dotenv подставить настройки из .env
+    env = dict(os.environ, BOT_TOKEN=CHECK_TOKEN, ADMINS='', BACKUPTO='', GoogleSheetsID='',
+               METRICS_PORT='', PYTHONPATH=BOT_DIR, PYTHONDONTWRITEBYTECODE='1')
+    env.update(extra)
+    return env
+
+def measure_import(work_dir: str) -> dict:
+    """Импорт simple_bot в отдельном процессе: время (мкс из -X importtime) и загруженные модули"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import simple_bot'],
+                            cwd=work_dir, env=bot_env(), capture_output=True, text=True, check=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = int(cumulative)
+    return {
+        'import_ms': modules['simple_bot'] / 1000,
+        'lazy_loaded': sorted(name for name in modules
+                              if any(name == lazy or name.startswith(lazy + '.') for lazy in LAZY_MODULES)),
+        'db_created': os.path.exists(os.path.join(work_dir, 'naumovado.db')),
+    }
+
+class FakeBotApi(BaseHTTPRequestHandler):
+    """Замена Bot API: отмечает время первого getUpdates"""
+
+    first_get_updates = None
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        api_method = self.path.rsplit('/', 1)[-1]
+        if api_method == 'getMe':
+            result = {'id': 123456, 'is_bot': True, 'first_name': 'Startup', 'username': 'startup_bot'}
+        elif api_method == 'getUpdates':
+            if FakeBotApi.first_get_updates is None:
+                FakeBotApi.first_get_updates = time.perf_counter()
+            time.sleep(0.2)
+            result = []
+        else:
+            result = True
+        body = json.dumps({'ok': True, 'result': result}).encode()
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # Бот остановлен во время длинного опроса
+            pass
+
+    do_GET = do_POST
+
+    def log_message(self, format, *args):
+        pass
+
+def measure_cold_start(work_dir: str, api_url: str, timeout: float) -> float:
+    """Время от запуска процесса бота до первого getUpdates, миллисекунды"""
+    FakeBotApi.first_get_updates = None
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(BOT_DIR, 'simple_bot.py')], cwd=work_dir,
+                               env=bot_env(BOT_API_BASE_URL=api_url), stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    try:
+        while FakeBotApi.first_get_updates is None:
+            if process.poll() is not None:
+                raise RuntimeError(f"Бот завершился с кодом {process.returncode} до первого getUpdates")
+            if time.perf_counter() - started > timeout:
+                raise RuntimeError(f"Нет getUpdates за {timeout:g} с")
+            time.sleep(0.005)
+        return (FakeBotApi.first_get_updates - started) * 1000
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка скорости запуска бота")
+    # Почти все время импорта - python-telegram-bot (~250-430 мс в зависимости от машины и кэша ФС);
+    # бюджет с запасом над этим разбросом, чтобы проверка ловила новые тяжелые импорты, а не шум
+    parser.add_argument('--import-budget-ms', type=float, default=float(os.getenv('STARTUP_IMPORT_BUDGET_MS', '550')),
+                        help="бюджет импорта simple_bot, мс")
+    parser.add_argument('--start-budget-ms', type=float, default=float(os.getenv('STARTUP_BUDGET_MS', '1500')),
+                        help="бюджет от запуска процесса до первого getUpdates, мс")
+    parser.add_argument('--runs', type=int, default=3, help="повторов каждого замера")
+    parser.add_argument('--timeout', type=float, default=30.0, help="ожидание первого getUpdates, секунды")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeBotApi)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = f"http://127.0.0.1:{server.server_port}/bot"
+
+    imports, starts = [], []
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory(prefix="naumovado_startup_") as work_dir:
+            imports.append(measure_import(work_dir))
+        with tempfile.TemporaryDirectory(prefix="naumovado_startup_") as work_dir:
+            starts.append(measure_cold_start(work_dir, api_url, args.timeout))
+    server.shutdown()
+
+    import_ms = statistics.median(run['import_ms'] for run in imports)
+    start_ms = statistics.median(starts)
+    lazy_loaded = sorted({name for run in imports for name in run['lazy_loaded']})
+    db_created = any(run['db_created'] for run in imports)
+
+    failures = []
+    print(f"📦 Импорт simple_bot: {import_ms:.0f} мс (бюджет {args.import_budget_ms:g} мс)")
+    if import_ms > args.import_budget_ms:
+        failures.append("импорт дольше бюджета")
+    if lazy_loaded:
+        print(f"   загружены при импорте: {', '.join(lazy_loaded)}")
+        failures.append("тяжелые модули загружаются при импорте")
+    if db_created:
+        failures.append("импорт создает базу данных")
+    print(f"🚀 До первого getUpdates: {start_ms:.0f} мс (бюджет {args.start_budget_ms:g} мс), "
+          f"замеры: {', '.join(f'{value:.0f}' for value in starts)}")
+    if start_ms > args.start_budget_ms:
+        failures.append("запуск дольше бюджета")
+
+    if failures:
+        print(f"❌ {'; '.join(failures)}")
+        sys.exit(1)
+    print("✅ Запуск в пределах бюджета")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Хранение состояний разговоров бота в общем хранилище
+
+Состояние разговора регистрации (ждем контакт / ждем запрос) по умолчанию
+живет в памяти процесса. Чтобы его видели все процессы бота (режим
+webhook_supervisor.py) и чтобы оно переживало перезапуск, состояния пишутся
+в таблицу conversations хранилища (SQLite или PostgreSQL, см. storage.py).
+
+Сохраняются только разговоры: user_data, chat_data и bot_data бот не читает.
+Application записывает изменившиеся состояния раз в PERSISTENCE_INTERVAL
+секунд и при остановке.
+"""
+import os
+import asyncio
+from telegram.ext import BasePersistence, PersistenceInput
+
+from storage import Storage
+
+PERSISTENCE_INTERVAL = float(os.getenv('PERSISTENCE_INTERVAL', '1'))
+
+class StoragePersistence(BasePersistence):
+    """Состояния разговоров в хранилище бота"""
+
+    def __init__(self, db: Storage, update_interval: float = None):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=False, callback_data=False),
+            update_interval=update_interval if update_interval is not None else PERSISTENCE_INTERVAL
+        )
+        self.db = db
+
+    async def get_conversations(self, name: str) -> dict:
+        return await asyncio.to_thread(self.db.get_conversations, name)
+
+    async def update_conversation(self, name: str, key: tuple, new_state) -> None:
+        await asyncio.to_thread(self.db.update_conversation, name, key, new_state)
+
+    # Остальные данные не сохраняются (store_data), Application их не запрашивает
+
+    async def get_user_data(self) -> dict:
+        return {}
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_user_data(self, user_id: int, data) -> None:
+        pass
+
+    async def update_chat_data(self, chat_id: int, data) -> None:
+        pass
+
+    async def update_bot_data(self, data) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data) -> None:
+        pass
+
+    async def flush(self) -> None:
+        pass
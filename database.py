@@ -1,9 +1,36 @@
 import sqlite3
 import os
+import json
+import time
+import logging
 from datetime import datetime
-from typing import Optional, List, Tuple
+from typing import Optional, Dict, List, Tuple, Iterator, Iterable, Sequence
 
-class Database:
+from metrics import DB_QUERY_SECONDS
+from storage import Storage
+from user_search import normalize_phone, name_keys, parse_query, PREFIX_END, MAX_NAME_KEYS
+
+logger = logging.getLogger(__name__)
+
+# Версия схемы (PRAGMA user_version): 1 - телефоны в E.164 и ключи поиска по имени,
+# 2 - сводная таблица регистраций registration_stats
+SCHEMA_VERSION = 2
+
+# События users, по которым триггеры ведут счетчик изменений (см. create_user_triggers)
+USER_TRIGGER_EVENTS = ('INSERT', 'UPDATE', 'DELETE')
+USER_TRIGGERS = ('users_outbox_insert', 'users_outbox_update') + tuple(
+    f'users_{kind}_{event.lower()}' for kind in ('changes', 'stats') for event in USER_TRIGGER_EVENTS
+)
+
+# Пересчет сводной таблицы регистраций по users
+BACKFILL_STATS = '''
+    INSERT INTO registration_stats (day, request_type, users)
+    SELECT date(registration_timestamp), COALESCE(request_type, ''), COUNT(*) FROM users GROUP BY 1, 2
+'''
+
+class Database(Storage):
+    """Хранилище в файле SQLite (по умолчанию, см. storage.py)"""
+    
     def __init__(self, db_path: str = "naumovado.db"):
         self.db_path = db_path
         self.init_database()
@@ -12,6 +39,8 @@ class Database:
         """Инициализация базы данных и создание таблиц"""
         with sqlite3.connect(self.db_path) as conn:
             cursor = conn.cursor()
+            # WAL: чтение (в том числе снятие резервной копии) не блокирует запись
+            cursor.execute('PRAGMA journal_mode=WAL')
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS users (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -25,43 +54,288 @@ class Database:
                     file_id TEXT
                 )
             ''')
+            
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_users_registration ON users (registration_timestamp)
+            ''')
+            
+            # Файлы запроса-альбома (несколько фото в одном запросе), первый также в users.file_id
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS request_files (
+                    telegram_id INTEGER NOT NULL,
+                    position INTEGER NOT NULL,
+                    file_id TEXT NOT NULL,
+                    PRIMARY KEY (telegram_id, position)
+                ) WITHOUT ROWID
+            ''')
+            
+            # Архив медиафайлов запросов (см. media_archive.py): путь, размер и время использования (LRU)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS media_files (
+                    file_unique_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    sha256 TEXT,
+                    path TEXT,
+                    size INTEGER,
+                    last_used REAL NOT NULL
+                )
+            ''')
+            # Один файл может прийти с разными file_id
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS media_file_ids (
+                    file_id TEXT PRIMARY KEY,
+                    file_unique_id TEXT NOT NULL
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_media_files_lru ON media_files (status, last_used)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_media_files_path ON media_files (path)')
+            
+            # Поиск /find: телефон (E.164) и ключи имени (см. user_search.py)
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_phone ON users (phone)')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS user_names (
+                    name TEXT NOT NULL,
+                    telegram_id INTEGER NOT NULL,
+                    PRIMARY KEY (name, telegram_id)
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_names_telegram_id ON user_names (telegram_id)')
+            
+            # Очередь изменений для синхронизации с Google Sheets (outbox)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS sheets_outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    telegram_id INTEGER NOT NULL,
+                    operation TEXT NOT NULL,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # Счетчик изменений строк - по нему резервное копирование определяет, менялась ли база
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS change_counter (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    changes INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            cursor.execute('INSERT OR IGNORE INTO change_counter (id, changes) VALUES (1, 0)')
+            
+            # Сводная таблица регистраций по дням и типам запроса (/stats) - ведется триггерами users
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS registration_stats (
+                    day TEXT NOT NULL,
+                    request_type TEXT NOT NULL,
+                    users INTEGER NOT NULL,
+                    PRIMARY KEY (day, request_type)
+                ) WITHOUT ROWID
+            ''')
+            
+            # Служебное состояние бота (отсев повторов обновлений, см. update_dedup.py)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS bot_state (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL
+                )
+            ''')
+            
+            # Состояния разговоров бота - общие для всех процессов (см. conversation_persistence.py)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS conversations (
+                    name TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    PRIMARY KEY (name, key)
+                )
+            ''')
+            self.create_user_triggers(cursor)
             conn.commit()
+            
+            self._upgrade(conn)
+    
+    @staticmethod
+    def create_user_triggers(cursor):
+        """Триггеры users: очередь изменений для Google Sheets, счетчик изменений строк и сводка регистраций"""
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS users_outbox_insert AFTER INSERT ON users
+            BEGIN
+                INSERT INTO sheets_outbox (telegram_id, operation) VALUES (NEW.telegram_id, 'insert');
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS users_outbox_update AFTER UPDATE ON users
+            BEGIN
+                INSERT INTO sheets_outbox (telegram_id, operation) VALUES (NEW.telegram_id, 'update');
+            END
+        ''')
+        for event in USER_TRIGGER_EVENTS:
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS users_changes_{event.lower()} AFTER {event} ON users
+                BEGIN
+                    UPDATE change_counter SET changes = changes + 1 WHERE id = 1;
+                END
+            ''')
+        # Сводка: -1 в строке старого (день, тип), +1 в строке нового
+        remove = '''
+            UPDATE registration_stats SET users = users - 1
+            WHERE day = date(OLD.registration_timestamp) AND request_type = COALESCE(OLD.request_type, '');
+        '''
+        add = '''
+            INSERT INTO registration_stats (day, request_type, users)
+            VALUES (date(NEW.registration_timestamp), COALESCE(NEW.request_type, ''), 1)
+            ON CONFLICT (day, request_type) DO UPDATE SET users = users + 1;
+        '''
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS users_stats_insert AFTER INSERT ON users
+            BEGIN {add} END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS users_stats_update AFTER UPDATE OF registration_timestamp, request_type ON users
+            WHEN (date(OLD.registration_timestamp), COALESCE(OLD.request_type, ''))
+                IS NOT (date(NEW.registration_timestamp), COALESCE(NEW.request_type, ''))
+            BEGIN {remove} {add} END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS users_stats_delete AFTER DELETE ON users
+            BEGIN {remove} END
+        ''')
+    
+    def _upgrade(self, conn: sqlite3.Connection):
+        """Перевод существующих данных на текущую версию схемы (один раз)"""
+        # Блокировка записи: несколько процессов бота не выполняют перевод одновременно
+        conn.execute('BEGIN IMMEDIATE')
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            conn.rollback()
+            return
+        
+        if version < 1:
+            # Телефоны в E.164 и ключи поиска по имени для существующих пользователей
+            rows = conn.execute('SELECT telegram_id, first_name, last_name, phone FROM users').fetchall()
+            phones = []
+            for telegram_id, _, _, phone in rows:
+                normalized = normalize_phone(phone)
+                if normalized != phone:
+                    phones.append((normalized, telegram_id))
+            conn.executemany('UPDATE users SET phone = ? WHERE telegram_id = ?', phones)
+            conn.execute('DELETE FROM user_names')
+            conn.executemany('INSERT OR IGNORE INTO user_names (name, telegram_id) VALUES (?, ?)',
+                             self._name_rows(rows))
+            if rows:
+                logger.info(f"✅ Телефоны приведены к E.164 ({len(phones)} изменено), "
+                            f"ключи поиска построены для {len(rows)} пользователей")
+        if version < 2:
+            # Сводка регистраций для пользователей, добавленных до появления триггеров
+            days = self._backfill_stats(conn)
+            if days:
+                logger.info(f"✅ Сводка регистраций построена: {days} строк")
+        conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        conn.commit()
     
+    @staticmethod
+    def _backfill_stats(conn: sqlite3.Connection) -> int:
+        """Пересчет registration_stats по users внутри текущей транзакции"""
+        conn.execute('DELETE FROM registration_stats')
+        return conn.execute(BACKFILL_STATS).rowcount
+    
+    @staticmethod
+    def _name_rows(rows: Iterable[Tuple]) -> Iterator[Tuple[str, int]]:
+        """Строки user_names для (telegram_id, first_name, last_name, ...)"""
+        for telegram_id, first_name, last_name, *_ in rows:
+            for key in name_keys(first_name, last_name):
+                yield key, telegram_id
+    
+    @DB_QUERY_SECONDS.labels('add_user').time()
     def add_user(self, telegram_id: int, first_name: str, last_name: str, phone: str) -> bool:
-        """Добавление нового пользователя"""
+        """
+        Добавление пользователя или обновление контакта
+        
+        id, время регистрации и запрос существующего пользователя сохраняются;
+        если контакт не изменился (повторная доставка), запись не выполняется.
+        """
         try:
-            print(f"Попытка добавления пользователя: ID={telegram_id}, Имя={first_name}, Фамилия={last_name}, Телефон={phone}")
-            print(f"Путь к БД: {os.path.abspath(self.db_path)}")
-            
             with sqlite3.connect(self.db_path) as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
-                    INSERT OR REPLACE INTO users (telegram_id, first_name, last_name, phone)
+                    INSERT INTO users (telegram_id, first_name, last_name, phone)
                     VALUES (?, ?, ?, ?)
-                ''', (telegram_id, first_name, last_name, phone))
+                    ON CONFLICT (telegram_id) DO UPDATE SET
+                        first_name = excluded.first_name,
+                        last_name = excluded.last_name,
+                        phone = excluded.phone
+                    WHERE (first_name, last_name, phone) IS NOT (excluded.first_name, excluded.last_name, excluded.phone)
+                ''', (telegram_id, first_name, last_name, normalize_phone(phone)))
+                if cursor.rowcount:
+                    cursor.execute('DELETE FROM user_names WHERE telegram_id = ?', (telegram_id,))
+                    cursor.executemany('INSERT OR IGNORE INTO user_names (name, telegram_id) VALUES (?, ?)',
+                                       self._name_rows([(telegram_id, first_name, last_name)]))
                 conn.commit()
-                print(f"Пользователь успешно добавлен/обновлен: {telegram_id}")
+                logger.info("Пользователь добавлен/обновлен", extra={'telegram_id': telegram_id})
                 return True
         except Exception as e:
-            print(f"Ошибка при добавлении пользователя: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception(f"Ошибка при добавлении пользователя: {e}", extra={'telegram_id': telegram_id})
             return False
     
-    def update_user_request(self, telegram_id: int, request: str, request_type: str = None, file_id: str = None) -> bool:
-        """Обновление запроса пользователя"""
+    @DB_QUERY_SECONDS.labels('update_user_request').time()
+    def update_user_request(self, telegram_id: int, request: str, request_type: str = None, file_id: str = None,
+                            file_ids: Sequence[str] = ()) -> bool:
+        """
+        Обновление запроса пользователя (одной транзакцией)
+        
+        file_ids - все файлы запроса-альбома по порядку; первый записывается и в file_id.
+        """
+        if file_ids and file_id is None:
+            file_id = file_ids[0]
         try:
             with sqlite3.connect(self.db_path) as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     UPDATE users SET request = ?, request_type = ?, file_id = ? WHERE telegram_id = ?
                 ''', (request, request_type, file_id, telegram_id))
+                if not cursor.rowcount:
+                    return False
+                cursor.execute('DELETE FROM request_files WHERE telegram_id = ?', (telegram_id,))
+                if len(file_ids) > 1:
+                    cursor.executemany('INSERT INTO request_files (telegram_id, position, file_id) VALUES (?, ?, ?)',
+                                       [(telegram_id, position, value) for position, value in enumerate(file_ids)])
                 conn.commit()
-                return cursor.rowcount > 0
+                return True
         except Exception as e:
-            print(f"Ошибка при обновлении запроса: {e}")
+            logger.error(f"Ошибка при обновлении запроса: {e}")
             return False
     
+    @DB_QUERY_SECONDS.labels('get_request_files').time()
+    def get_request_files(self, telegram_id: int) -> List[str]:
+        """Файлы запроса-альбома по порядку (пустой список - запрос не альбом)"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                return [row[0] for row in conn.execute(
+                    'SELECT file_id FROM request_files WHERE telegram_id = ? ORDER BY position', (telegram_id,)
+                )]
+        except Exception as e:
+            logger.error(f"Ошибка при получении файлов запроса: {e}")
+            return []
+    
+    @DB_QUERY_SECONDS.labels('get_request_files_by_telegram_ids').time()
+    def get_request_files_by_telegram_ids(self, telegram_ids: List[int]) -> Dict[int, List[str]]:
+        """Файлы запросов-альбомов для списка пользователей одним запросом (только альбомы)"""
+        files: Dict[int, List[str]] = {}
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                # Пачками - число параметров запроса SQLite ограничено
+                for start in range(0, len(telegram_ids), 500):
+                    chunk = list(telegram_ids[start:start + 500])
+                    placeholders = ','.join('?' * len(chunk))
+                    for telegram_id, file_id in conn.execute(f'''
+                        SELECT telegram_id, file_id FROM request_files
+                        WHERE telegram_id IN ({placeholders}) ORDER BY telegram_id, position
+                    ''', chunk):
+                        files.setdefault(telegram_id, []).append(file_id)
+            return files
+        except Exception as e:
+            logger.error(f"Ошибка при получении файлов запросов: {e}")
+            return {}
+    
+    @DB_QUERY_SECONDS.labels('get_user').time()
     def get_user(self, telegram_id: int) -> Optional[Tuple]:
         """Получение пользователя по telegram_id"""
         try:
@@ -72,9 +346,10 @@ class Database:
                 ''', (telegram_id,))
                 return cursor.fetchone()
         except Exception as e:
-            print(f"Ошибка при получении пользователя: {e}")
+            logger.error(f"Ошибка при получении пользователя: {e}")
             return None
     
+    @DB_QUERY_SECONDS.labels('get_all_users').time()
     def get_all_users(self) -> List[Tuple]:
         """Получение всех пользователей"""
         try:
@@ -85,9 +360,10 @@ class Database:
                 ''')
                 return cursor.fetchall()
         except Exception as e:
-            print(f"Ошибка при получении всех пользователей: {e}")
+            logger.error(f"Ошибка при получении всех пользователей: {e}")
             return []
     
+    @DB_QUERY_SECONDS.labels('get_today_registrations').time()
     def get_today_registrations(self) -> List[Tuple]:
         """Получение регистраций за сегодня"""
         try:
@@ -100,9 +376,327 @@ class Database:
                 ''')
                 return cursor.fetchall()
         except Exception as e:
-            print(f"Ошибка при получении сегодняшних регистраций: {e}")
+            logger.error(f"Ошибка при получении сегодняшних регистраций: {e}")
+            return []
+    
+    def iter_users(self, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                   chunk_size: int = 1000) -> Iterator[Tuple]:
+        """
+        Потоковое чтение пользователей пачками по chunk_size в порядке регистрации
+        
+        Фильтр по датам (YYYY-MM-DD, date_to включительно) использует индекс
+        по registration_timestamp. Каждая пачка читается отдельным запросом с
+        продолжением по ключу, поэтому блокировка чтения не удерживается между пачками.
+        """
+        conditions = []
+        params = []
+        if date_from:
+            conditions.append("registration_timestamp >= ?")
+            params.append(date_from)
+        if date_to:
+            conditions.append("registration_timestamp < DATE(?, '+1 day')")
+            params.append(date_to)
+        
+        # Время считается по каждой пачке: генератор может читаться долго
+        page_timer = DB_QUERY_SECONDS.labels('iter_users').time()
+        last_key = None
+        while True:
+            page_conditions = list(conditions)
+            page_params = list(params)
+            if last_key:
+                page_conditions.append("(registration_timestamp, id) > (?, ?)")
+                page_params.extend(last_key)
+            where = f"WHERE {' AND '.join(page_conditions)}" if page_conditions else ""
+            
+            with page_timer, sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    SELECT * FROM users {where}
+                    ORDER BY registration_timestamp, id
+                    LIMIT ?
+                ''', page_params + [chunk_size])
+                rows = cursor.fetchall()
+            
+            yield from rows
+            if len(rows) < chunk_size:
+                return
+            last_key = (rows[-1][5], rows[-1][0])
+    
+    @DB_QUERY_SECONDS.labels('get_users_by_telegram_ids').time()
+    def get_users_by_telegram_ids(self, telegram_ids: List[int]) -> List[Tuple]:
+        """Получение пользователей по списку telegram_id"""
+        if not telegram_ids:
+            return []
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                placeholders = ','.join('?' * len(telegram_ids))
+                cursor.execute(f'''
+                    SELECT * FROM users WHERE telegram_id IN ({placeholders})
+                ''', list(telegram_ids))
+                return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Ошибка при получении пользователей по списку: {e}")
             return []
     
+    @DB_QUERY_SECONDS.labels('find_users').time()
+    def find_users(self, query: str, limit: int = 20) -> List[Tuple]:
+        """Поиск по началу телефона или имени/фамилии (см. user_search.parse_query) по индексу"""
+        kind, prefix = parse_query(query)
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                if kind == 'phone':
+                    cursor.execute('''
+                        SELECT * FROM users WHERE phone >= ? AND phone < ? ORDER BY phone LIMIT ?
+                    ''', (prefix, prefix + PREFIX_END, limit))
+                else:
+                    # У пользователя не больше MAX_NAME_KEYS ключей - столько строк индекса хватит на limit пользователей
+                    cursor.execute('''
+                        SELECT * FROM users WHERE telegram_id IN (
+                            SELECT telegram_id FROM user_names WHERE name >= ? AND name < ? LIMIT ?
+                        )
+                        ORDER BY registration_timestamp DESC LIMIT ?
+                    ''', (prefix, prefix + PREFIX_END, limit * MAX_NAME_KEYS, limit))
+                return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Ошибка при поиске пользователей: {e}")
+            return []
+    
+    @DB_QUERY_SECONDS.labels('get_registration_stats').time()
+    def get_registration_stats(self, date_from: Optional[str] = None,
+                               date_to: Optional[str] = None) -> List[Tuple[str, str, int]]:
+        """Регистрации по дням и типам запроса из сводной таблицы (date_to включительно)"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                return conn.execute('''
+                    SELECT day, request_type, users FROM registration_stats
+                    WHERE day >= ? AND day <= ? AND users > 0
+                    ORDER BY day, request_type
+                ''', (date_from or '', date_to or '9999-12-31')).fetchall()
+        except Exception as e:
+            logger.error(f"Ошибка при получении сводки регистраций: {e}")
+            return []
+    
+    def rebuild_registration_stats(self) -> int:
+        """Пересчет сводной таблицы регистраций по users"""
+        with sqlite3.connect(self.db_path) as conn:
+            # Блокировка записи: регистрации не теряются между удалением и пересчетом
+            conn.execute('BEGIN IMMEDIATE')
+            rows = self._backfill_stats(conn)
+            conn.commit()
+            return rows
+    
+    @DB_QUERY_SECONDS.labels('get_outbox_batch').time()
+    def get_outbox_batch(self, limit: int = 500) -> List[Tuple]:
+        """Получение очередной пачки изменений из outbox: (id, telegram_id, operation)"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT id, telegram_id, operation FROM sheets_outbox ORDER BY id LIMIT ?
+                ''', (limit,))
+                return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Ошибка при чтении outbox: {e}")
+            return []
+    
+    @DB_QUERY_SECONDS.labels('get_outbox_size').time()
+    def get_outbox_size(self) -> int:
+        """Число изменений, ожидающих синхронизации"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT COUNT(*) FROM sheets_outbox')
+                return cursor.fetchone()[0]
+        except Exception as e:
+            logger.error(f"Ошибка при чтении outbox: {e}")
+            return 0
+    
+    @DB_QUERY_SECONDS.labels('delete_outbox_entries').time()
+    def delete_outbox_entries(self, max_id: Optional[int] = None) -> int:
+        """Удаление обработанных записей outbox (до max_id включительно, либо всех)"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                if max_id is None:
+                    cursor.execute('DELETE FROM sheets_outbox')
+                else:
+                    cursor.execute('DELETE FROM sheets_outbox WHERE id <= ?', (max_id,))
+                conn.commit()
+                return cursor.rowcount
+        except Exception as e:
+            logger.error(f"Ошибка при очистке outbox: {e}")
+            return 0
+    
+    @DB_QUERY_SECONDS.labels('delete_stale_outbox_entries').time()
+    def delete_stale_outbox_entries(self, max_age_hours: float) -> int:
+        """Удаление записей outbox старше max_age_hours часов (синхронизация не запущена)"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                # id растут вместе с created_at: удаляется начало очереди до первой свежей записи,
+                # просматриваются только удаляемые строки
+                cursor.execute('''
+                    DELETE FROM sheets_outbox WHERE id < COALESCE(
+                        (SELECT id FROM sheets_outbox WHERE created_at >= datetime('now', ?) ORDER BY id LIMIT 1),
+                        (SELECT MAX(id) + 1 FROM sheets_outbox)
+                    )
+                ''', (f'-{max_age_hours * 3600:.0f} seconds',))
+                conn.commit()
+                return cursor.rowcount
+        except Exception as e:
+            logger.error(f"Ошибка при очистке outbox: {e}")
+            return 0
+    
+    @DB_QUERY_SECONDS.labels('has_media').time()
+    def has_media(self, file_unique_id: str) -> bool:
+        """Файл уже обработан архивом медиафайлов (сохранен, вытеснен или недоступен)"""
+        with sqlite3.connect(self.db_path) as conn:
+            return conn.execute('SELECT 1 FROM media_files WHERE file_unique_id = ?',
+                                (file_unique_id,)).fetchone() is not None
+    
+    @DB_QUERY_SECONDS.labels('save_media').time()
+    def save_media(self, file_unique_id: str, file_id: str, path: Optional[str] = None,
+                   sha256: Optional[str] = None, size: Optional[int] = None) -> None:
+        """Запись о файле архива: path - путь в архиве; None - файл скачать не удалось"""
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO media_files (file_unique_id, status, sha256, path, size, last_used)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (file_unique_id, 'stored' if path else 'failed', sha256, path, size, time.time()))
+            conn.execute('INSERT OR IGNORE INTO media_file_ids (file_id, file_unique_id) VALUES (?, ?)',
+                         (file_id, file_unique_id))
+            conn.commit()
+    
+    @DB_QUERY_SECONDS.labels('link_media').time()
+    def link_media(self, file_id: str, file_unique_id: str) -> None:
+        """Еще один file_id уже обработанного архивом файла"""
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute('INSERT OR IGNORE INTO media_file_ids (file_id, file_unique_id) VALUES (?, ?)',
+                         (file_id, file_unique_id))
+            conn.commit()
+    
+    @DB_QUERY_SECONDS.labels('use_media').time()
+    def use_media(self, file_id: str) -> Optional[str]:
+        """Путь сохраненного файла по file_id с отметкой использования (LRU) или None"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                row = conn.execute('''
+                    SELECT media_files.file_unique_id, path FROM media_file_ids
+                    JOIN media_files USING (file_unique_id)
+                    WHERE file_id = ? AND status = 'stored'
+                ''', (file_id,)).fetchone()
+                if row is None:
+                    return None
+                conn.execute('UPDATE media_files SET last_used = ? WHERE file_unique_id = ?', (time.time(), row[0]))
+                conn.commit()
+                return row[1]
+        except Exception as e:
+            logger.error(f"Ошибка при чтении архива медиафайлов: {e}")
+            return None
+    
+    @DB_QUERY_SECONDS.labels('get_unarchived_media').time()
+    def get_unarchived_media(self, limit: int = 500) -> List[str]:
+        """file_id медиафайлов запросов, которых еще нет в архиве"""
+        with sqlite3.connect(self.db_path) as conn:
+            return [row[0] for row in conn.execute('''
+                SELECT file_id FROM users
+                WHERE file_id IS NOT NULL AND request_type IN ('photo', 'voice', 'video_note')
+                  AND NOT EXISTS (SELECT 1 FROM media_file_ids WHERE media_file_ids.file_id = users.file_id)
+                UNION
+                SELECT file_id FROM request_files
+                WHERE NOT EXISTS (SELECT 1 FROM media_file_ids WHERE media_file_ids.file_id = request_files.file_id)
+                LIMIT ?
+            ''', (limit,))]
+    
+    @DB_QUERY_SECONDS.labels('get_media_usage').time()
+    def get_media_usage(self) -> int:
+        """Суммарный размер сохраненных файлов архива (одинаковое содержимое - один раз)"""
+        with sqlite3.connect(self.db_path) as conn:
+            return conn.execute('''
+                SELECT COALESCE(SUM(size), 0) FROM (
+                    SELECT MAX(size) AS size FROM media_files WHERE status = 'stored' GROUP BY path
+                )
+            ''').fetchone()[0]
+    
+    @DB_QUERY_SECONDS.labels('get_lru_media').time()
+    def get_lru_media(self, limit: int = 100) -> List[Tuple[str, str, int]]:
+        """Давно не использованные файлы архива: (file_unique_id, path, size)"""
+        with sqlite3.connect(self.db_path) as conn:
+            return conn.execute('''
+                SELECT file_unique_id, path, size FROM media_files
+                WHERE status = 'stored' ORDER BY last_used LIMIT ?
+            ''', (limit,)).fetchall()
+    
+    @DB_QUERY_SECONDS.labels('evict_media').time()
+    def evict_media(self, file_unique_id: str) -> bool:
+        """Отметка файла вытесненным; True - на его содержимое больше никто не ссылается"""
+        with sqlite3.connect(self.db_path) as conn:
+            row = conn.execute("SELECT path FROM media_files WHERE file_unique_id = ? AND status = 'stored'",
+                               (file_unique_id,)).fetchone()
+            if row is None:
+                return False
+            conn.execute("UPDATE media_files SET status = 'evicted' WHERE file_unique_id = ?", (file_unique_id,))
+            shared = conn.execute("SELECT 1 FROM media_files WHERE path = ? AND status = 'stored'", (row[0],)).fetchone()
+            conn.commit()
+            return shared is None
+    
+    @DB_QUERY_SECONDS.labels('get_conversations').time()
+    def get_conversations(self, name: str) -> dict:
+        """Состояния разговора name: {ключ (кортеж id): состояние}"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT key, state FROM conversations WHERE name = ?', (name,))
+                return {tuple(json.loads(key)): json.loads(state) for key, state in cursor.fetchall()}
+        except Exception as e:
+            logger.error(f"Ошибка при чтении состояний разговора: {e}")
+            return {}
+    
+    @DB_QUERY_SECONDS.labels('update_conversation').time()
+    def update_conversation(self, name: str, key: tuple, state) -> None:
+        """Сохранение состояния разговора (None - разговор завершен)"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                if state is None:
+                    conn.execute('DELETE FROM conversations WHERE name = ? AND key = ?', (name, json.dumps(key)))
+                else:
+                    conn.execute('INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)',
+                                 (name, json.dumps(key), json.dumps(state)))
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении состояния разговора: {e}")
+    
+    @DB_QUERY_SECONDS.labels('get_state').time()
+    def get_state(self, key: str) -> Optional[bytes]:
+        """Служебное состояние бота (например, отсев повторов update_dedup.py)"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                row = conn.execute('SELECT value FROM bot_state WHERE key = ?', (key,)).fetchone()
+                return bytes(row[0]) if row else None
+        except Exception as e:
+            logger.error(f"Ошибка при чтении состояния {key}: {e}")
+            return None
+    
+    @DB_QUERY_SECONDS.labels('set_state').time()
+    def set_state(self, key: str, value: bytes) -> None:
+        """Сохранение служебного состояния бота"""
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute('INSERT OR REPLACE INTO bot_state (key, value) VALUES (?, ?)', (key, value))
+            conn.commit()
+    
+    @DB_QUERY_SECONDS.labels('ping').time()
+    def ping(self) -> bool:
+        """Простейший запрос к базе - проверка, что она доступна и не заблокирована"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute('SELECT 1 FROM users LIMIT 1').fetchall()
+                return True
+        except Exception as e:
+            logger.error(f"Ошибка проверки базы данных: {e}")
+            return False
+    
     def get_db_file_path(self) -> str:
         """Получение пути к файлу базы данных"""
         return os.path.abspath(self.db_path) 
\ No newline at end of file
@@ -66,13 +66,18 @@ Description=Telegram Bot Naumova
 After=network.target
 
 [Service]
-Type=simple
+# Бот сообщает о готовности и шлет сигналы watchdog (см. health_watchdog.py)
+Type=notify
+NotifyAccess=main
 User=telegram
 WorkingDirectory=$BOT_DIR
 Environment=PATH=$BOT_DIR/venv/bin:/usr/local/bin:/usr/bin:/bin
 ExecStart=$BOT_DIR/venv/bin/python $BOT_DIR/simple_bot.py
 Restart=always
-RestartSec=10
+RestartSec=5
+# Без сигнала WATCHDOG=1 дольше WatchdogSec служба перезапускается
+WatchdogSec=30
+TimeoutStartSec=120
 
 # Логирование
 StandardOutput=journal
@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""
+Журнал событий пользователей (JSON Lines) и восстановление базы по нему
+
+Каждое изменение, видимое пользователю, - контакт получен, запрос отправлен
+или изменен, разговор завершен - дописывается в журнал строкой JSON:
+  {"ts": 1760000000.123456, "event": "contact", "telegram_id": 1, ...}
+
+Обработчик только кладет строку в буфер в памяти (record, без ожидания
+диска). Фоновая задача записывает буфер группой: одна запись и один fsync
+на все события за EVENT_JOURNAL_FLUSH_INTERVAL секунд (или сразу, когда
+набралось EVENT_JOURNAL_BATCH событий). При аварийном завершении теряются
+только события последней несохраненной группы - сами данные при этом уже в базе.
+
+Файлы журнала: EVENT_JOURNAL_DIR/<поток>_<время открытия>.jsonl; поток -
+процесс бота (events, в режиме webhook_supervisor.py events-<номер>).
+Файл закрывается и начинается новый, когда он больше EVENT_JOURNAL_MAX_MB
+или старше EVENT_JOURNAL_MAX_HOURS; закрытый файл сжимается gzip
+(EVENT_JOURNAL_COMPRESS=0 - не сжимать).
+
+Восстановление (только SQLite): резервная копия + события после нее дают
+состояние базы на любой момент без пересылки полных копий базы.
+Использование:
+  python event_journal.py replay [--db naumovado.db] [--since ДАТА] [--until ДАТА]
+      - применить события к базе (новый файл - база строится с нуля)
+  python event_journal.py verify [--db naumovado.db]
+      - сверить базу с журналом
+"""
+import os
+import sys
+import json
+import time
+import gzip
+import heapq
+import shutil
+import sqlite3
+import asyncio
+import logging
+import argparse
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from metrics import EVENT_JOURNAL_EVENTS, EVENT_JOURNAL_FLUSH_SECONDS, EVENT_JOURNAL_BUFFER
+from user_search import normalize_phone
+
+logger = logging.getLogger(__name__)
+
+# Пустое значение отключает журнал
+EVENT_JOURNAL_DIR = os.getenv('EVENT_JOURNAL_DIR', 'journal')
+EVENT_JOURNAL_FLUSH_INTERVAL = float(os.getenv('EVENT_JOURNAL_FLUSH_INTERVAL', '0.2'))
+EVENT_JOURNAL_BATCH = int(os.getenv('EVENT_JOURNAL_BATCH', '1000'))
+EVENT_JOURNAL_MAX_MB = float(os.getenv('EVENT_JOURNAL_MAX_MB', '64'))
+EVENT_JOURNAL_MAX_HOURS = float(os.getenv('EVENT_JOURNAL_MAX_HOURS', '24'))
+EVENT_JOURNAL_COMPRESS = os.getenv('EVENT_JOURNAL_COMPRESS', '1') == '1'
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+class EventJournal:
+    """Журнал событий одного процесса бота с групповой записью и ротацией файлов"""
+
+    def __init__(self, directory: str = EVENT_JOURNAL_DIR, stream: str = 'events',
+                 max_mb: float = EVENT_JOURNAL_MAX_MB, max_hours: float = EVENT_JOURNAL_MAX_HOURS,
+                 compress: bool = EVENT_JOURNAL_COMPRESS):
+        self.directory = directory
+        self.stream = stream
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.max_age = max_hours * 3600
+        self.compress = compress
+        self.path = None
+        self._buffer: List[str] = []
+        self._file = None
+        self._size = 0
+        self._opened_at = 0.0
+        self._task = None
+        self._wake = asyncio.Event()
+        self._stopping = False
+
+    def record(self, event: str, telegram_id: int, **fields):
+        """Событие - в буфер; на диск оно попадет со следующей группой"""
+        entry = {'ts': round(time.time(), 6), 'event': event, 'telegram_id': telegram_id}
+        entry.update(fields)
+        self._buffer.append(json.dumps(entry, ensure_ascii=False) + '\n')
+        EVENT_JOURNAL_EVENTS.labels(event).inc()
+        EVENT_JOURNAL_BUFFER.set(len(self._buffer))
+        if len(self._buffer) >= EVENT_JOURNAL_BATCH:
+            self._wake.set()
+
+    async def start(self):
+        """Запуск фоновой записи (после Application.start)"""
+        os.makedirs(self.directory, exist_ok=True)
+        self._stopping = False
+        if self.compress:
+            # Файлы, оставшиеся несжатыми после аварийного завершения
+            await asyncio.to_thread(self._compress_closed)
+        self._task = asyncio.get_running_loop().create_task(self._writer())
+        logger.info(f"✅ Журнал событий: {self.directory} (поток {self.stream})")
+
+    async def stop(self):
+        """Запись оставшихся событий и закрытие файла"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        await self._task
+        self._task = None
+        closed = await asyncio.to_thread(self._close)
+        if closed and self.compress:
+            await asyncio.to_thread(self._compress, closed)
+
+    async def _writer(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), EVENT_JOURNAL_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+        # События, пришедшие во время последней записи
+        await self.flush()
+
+    async def flush(self):
+        """Запись накопленной группы событий одним fsync"""
+        if not self._buffer:
+            return
+        lines, self._buffer = self._buffer, []
+        EVENT_JOURNAL_BUFFER.set(0)
+        try:
+            with EVENT_JOURNAL_FLUSH_SECONDS.time():
+                await asyncio.to_thread(self._write, lines)
+        except Exception as e:
+            # Диск недоступен: события вернутся в буфер и запишутся следующей группой
+            self._buffer[:0] = lines
+            EVENT_JOURNAL_BUFFER.set(len(self._buffer))
+            logger.error(f"❌ Не удалось записать журнал событий: {e}")
+
+    def _write(self, lines: List[str]):
+        closed = None
+        if self._file is None or self._size >= self.max_bytes or time.time() - self._opened_at >= self.max_age:
+            closed = self._close()
+            self._open()
+        data = ''.join(lines).encode()
+        self._file.write(data)
+        os.fsync(self._file.fileno())
+        self._size += len(data)
+        # Сжатие закрытого файла - после fsync группы, чтобы не задерживать ее
+        if closed and self.compress:
+            self._compress(closed)
+
+    def _open(self):
+        self._opened_at = time.time()
+        name = f"{self.stream}_{datetime.fromtimestamp(self._opened_at):%Y%m%dT%H%M%S.%f}.jsonl"
+        self.path = os.path.join(self.directory, name)
+        self._file = open(self.path, 'ab', buffering=0)
+        self._size = 0
+        # Запись о новом файле в каталоге тоже должна пережить сбой питания
+        directory = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+    def _close(self) -> Optional[str]:
+        if self._file is None:
+            return None
+        self._file.close()
+        self._file = None
+        return self.path
+
+    def _compress(self, path: str):
+        with open(path, 'rb') as source, gzip.open(path + '.gz', 'wb', compresslevel=6) as target:
+            shutil.copyfileobj(source, target, COPY_CHUNK_SIZE)
+        with open(path + '.gz', 'rb') as f:
+            os.fsync(f.fileno())
+        os.remove(path)
+
+    def _compress_closed(self):
+        for path in journal_files(self.directory).get(self.stream, []):
+            if path.endswith('.jsonl'):
+                self._compress(path)
+
+def journal_files(directory: str) -> Dict[str, List[str]]:
+    """Файлы журнала по потокам, в порядке открытия"""
+    streams = defaultdict(list)
+    if not os.path.isdir(directory):
+        return streams
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.jsonl') or name.endswith('.jsonl.gz'):
+            streams[name.rsplit('_', 1)[0]].append(os.path.join(directory, name))
+    return streams
+
+def _stream_events(files: List[str], stats: Counter) -> Iterator[dict]:
+    for path in files:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # Недописанная строка последней группы перед аварийным завершением
+                    stats['damaged'] += 1
+
+def read_events(directory: str, since: Optional[float] = None, until: Optional[float] = None,
+                stats: Optional[Counter] = None) -> Iterator[dict]:
+    """События всех потоков по времени (since включительно, until - не позже)"""
+    stats = stats if stats is not None else Counter()
+    streams = [_stream_events(files, stats) for files in journal_files(directory).values()]
+    for event in heapq.merge(*streams, key=lambda event: event['ts']):
+        if since is not None and event['ts'] < since:
+            continue
+        if until is not None and event['ts'] > until:
+            break
+        yield event
+
+def fold_events(events) -> Tuple[Dict[int, list], Counter]:
+    """
+    Итоговое состояние пользователей после событий
+
+    Returns:
+        ({telegram_id: [время первого контакта, контакт, запрос]}, число событий по типам);
+        контакт - (имя, фамилия, телефон), запрос - (текст, тип, file_id, file_ids) или None
+    """
+    users = {}
+    counts = Counter()
+    for event in events:
+        kind = event['event']
+        counts[kind] += 1
+        if kind == 'contact':
+            user = users.get(event['telegram_id'])
+            contact = (event.get('first_name'), event.get('last_name'), event.get('phone'))
+            if user is None:
+                users[event['telegram_id']] = [event['ts'], contact, None]
+            else:
+                user[0] = user[0] or event['ts']
+                user[1] = contact
+        elif kind == 'request':
+            user = users.setdefault(event['telegram_id'], [None, None, None])
+            user[2] = (event.get('request'), event.get('request_type'), event.get('file_id'),
+                       event.get('file_ids') or [])
+    return users, counts
+
+def _registration(ts: float) -> str:
+    """Время в формате CURRENT_TIMESTAMP SQLite (UTC)"""
+    return datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+def apply_events(db_path: str, users: Dict[int, list]):
+    """
+    Применение итогового состояния к базе SQLite одной транзакцией
+
+    Пакетами executemany: контакты вместе с запросами (время регистрации существующих
+    пользователей сохраняется, как в add_user), ключи поиска по имени, файлы альбомов.
+    Построчные триггеры users на время пакета снимаются: очередь Google Sheets и
+    счетчик изменений получают по одной записи на пользователя, сводка регистраций
+    пересчитывается, триггеры восстанавливаются в той же транзакции.
+    """
+    from database import Database, USER_TRIGGERS
+    # Схема, триггеры и версия - как у базы бота
+    Database(db_path)
+    full, contacts_only, requests_only = [], [], []
+    for telegram_id, (ts, contact, request) in users.items():
+        if contact:
+            row = (telegram_id, contact[0], contact[1], normalize_phone(contact[2]), _registration(ts))
+            if request:
+                full.append(row + request[:3])
+            else:
+                contacts_only.append(row)
+        else:
+            requests_only.append((*request[:3], telegram_id))
+    contacts = full + contacts_only
+    albums = [(telegram_id, user[2][3]) for telegram_id, user in users.items() if user[2]]
+    with sqlite3.connect(db_path) as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        for name in USER_TRIGGERS:
+            conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+        conn.executemany('''
+            INSERT INTO users (telegram_id, first_name, last_name, phone, registration_timestamp,
+                               request, request_type, file_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (telegram_id) DO UPDATE SET
+                first_name = excluded.first_name,
+                last_name = excluded.last_name,
+                phone = excluded.phone,
+                request = excluded.request,
+                request_type = excluded.request_type,
+                file_id = excluded.file_id
+        ''', full)
+        conn.executemany('''
+            INSERT INTO users (telegram_id, first_name, last_name, phone, registration_timestamp)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (telegram_id) DO UPDATE SET
+                first_name = excluded.first_name,
+                last_name = excluded.last_name,
+                phone = excluded.phone
+        ''', contacts_only)
+        conn.executemany('UPDATE users SET request = ?, request_type = ?, file_id = ? WHERE telegram_id = ?',
+                         requests_only)
+        conn.executemany('DELETE FROM user_names WHERE telegram_id = ?', ((row[0],) for row in contacts))
+        # В порядке ключа: строки дописываются в конец индекса, а не вразброс
+        conn.executemany('INSERT OR IGNORE INTO user_names (name, telegram_id) VALUES (?, ?)',
+                         sorted(Database._name_rows(contacts)))
+        conn.executemany('DELETE FROM request_files WHERE telegram_id = ?', ((row[0],) for row in albums))
+        conn.executemany('INSERT INTO request_files (telegram_id, position, file_id) VALUES (?, ?, ?)',
+                         ((telegram_id, position, value)
+                          for telegram_id, file_ids in albums if len(file_ids) > 1
+                          for position, value in enumerate(file_ids)))
+        conn.executemany("INSERT INTO sheets_outbox (telegram_id, operation) VALUES (?, 'update')",
+                         ((telegram_id,) for telegram_id in users))
+        conn.execute('UPDATE change_counter SET changes = changes + ? WHERE id = 1', (len(users),))
+        Database._backfill_stats(conn)
+        Database.create_user_triggers(conn)
+        conn.commit()
+    return len(contacts), len(albums)
+
+def verify_database(db_path: str, users: Dict[int, list]) -> Tuple[int, List[str], int]:
+    """
+    Сверка базы с журналом
+
+    Returns:
+        (совпадающих пользователей, описания расхождений, пользователей базы без событий в журнале)
+    """
+    with sqlite3.connect(db_path) as conn:
+        rows = {row[0]: row[1:] for row in conn.execute(
+            'SELECT telegram_id, first_name, last_name, phone, request, request_type, file_id FROM users'
+        )}
+        albums = defaultdict(list)
+        for telegram_id, file_id in conn.execute(
+            'SELECT telegram_id, file_id FROM request_files ORDER BY telegram_id, position'
+        ):
+            albums[telegram_id].append(file_id)
+    matched = 0
+    problems = []
+    for telegram_id, (_, contact, request) in users.items():
+        row = rows.get(telegram_id)
+        if row is None:
+            problems.append(f"{telegram_id}: нет в базе")
+            continue
+        if contact and (contact[0], contact[1], normalize_phone(contact[2])) != row[:3]:
+            problems.append(f"{telegram_id}: контакт {row[:3]} вместо {contact}")
+        elif request and (request[:3] != row[3:] or
+                          (request[3] if len(request[3]) > 1 else []) != albums.get(telegram_id, [])):
+            problems.append(f"{telegram_id}: запрос {row[3:]} вместо {request[:3]}")
+        else:
+            matched += 1
+    return matched, problems, len(rows.keys() - users.keys())
+
+def _parse_time(value: Optional[str]) -> Optional[float]:
+    """ГГГГ-ММ-ДД[ ЧЧ:ММ[:СС]] по местному времени -> метка времени"""
+    return datetime.fromisoformat(value).timestamp() if value else None
+
+def main():
+    parser = argparse.ArgumentParser(description="Восстановление и сверка базы по журналу событий")
+    parser.add_argument('command', choices=['replay', 'verify'])
+    parser.add_argument('--db', default=os.getenv('DB_PATH', 'naumovado.db'), help="Файл базы SQLite")
+    parser.add_argument('--dir', default=EVENT_JOURNAL_DIR or 'journal', help="Каталог журнала")
+    parser.add_argument('--since', help="Только события с этого времени (время резервной копии)")
+    parser.add_argument('--until', help="Только события до этого времени (восстановление на момент)")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    stats = Counter()
+    users, counts = fold_events(read_events(args.dir, _parse_time(args.since), _parse_time(args.until), stats))
+    total = sum(counts.values())
+    print(f"Журнал: {total} событий ({', '.join(f'{k}: {v}' for k, v in sorted(counts.items())) or 'нет'}), "
+          f"пользователей {len(users)}, прочитано за {time.perf_counter() - started:.2f} с")
+    if stats['damaged']:
+        print(f"⚠️ Пропущено поврежденных строк: {stats['damaged']}")
+
+    if args.command == 'replay':
+        applied = time.perf_counter()
+        contacts, requests = apply_events(args.db, users)
+        elapsed = time.perf_counter() - started
+        print(f"✅ {args.db}: контактов {contacts}, запросов {requests} за {time.perf_counter() - applied:.2f} с; "
+              f"всего {elapsed:.2f} с ({total / max(elapsed, 1e-9):.0f} событий/с)")
+        return
+
+    if not os.path.exists(args.db):
+        print(f"❌ Файл базы не найден: {args.db}")
+        sys.exit(1)
+    matched, problems, unjournaled = verify_database(args.db, users)
+    print(f"Совпадает: {matched}, расхождений: {len(problems)}, в базе без событий в журнале: {unjournaled}")
+    for problem in problems[:20]:
+        print(f"  ❌ {problem}")
+    if problems:
+        sys.exit(1)
+    print("✅ База соответствует журналу")
+
+if __name__ == "__main__":
+    main()
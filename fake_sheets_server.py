@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Локальная замена Google Sheets API v4 для тестов и бенчмарков экспорта
+
+Реализует values.get/update/append/clear/batchUpdate и spreadsheets.get
+поверх таблицы в памяти. Поддерживает искусственную задержку и внедрение
+ошибок 429/500. GoogleSheetsService подключается к серверу через
+GOOGLE_SHEETS_ENDPOINT (или параметр api_endpoint) без учетных данных.
+
+Запуск отдельным процессом:
+  python fake_sheets_server.py --port 8099 --latency 0.05 --error-rate 0.01
+"""
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, unquote
+
+SHEET_TITLE = "Лист1"
+
+ERROR_STATUSES = {
+    429: "RESOURCE_EXHAUSTED",
+    500: "INTERNAL",
+    503: "UNAVAILABLE",
+}
+
+def column_to_index(letters: str) -> int:
+    """Буквенное обозначение колонки -> индекс с нуля (A -> 0, AA -> 26)"""
+    index = 0
+    for char in letters:
+        index = index * 26 + (ord(char) - ord('A') + 1)
+    return index - 1
+
+def index_to_column(index: int) -> str:
+    """Индекс колонки с нуля -> буквенное обозначение"""
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+def parse_a1_range(range_name: str):
+    """
+    Разбор диапазона в нотации A1
+
+    Returns:
+        (first_col, first_row, last_col, last_row) с индексами с нуля,
+        None означает открытую границу
+    """
+    range_name = range_name.split('!')[-1]
+    bounds = []
+    for part in range_name.split(':'):
+        match = re.fullmatch(r'([A-Z]*)(\d*)', part.upper())
+        if not match:
+            raise ValueError(f"Некорректный диапазон: {range_name}")
+        col = column_to_index(match.group(1)) if match.group(1) else None
+        row = int(match.group(2)) - 1 if match.group(2) else None
+        bounds.append((col, row))
+
+    first_col, first_row = bounds[0]
+    last_col, last_row = bounds[-1] if len(bounds) > 1 else (first_col, first_row)
+    if len(bounds) == 1 and first_row is None:
+        # Диапазон вида "A" - вся колонка
+        last_row = None
+    return first_col or 0, first_row or 0, last_col, last_row
+
+class FakeSpreadsheet:
+    """Таблица в памяти с семантикой значений Google Sheets"""
+
+    def __init__(self, spreadsheet_id: str, title: str = "Fake spreadsheet"):
+        self.spreadsheet_id = spreadsheet_id
+        self.title = title
+        self.rows = []
+        self.lock = threading.Lock()
+
+    def _a1(self, first_col, first_row, last_col, last_row) -> str:
+        return (f"{SHEET_TITLE}!{index_to_column(first_col)}{first_row + 1}:"
+                f"{index_to_column(last_col)}{last_row + 1}")
+
+    def _write(self, first_col: int, first_row: int, values: list) -> dict:
+        width = max((len(row) for row in values), default=0)
+        for offset, row in enumerate(values):
+            row_index = first_row + offset
+            while len(self.rows) <= row_index:
+                self.rows.append([])
+            target = self.rows[row_index]
+            if len(target) < first_col + len(row):
+                target.extend([''] * (first_col + len(row) - len(target)))
+            target[first_col:first_col + len(row)] = [str(value) for value in row]
+        return {
+            'updatedRange': self._a1(first_col, first_row, first_col + max(width, 1) - 1,
+                                     first_row + max(len(values), 1) - 1),
+            'updatedRows': len(values),
+            'updatedColumns': width,
+            'updatedCells': sum(len(row) for row in values),
+        }
+
+    def get(self, range_name: str) -> dict:
+        first_col, first_row, last_col, last_row = parse_a1_range(range_name)
+        with self.lock:
+            end_row = len(self.rows) if last_row is None else min(last_row + 1, len(self.rows))
+            values = []
+            for row in self.rows[first_row:end_row]:
+                cells = row[first_col:] if last_col is None else row[first_col:last_col + 1]
+                while cells and cells[-1] == '':
+                    cells = cells[:-1]
+                values.append(list(cells))
+            # Google не возвращает пустые строки в конце диапазона
+            while values and not values[-1]:
+                values.pop()
+        result = {'range': f"{SHEET_TITLE}!{range_name}", 'majorDimension': 'ROWS'}
+        if values:
+            result['values'] = values
+        return result
+
+    def update(self, range_name: str, values: list) -> dict:
+        first_col, first_row, _, _ = parse_a1_range(range_name)
+        with self.lock:
+            return self._write(first_col, first_row, values)
+
+    def append(self, range_name: str, values: list) -> dict:
+        first_col, _, _, _ = parse_a1_range(range_name)
+        with self.lock:
+            # Добавляем после последней непустой строки таблицы
+            last_filled = len(self.rows)
+            while last_filled and not any(self.rows[last_filled - 1]):
+                last_filled -= 1
+            updates = self._write(first_col, last_filled, values)
+        return {'spreadsheetId': self.spreadsheet_id, 'updates': updates}
+
+    def clear(self, range_name: str) -> dict:
+        first_col, first_row, last_col, last_row = parse_a1_range(range_name)
+        with self.lock:
+            end_row = len(self.rows) if last_row is None else min(last_row + 1, len(self.rows))
+            for row in self.rows[first_row:end_row]:
+                end_col = len(row) if last_col is None else min(last_col + 1, len(row))
+                for col in range(first_col, end_col):
+                    row[col] = ''
+        return {'spreadsheetId': self.spreadsheet_id, 'clearedRange': f"{SHEET_TITLE}!{range_name}"}
+
+    def metadata(self) -> dict:
+        return {
+            'spreadsheetId': self.spreadsheet_id,
+            'properties': {'title': self.title},
+            'sheets': [{'properties': {'sheetId': 0, 'title': SHEET_TITLE}}],
+        }
+
+class FakeSheetsServer:
+    """HTTP-сервер, имитирующий Google Sheets API v4"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 error_rate: float = 0.0, error_codes=(429, 500), seed: int = None):
+        """
+        Args:
+            host, port: Адрес для прослушивания (port=0 - любой свободный)
+            latency: Задержка каждого ответа, секунды
+            error_rate: Доля запросов, на которые возвращается ошибка
+            error_codes: Коды ошибок, из которых выбирается случайная
+            seed: Зерно генератора для воспроизводимого внедрения ошибок
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self.random = random.Random(seed)
+        self.spreadsheets = {}
+        self.calls = Counter()
+        self.errors = Counter()
+        self._forced_errors = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+        self.httpd = ThreadingHTTPServer((host, port), _FakeSheetsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake = self
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def get_spreadsheet(self, spreadsheet_id: str) -> FakeSpreadsheet:
+        with self._lock:
+            if spreadsheet_id not in self.spreadsheets:
+                self.spreadsheets[spreadsheet_id] = FakeSpreadsheet(spreadsheet_id)
+            return self.spreadsheets[spreadsheet_id]
+
+    def fail_next(self, count: int = 1, code: int = 429):
+        """Гарантированно вернуть ошибку code на следующие count запросов"""
+        with self._lock:
+            self._forced_errors.extend([code] * count)
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls.clear()
+            self.errors.clear()
+
+    def _pick_error(self):
+        with self._lock:
+            if self._forced_errors:
+                return self._forced_errors.pop(0)
+            if self.error_rate and self.random.random() < self.error_rate:
+                return self.random.choice(self.error_codes)
+        return None
+
+    def start(self) -> str:
+        """Запуск сервера в фоновом потоке, возвращает базовый URL"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-sheets", daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+class _FakeSheetsHandler(BaseHTTPRequestHandler):
+    """Маршрутизация REST-запросов Sheets API v4"""
+
+    protocol_version = "HTTP/1.1"
+
+    ROUTES = [
+        ('GET', re.compile(r'^/v4/spreadsheets/([^/]+)/values/([^/:]+)$'), 'values.get'),
+        ('PUT', re.compile(r'^/v4/spreadsheets/([^/]+)/values/([^/:]+)$'), 'values.update'),
+        ('POST', re.compile(r'^/v4/spreadsheets/([^/]+)/values/([^/:]+):append$'), 'values.append'),
+        ('POST', re.compile(r'^/v4/spreadsheets/([^/]+)/values/([^/:]+):clear$'), 'values.clear'),
+        ('POST', re.compile(r'^/v4/spreadsheets/([^/]+)/values:batchUpdate$'), 'values.batchUpdate'),
+        ('GET', re.compile(r'^/v4/spreadsheets/([^/]+)$'), 'spreadsheets.get'),
+    ]
+
+    def log_message(self, format, *args):
+        # Не засоряем вывод бенчмарков access-логом
+        pass
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _dispatch(self, method: str):
+        fake = self.server.fake
+        length = int(self.headers.get('Content-Length') or 0)
+        raw_body = self.rfile.read(length) if length else b''
+        path = urlsplit(self.path).path
+
+        for route_method, pattern, name in self.ROUTES:
+            match = pattern.match(path) if route_method == method else None
+            if match:
+                break
+        else:
+            self._send_json(404, {'error': {'code': 404, 'message': f"Unknown path {path}", 'status': 'NOT_FOUND'}})
+            return
+
+        with fake._lock:
+            fake.calls[name] += 1
+        if fake.latency:
+            time.sleep(fake.latency)
+
+        error_code = fake._pick_error()
+        if error_code:
+            with fake._lock:
+                fake.errors[error_code] += 1
+            self._send_json(error_code, {'error': {
+                'code': error_code,
+                'message': 'Injected error',
+                'status': ERROR_STATUSES.get(error_code, 'UNKNOWN'),
+            }})
+            return
+
+        spreadsheet = fake.get_spreadsheet(unquote(match.group(1)))
+        body = json.loads(raw_body) if raw_body else {}
+        try:
+            if name == 'values.get':
+                result = spreadsheet.get(unquote(match.group(2)))
+            elif name == 'values.update':
+                result = spreadsheet.update(unquote(match.group(2)), body.get('values', []))
+            elif name == 'values.append':
+                result = spreadsheet.append(unquote(match.group(2)), body.get('values', []))
+            elif name == 'values.clear':
+                result = spreadsheet.clear(unquote(match.group(2)))
+            elif name == 'values.batchUpdate':
+                responses = [spreadsheet.update(item['range'], item.get('values', []))
+                             for item in body.get('data', [])]
+                result = {
+                    'spreadsheetId': spreadsheet.spreadsheet_id,
+                    'totalUpdatedCells': sum(item['updatedCells'] for item in responses),
+                    'responses': responses,
+                }
+            else:
+                result = spreadsheet.metadata()
+        except ValueError as e:
+            self._send_json(400, {'error': {'code': 400, 'message': str(e), 'status': 'INVALID_ARGUMENT'}})
+            return
+
+        self._send_json(200, result)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная замена Google Sheets API v4")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка ответа, секунды")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="доля ответов с ошибкой")
+    parser.add_argument('--error-codes', default='429,500', help="коды ошибок через запятую")
+    args = parser.parse_args()
+
+    server = FakeSheetsServer(
+        args.host, args.port, latency=args.latency, error_rate=args.error_rate,
+        error_codes=[int(code) for code in args.error_codes.split(',') if code]
+    )
+    print(f"🧪 Fake Google Sheets API запущен: {server.url}")
+    print(f"   Для бота: GOOGLE_SHEETS_ENDPOINT={server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 Остановлен")
+    finally:
+        server.httpd.server_close()
+
+if __name__ == "__main__":
+    sys.exit(main())
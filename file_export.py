@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Выгрузка пользователей в файл CSV или XLSX без Google Sheets
+
+Пользователи читаются из базы пачками и сразу пишутся в файл, поэтому
+расход памяти не зависит от размера таблицы. XLSX собирается вручную
+потоковой записью листа в zip-архив; большие CSV упаковываются в zip.
+
+Имя, фамилию и запрос вводит пользователь: в CSV текст, начинающийся с
+=, +, -, @ или табуляции, Excel и LibreOffice выполнили бы как формулу,
+поэтому такие ячейки начинаются с апострофа (csv_cell); телефоны вида +7...
+и числа остаются как есть. В XLSX текст
+записывается строкой (inlineStr) и формулой не бывает.
+"""
+import os
+import re
+import csv
+import zipfile
+import logging
+from datetime import datetime
+from typing import Iterable, Optional, Tuple
+from xml.sax.saxutils import escape
+
+from storage import Storage
+
+logger = logging.getLogger(__name__)
+
+# Заголовки совпадают с выгрузкой в Google Sheets
+EXPORT_HEADERS = [
+    'ID',
+    'Telegram ID',
+    'Имя',
+    'Фамилия',
+    'Телефон',
+    'Дата регистрации',
+    'Запрос',
+    'Тип запроса',
+    'ID файла'
+]
+
+# CSV больше этого размера отправляется упакованным в zip
+COMPRESS_THRESHOLD = int(os.getenv('EXPORT_COMPRESS_THRESHOLD', str(5 * 1024 * 1024)))
+
+# Ограничение Telegram Bot API на размер отправляемого документа
+TELEGRAM_DOCUMENT_LIMIT = 50 * 1024 * 1024
+
+# Первые символы, с которых табличные редакторы начинают формулу
+_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+# Телефон в E.164 (+79990000000) или число формулой не выполнится - такие ячейки не меняем
+_PLAIN_NUMBER = re.compile(r'\+?\d[\d ]*')
+
+# Символы, недопустимые в XML 1.0
+_ILLEGAL_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{title}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+
+class XlsxStreamWriter:
+    """Потоковая запись одного листа XLSX с постоянным расходом памяти"""
+
+    def __init__(self, path: str, sheet_title: str = "Пользователи"):
+        self.path = path
+        self.rows_written = 0
+        self._zip = zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED)
+        self._zip.writestr('[Content_Types].xml', _CONTENT_TYPES)
+        self._zip.writestr('_rels/.rels', _ROOT_RELS)
+        self._zip.writestr('xl/workbook.xml', _WORKBOOK.format(title=escape(sheet_title)))
+        self._zip.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS)
+        self._sheet = self._zip.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True)
+        self._sheet.write(
+            b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+        )
+
+    @staticmethod
+    def _cell(value) -> str:
+        if value is None or value == '':
+            return '<c/>'
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return f'<c><v>{value}</v></c>'
+        text = escape(_ILLEGAL_XML_CHARS.sub('', str(value)))
+        return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+    def write_row(self, values: Iterable):
+        self.rows_written += 1
+        cells = ''.join(self._cell(value) for value in values)
+        self._sheet.write(f'<row r="{self.rows_written}">{cells}</row>'.encode('utf-8'))
+
+    def close(self):
+        self._sheet.write(b'</sheetData></worksheet>')
+        self._sheet.close()
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def csv_cell(value):
+    """Значение ячейки CSV: пустая строка вместо None, текст, похожий на формулу, - с апострофом"""
+    if value is None:
+        return ''
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES) and not _PLAIN_NUMBER.fullmatch(value):
+        return "'" + value
+    return value
+
+def _write_csv(users: Iterable[Tuple], path: str) -> int:
+    count = 0
+    # utf-8-sig - чтобы Excel корректно открыл кириллицу
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(EXPORT_HEADERS)
+        for user in users:
+            writer.writerow([csv_cell(value) for value in user[:len(EXPORT_HEADERS)]])
+            count += 1
+    return count
+
+def _write_xlsx(users: Iterable[Tuple], path: str) -> int:
+    count = 0
+    with XlsxStreamWriter(path) as writer:
+        writer.write_row(EXPORT_HEADERS)
+        for user in users:
+            writer.write_row(user[:len(EXPORT_HEADERS)])
+            count += 1
+    return count
+
+def export_users_to_file(db: Storage, directory: str, file_format: str = "xlsx",
+                         date_from: Optional[str] = None, date_to: Optional[str] = None) -> Tuple[str, int]:
+    """
+    Выгрузка пользователей в файл
+
+    Args:
+        db: База данных
+        directory: Каталог для создаваемого файла
+        file_format: "xlsx" или "csv"
+        date_from, date_to: Необязательный диапазон дат регистрации (YYYY-MM-DD, включительно)
+
+    Returns:
+        (путь к готовому файлу, количество выгруженных пользователей)
+    """
+    if file_format not in ("xlsx", "csv"):
+        raise ValueError(f"Неизвестный формат выгрузки: {file_format}")
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    path = os.path.join(directory, f"naumovado_users_{timestamp}.{file_format}")
+    users = db.iter_users(date_from=date_from, date_to=date_to)
+
+    if file_format == "xlsx":
+        count = _write_xlsx(users, path)
+    else:
+        count = _write_csv(users, path)
+        if os.path.getsize(path) > COMPRESS_THRESHOLD:
+            zip_path = f"{path}.zip"
+            with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+                archive.write(path, arcname=os.path.basename(path))
+            os.remove(path)
+            path = zip_path
+
+    logger.info(f"📁 Выгружено {count} пользователей в {path} ({os.path.getsize(path)} байт)")
+    return path, count
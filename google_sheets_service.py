@@ -5,28 +5,45 @@
 """
 import os
 import logging
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
 from datetime import datetime
+from google.auth.credentials import AnonymousCredentials
 from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
 from dotenv import load_dotenv
 
+from metrics import SHEETS_SECONDS
+from tracing import Span
+
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class TracedHttpRequest(HttpRequest):
+    """Запрос Google API, записываемый интервалом в трассу текущего обновления"""
+    
+    def execute(self, http=None, num_retries=0):
+        with Span('google', self.methodId or self.method):
+            return super().execute(http=http, num_retries=num_retries)
+
 class GoogleSheetsService:
-    def __init__(self, credentials_file: str = "endless-codex.json"):
+    def __init__(self, credentials_file: str = "endless-codex.json", api_endpoint: str = None):
         """
         Инициализация сервиса Google Sheets
         
         Args:
             credentials_file: Путь к файлу с учетными данными сервисного аккаунта
+            api_endpoint: Альтернативный адрес API (например, fake_sheets_server.py);
+                          по умолчанию берется из GOOGLE_SHEETS_ENDPOINT
         """
         self.credentials_file = credentials_file
+        self.api_endpoint = api_endpoint or os.getenv('GOOGLE_SHEETS_ENDPOINT')
         self.service = None
         self.sheets_id = os.getenv('GoogleSheetsID')
+        # Повторы запросов с экспоненциальной задержкой при ошибках 429/5xx
+        self.num_retries = int(os.getenv('GOOGLE_SHEETS_RETRIES', '3'))
         
         if not self.sheets_id:
             raise ValueError("Не задан GoogleSheetsID в переменных окружения")
@@ -36,6 +53,18 @@ class GoogleSheetsService:
     def _authenticate(self):
         """Аутентификация в Google API"""
         try:
+            if self.api_endpoint:
+                # Локальная замена API: учетные данные не нужны
+                self.service = build(
+                    'sheets', 'v4',
+                    credentials=AnonymousCredentials(),
+                    client_options={'api_endpoint': self.api_endpoint},
+                    cache_discovery=False,
+                    requestBuilder=TracedHttpRequest
+                )
+                logger.info(f"🧪 Google Sheets API: используется {self.api_endpoint}")
+                return
+            
             if not os.path.exists(self.credentials_file):
                 raise FileNotFoundError(f"Файл учетных данных не найден: {self.credentials_file}")
             
@@ -52,7 +81,7 @@ class GoogleSheetsService:
             )
             
             # Создание сервиса
-            self.service = build('sheets', 'v4', credentials=credentials)
+            self.service = build('sheets', 'v4', credentials=credentials, requestBuilder=TracedHttpRequest)
             logger.info("✅ Успешная аутентификация в Google Sheets API")
             
         except Exception as e:
@@ -73,7 +102,7 @@ class GoogleSheetsService:
             result = self.service.spreadsheets().values().get(
                 spreadsheetId=self.sheets_id,
                 range=range_name
-            ).execute()
+            ).execute(num_retries=self.num_retries)
             
             values = result.get('values', [])
             logger.info(f"📊 Получено {len(values)} строк из таблицы")
@@ -101,7 +130,7 @@ class GoogleSheetsService:
                 range=range_name,
                 valueInputOption='RAW',
                 body=body
-            ).execute()
+            ).execute(num_retries=self.num_retries)
             
             logger.info(f"✅ Обновлено {result.get('updatedCells')} ячеек")
             return True
@@ -129,7 +158,7 @@ class GoogleSheetsService:
                 valueInputOption='RAW',
                 insertDataOption='INSERT_ROWS',
                 body=body
-            ).execute()
+            ).execute(num_retries=self.num_retries)
             
             logger.info(f"✅ Добавлено {len(values)} новых строк")
             return True
@@ -152,7 +181,7 @@ class GoogleSheetsService:
             self.service.spreadsheets().values().clear(
                 spreadsheetId=self.sheets_id,
                 range=range_name
-            ).execute()
+            ).execute(num_retries=self.num_retries)
             
             logger.info(f"✅ Таблица очищена в диапазоне {range_name}")
             return True
@@ -187,6 +216,100 @@ class GoogleSheetsService:
             logger.error(f"❌ Ошибка форматирования заголовков: {e}")
             return False
     
+    @staticmethod
+    def _user_to_row(user: Tuple) -> List:
+        """Преобразование записи пользователя из базы в строку таблицы"""
+        # user: (id, telegram_id, first_name, last_name, phone, registration_timestamp, request, request_type, file_id)
+        return [
+            user[0],                    # ID
+            user[1],                    # Telegram ID
+            user[2] or '',              # Имя
+            user[3] or '',              # Фамилия
+            user[4] or '',              # Телефон
+            user[5] or '',              # Дата регистрации
+            user[6] or '',              # Запрос
+            user[7] or '',              # Тип запроса
+            user[8] or ''               # ID файла
+        ]
+    
+    def _load_row_index(self) -> Optional[Dict[int, int]]:
+        """
+        Индекс telegram_id -> номер строки по колонке B
+        
+        Строится заново для каждой пачки: строки могут сортировать и удалять вручную,
+        а /export_sheets - добавлять пользователей, еще ждущих в очереди синхронизации.
+        """
+        column = self.get_sheet_data("B:B")
+        if column is None:
+            return None
+        
+        if not column:
+            # Пустая таблица - сначала пишем заголовки
+            if not self.format_headers():
+                return None
+        
+        row_index = {}
+        for row_number, row in enumerate(column[1:], start=2):
+            if row and row[0]:
+                try:
+                    row_index[int(row[0])] = row_number
+                except ValueError:
+                    continue
+        return row_index
+    
+    @SHEETS_SECONDS.labels('sync_users').time()
+    def sync_users(self, users_data: List[Tuple]) -> bool:
+        """
+        Инкрементальная синхронизация изменившихся пользователей
+        
+        Существующие строки обновляются одним batchUpdate, новые добавляются одним append.
+        
+        Args:
+            users_data: Список изменившихся пользователей из базы данных
+        
+        Returns:
+            True при успехе, False при ошибке
+        """
+        try:
+            if not users_data:
+                return True
+            
+            row_index = self._load_row_index()
+            if row_index is None:
+                return False
+            
+            updates = []
+            new_rows = []
+            for user in users_data:
+                row_number = row_index.get(user[1])
+                if row_number:
+                    updates.append({'range': f"A{row_number}", 'values': [self._user_to_row(user)]})
+                else:
+                    new_rows.append(self._user_to_row(user))
+            
+            if updates:
+                self.service.spreadsheets().values().batchUpdate(
+                    spreadsheetId=self.sheets_id,
+                    body={'valueInputOption': 'RAW', 'data': updates}
+                ).execute(num_retries=self.num_retries)
+            
+            if new_rows:
+                self.service.spreadsheets().values().append(
+                    spreadsheetId=self.sheets_id,
+                    range="A",
+                    valueInputOption='RAW',
+                    insertDataOption='INSERT_ROWS',
+                    body={'values': new_rows}
+                ).execute(num_retries=self.num_retries)
+            
+            logger.info(f"✅ Синхронизировано: обновлено {len(updates)}, добавлено {len(new_rows)} строк")
+            return True
+            
+        except HttpError as e:
+            logger.error(f"❌ Ошибка синхронизации с Google Sheets: {e}")
+            return False
+    
+    @SHEETS_SECONDS.labels('export_users_to_sheets').time()
     def export_users_to_sheets(self, users_data: List[Tuple]) -> bool:
         """
         Экспорт пользователей в Google Sheets
@@ -214,21 +337,7 @@ class GoogleSheetsService:
                 logger.info("📊 Таблица пуста, начинаем с нуля")
             
             # Подготавливаем данные для экспорта
-            export_data = []
-            for user in users_data:
-                # user: (id, telegram_id, first_name, last_name, phone, registration_timestamp, request, request_type, file_id)
-                row = [
-                    user[0],                    # ID
-                    user[1],                    # Telegram ID
-                    user[2] or '',              # Имя
-                    user[3] or '',              # Фамилия
-                    user[4] or '',              # Телефон
-                    user[5] or '',              # Дата регистрации
-                    user[6] or '',              # Запрос
-                    user[7] or '',              # Тип запроса
-                    user[8] or ''               # ID файла
-                ]
-                export_data.append(row)
+            export_data = [self._user_to_row(user) for user in users_data]
             
             # Если таблица пуста, добавляем заголовки и все данные
             if not existing_data:
@@ -256,18 +365,7 @@ class GoogleSheetsService:
                 new_users = []
                 for user in users_data:
                     if user[1] not in existing_telegram_ids:  # user[1] - telegram_id
-                        row = [
-                            user[0],                    # ID
-                            user[1],                    # Telegram ID
-                            user[2] or '',              # Имя
-                            user[3] or '',              # Фамилия
-                            user[4] or '',              # Телефон
-                            user[5] or '',              # Дата регистрации
-                            user[6] or '',              # Запрос
-                            user[7] or '',              # Тип запроса
-                            user[8] or ''               # ID файла
-                        ]
-                        new_users.append(row)
+                        new_users.append(self._user_to_row(user))
                 
                 if new_users:
                     # Добавляем только новые записи
@@ -290,7 +388,7 @@ class GoogleSheetsService:
         try:
             spreadsheet = self.service.spreadsheets().get(
                 spreadsheetId=self.sheets_id
-            ).execute()
+            ).execute(num_retries=self.num_retries)
             
             info = {
                 'title': spreadsheet.get('properties', {}).get('title', 'Неизвестно'),
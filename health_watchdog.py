@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Интеграция с watchdog systemd
+
+Бот сообщает systemd о своем состоянии по протоколу sd_notify (READY, WATCHDOG,
+STATUS, STOPPING) - датаграммой в сокет NOTIFY_SOCKET, без зависимостей.
+Сигнал WATCHDOG=1 отправляется из цикла событий и только если проверка прошла:
+  - задержка цикла событий меньше WATCHDOG_MAX_LOOP_LAG;
+  - простейший запрос к базе выполняется быстрее WATCHDOG_MAX_DB_SECONDS;
+  - последний успешный getUpdates был не раньше WATCHDOG_MAX_POLL_AGE секунд назад.
+Если цикл событий завис или проверка не проходит, сигналы прекращаются и по
+истечении WatchdogSec systemd перезапускает службу (Type=notify, WatchdogSec в
+naumova-bot.service). Вне systemd проверка работает так же, но сигналы не
+отправляются.
+"""
+import os
+import time
+import socket
+import asyncio
+import logging
+import faulthandler
+from typing import Optional
+
+from metrics import EVENT_LOOP_LAG, WATCHDOG_SKIPPED
+
+logger = logging.getLogger(__name__)
+
+MAX_LOOP_LAG = float(os.getenv('WATCHDOG_MAX_LOOP_LAG', '5'))
+MAX_DB_SECONDS = float(os.getenv('WATCHDOG_MAX_DB_SECONDS', '10'))
+MAX_POLL_AGE = float(os.getenv('WATCHDOG_MAX_POLL_AGE', '300'))
+# Интервал проверки без systemd watchdog (с ним - половина WatchdogSec)
+PROBE_INTERVAL = float(os.getenv('WATCHDOG_PROBE_INTERVAL', '10'))
+
+_socket = None
+# Время последнего успешного getUpdates (time.monotonic), см. note_get_updates
+_last_get_updates = None
+
+def sd_notify(state: str) -> bool:
+    """Отправка состояния systemd; без NOTIFY_SOCKET ничего не делает"""
+    global _socket
+    address = os.getenv('NOTIFY_SOCKET')
+    if not address:
+        return False
+    if address.startswith('@'):
+        # Абстрактное пространство имен сокетов Linux
+        address = '\0' + address[1:]
+    try:
+        if _socket is None:
+            _socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM | socket.SOCK_CLOEXEC)
+        _socket.sendto(state.encode('utf-8'), address)
+        return True
+    except OSError as e:
+        logger.warning(f"⚠️ Не удалось отправить состояние systemd: {e}")
+        return False
+
+def watchdog_seconds() -> Optional[float]:
+    """WatchdogSec службы в секундах или None, если watchdog не включен для этого процесса"""
+    usec = os.getenv('WATCHDOG_USEC')
+    pid = os.getenv('WATCHDOG_PID')
+    if not usec or (pid and int(pid) != os.getpid()):
+        return None
+    return int(usec) / 1_000_000
+
+def note_get_updates():
+    """Отметка успешного getUpdates (вызывается HTTP-клиентом бота)"""
+    global _last_get_updates
+    _last_get_updates = time.monotonic()
+
+class HealthProbe:
+    """Периодическая проверка здоровья бота и сигналы watchdog systemd"""
+
+    def __init__(self, db, interval: float = None):
+        self.db = db
+        timeout = watchdog_seconds()
+        self.watchdog = timeout is not None
+        self.interval = interval or (timeout / 2 if timeout else PROBE_INTERVAL)
+        self.ready = False
+        self.db_seconds = 0.0
+        self.poll_age = None
+        self._task = None
+
+    async def check(self) -> list:
+        """
+        Одна проверка (задержка цикла событий замеряется в run)
+
+        Returns:
+            Список нарушений; пустой - бот здоров
+        """
+        problems = []
+        started = time.perf_counter()
+        try:
+            # Запрос к базе в потоке: зависшая база не должна останавливать проверку
+            ok = await asyncio.wait_for(asyncio.to_thread(self.db.ping), MAX_DB_SECONDS)
+            if not ok:
+                problems.append(('db', "база данных недоступна"))
+        except asyncio.TimeoutError:
+            problems.append(('db', f"запрос к базе дольше {MAX_DB_SECONDS:g} с"))
+        self.db_seconds = time.perf_counter() - started
+
+        if _last_get_updates is not None:
+            self.poll_age = time.monotonic() - _last_get_updates
+            if self.poll_age > MAX_POLL_AGE:
+                problems.append(('poll', f"нет успешного getUpdates {self.poll_age:.0f} с"))
+        else:
+            self.poll_age = None
+        return problems
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            EVENT_LOOP_LAG.set(lag)
+
+            problems = await self.check()
+            if lag > MAX_LOOP_LAG:
+                problems.append(('loop_lag', f"задержка цикла событий {lag:.1f} с"))
+            poll = f"{self.poll_age:.0f} с назад" if self.poll_age is not None else "еще не было"
+            status = f"задержка цикла {lag * 1000:.0f} мс, база {self.db_seconds * 1000:.0f} мс, getUpdates {poll}"
+
+            if problems:
+                for reason, _ in problems:
+                    WATCHDOG_SKIPPED.labels(reason).inc()
+                message = '; '.join(text for _, text in problems)
+                logger.error(f"❌ Проверка здоровья не пройдена, сигнал watchdog не отправлен: {message}")
+                sd_notify(f"STATUS=Проблема: {message}")
+                continue
+
+            if not self.ready and self.poll_age is not None:
+                # Готовность - после первого успешного опроса Telegram
+                self.ready = True
+                sd_notify("READY=1")
+                logger.info("✅ Бот готов, systemd уведомлен" if self.watchdog else "✅ Бот готов")
+            notify = f"STATUS={status}"
+            if self.watchdog:
+                notify += "\nWATCHDOG=1"
+            sd_notify(notify)
+
+    async def start(self, application=None):
+        """Запуск проверки (подходит как post_init приложения)"""
+        if self.watchdog:
+            # При остановке по watchdog (SIGABRT) стеки всех потоков попадут в журнал
+            faulthandler.enable()
+            logger.info(f"🐕 Watchdog systemd: проверка каждые {self.interval:g} с")
+        self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self, application=None):
+        """Остановка проверки (подходит как post_stop приложения)"""
+        sd_notify("STOPPING=1")
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
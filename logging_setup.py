@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Настройка логирования: неблокирующая очередь и структурированный вывод
+
+Записи из кода бота только кладутся в очередь (QueueHandler), а форматирует
+и пишет их в stderr (journald под systemd) отдельный поток QueueListener.
+Если очередь переполнена, запись отбрасывается и учитывается в метрике
+log_records_dropped_total - объем логов не может замедлить обработку запросов.
+
+Формат (LOG_FORMAT):
+  kv    - ключ=значение в одну строку (по умолчанию)
+  json  - JSON в одну строку
+  text  - прежний формат "время - логгер - уровень - сообщение"
+Дополнительные поля передаются через extra: logger.info("...", extra={'telegram_id': 1}).
+
+Шумные логгеры прореживаются (LOG_SAMPLE="httpx=0.01,database=0.1"):
+из записей уровня INFO и ниже проходит заданная доля, предупреждения и
+ошибки проходят всегда.
+"""
+import os
+import sys
+import copy
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+from datetime import datetime
+
+from metrics import Counter
+from tracing import TraceIdFilter
+
+LOG_DROPPED = Counter('log_records_dropped_total', 'Записи лога, отброшенные из-за переполнения очереди')
+
+# Атрибуты LogRecord, которые не считаются пользовательскими полями
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+_listener = None
+
+def _extra_fields(record: logging.LogRecord) -> dict:
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS}
+
+def _timestamp(record: logging.LogRecord) -> str:
+    return datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds')
+
+class KeyValueFormatter(logging.Formatter):
+    """ts=... level=INFO logger=database msg="..." поле=значение"""
+
+    @staticmethod
+    def _quote(value) -> str:
+        text = str(value)
+        if not text or any(char in text for char in ' ="\n'):
+            return '"' + text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        return text
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = {'ts': _timestamp(record), 'level': record.levelname, 'logger': record.name,
+                  'msg': record.getMessage()}
+        fields.update(_extra_fields(record))
+        if record.exc_text:
+            fields['exc'] = record.exc_text
+        return ' '.join(f"{key}={self._quote(value)}" for key, value in fields.items())
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - один JSON-объект в строке"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = {'ts': _timestamp(record), 'level': record.levelname, 'logger': record.name,
+                  'msg': record.getMessage()}
+        fields.update(_extra_fields(record))
+        if record.exc_text:
+            fields['exc'] = record.exc_text
+        return json.dumps(fields, ensure_ascii=False, default=str)
+
+class SamplingFilter(logging.Filter):
+    """
+    Прореживание шумных логгеров
+
+    Пропускается каждая N-я запись (N = 1 / доля) - без генератора случайных
+    чисел и одинаково воспроизводимо. Правило логгера действует и на дочерние
+    логгеры (httpx -> httpx._client).
+    """
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.every = {name: max(1, round(1 / rate)) for name, rate in rates.items() if rate > 0}
+        self.muted = {name for name, rate in rates.items() if rate <= 0}
+        self.counters = dict.fromkeys(self.every, 0)
+
+    def _rule(self, name: str):
+        while name:
+            if name in self.every or name in self.muted:
+                return name
+            name = name.rpartition('.')[0]
+        return None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rule = self._rule(record.name)
+        if rule is None:
+            return True
+        if rule in self.muted:
+            return False
+        self.counters[rule] += 1
+        return self.counters[rule] % self.every[rule] == 1 or self.every[rule] == 1
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который при переполнении очереди отбрасывает запись, а не ждет"""
+
+    _exception_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Сообщение собирается здесь, потому что аргументы могут измениться после возврата;
+        # исключение превращается в текст, а форматирование строки остается потоку вывода
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc()
+
+def parse_sample_rates(value: str) -> dict:
+    """"httpx=0.01,database=0.1" -> {'httpx': 0.01, 'database': 0.1}"""
+    rates = {}
+    for item in value.split(','):
+        name, _, rate = item.partition('=')
+        if name.strip() and rate.strip():
+            rates[name.strip()] = float(rate)
+    return rates
+
+def setup_logging(level: str = None, log_format: str = None, sample: str = None) -> logging.Logger:
+    """
+    Настройка корневого логгера (повторный вызов ничего не меняет)
+
+    По умолчанию LOG_LEVEL (INFO), LOG_FORMAT (kv), LOG_SAMPLE (httpx=0.01)
+    и LOG_QUEUE_SIZE (10000 записей).
+    """
+    global _listener
+    root = logging.getLogger()
+    if _listener is not None:
+        return root
+
+    level = (level or os.getenv('LOG_LEVEL', 'INFO')).upper()
+    log_format = log_format or os.getenv('LOG_FORMAT', 'kv')
+    sample = os.getenv('LOG_SAMPLE', 'httpx=0.01') if sample is None else sample
+
+    output = logging.StreamHandler(sys.stderr)
+    if log_format == 'json':
+        output.setFormatter(JsonFormatter())
+    elif log_format == 'text':
+        output.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    else:
+        output.setFormatter(KeyValueFormatter())
+
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=int(os.getenv('LOG_QUEUE_SIZE', '10000'))))
+    # trace_id добавляется до постановки в очередь - в потоке вывода трассы уже не видно
+    handler.addFilter(TraceIdFilter())
+    rates = parse_sample_rates(sample)
+    if rates:
+        handler.addFilter(SamplingFilter(rates))
+
+    # Как basicConfig(force=True): модули могли настроить корневой логгер при импорте
+    for old_handler in root.handlers[:]:
+        root.removeHandler(old_handler)
+        old_handler.close()
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    # При завершении дописываем накопившиеся записи
+    atexit.register(_listener.stop)
+    return root
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Локальный архив медиафайлов запросов
+
+В базе хранятся только file_id Telegram: администратор видит фото, голосовые
+и видеокружки, пока Telegram хранит файл. Архив скачивает их в фоне и хранит
+на диске по содержимому: путь - sha256 файла (MEDIA_ARCHIVE_DIR/ab/abcd...),
+поэтому одинаковые файлы лежат один раз. Файл, уже обработанный архивом
+(тот же file_unique_id), повторно не скачивается. В базе (media_files)
+записываются путь, размер и время последнего использования.
+
+Обработчики только ставят файл в очередь в памяти (enqueue, без ожидания);
+скачивают MEDIA_ARCHIVE_CONCURRENCY фоновых задач. Если очередь переполнена
+или бот остановился раньше, файл будет найден при следующем запуске: процесс
+с фоновыми задачами (start_background_services) сверяет запросы с архивом.
+
+Размер архива ограничен MEDIA_ARCHIVE_QUOTA_MB: при превышении удаляются
+давно не использованные файлы (LRU). Использованием считается отправка
+сохраненной копии администратору (use_media).
+"""
+import os
+import hashlib
+import asyncio
+import logging
+from typing import Optional
+
+from telegram.error import BadRequest
+
+from storage import Storage
+from metrics import MEDIA_ARCHIVE_FILES, MEDIA_ARCHIVE_BYTES, MEDIA_ARCHIVE_QUEUE
+
+logger = logging.getLogger(__name__)
+
+# Пустое значение отключает архив
+MEDIA_ARCHIVE_DIR = os.getenv('MEDIA_ARCHIVE_DIR', 'media_archive')
+MEDIA_ARCHIVE_QUOTA_MB = float(os.getenv('MEDIA_ARCHIVE_QUOTA_MB', '1024'))
+MEDIA_ARCHIVE_CONCURRENCY = int(os.getenv('MEDIA_ARCHIVE_CONCURRENCY', '4'))
+MEDIA_ARCHIVE_QUEUE_SIZE = int(os.getenv('MEDIA_ARCHIVE_QUEUE_SIZE', '10000'))
+
+# Файлов за один запрос к базе при сверке и вытеснении
+CATCH_UP_BATCH = 500
+EVICT_BATCH = 100
+HASH_CHUNK_SIZE = 1024 * 1024
+
+class MediaArchive:
+    """Фоновое скачивание медиафайлов в хранилище по содержимому с квотой"""
+
+    def __init__(self, db: Storage, root: str = MEDIA_ARCHIVE_DIR, quota_mb: float = MEDIA_ARCHIVE_QUOTA_MB,
+                 concurrency: int = MEDIA_ARCHIVE_CONCURRENCY):
+        self.db = db
+        self.root = root
+        self.quota_bytes = int(quota_mb * 1024 * 1024)
+        self.concurrency = concurrency
+        self.queue = asyncio.Queue(MEDIA_ARCHIVE_QUEUE_SIZE)
+        # Сверка запросов с архивом при запуске (только в одном процессе)
+        self.catch_up = False
+        self.bot = None
+        self.usage = 0
+        self._recorded = 0
+        self._tasks = []
+        self._evict_lock = asyncio.Lock()
+
+    def enqueue(self, file_id: str, file_unique_id: Optional[str] = None) -> bool:
+        """Постановка файла в очередь скачивания без ожидания; False - очередь переполнена"""
+        try:
+            self.queue.put_nowait((file_id, file_unique_id))
+        except asyncio.QueueFull:
+            MEDIA_ARCHIVE_FILES.labels('dropped').inc()
+            return False
+        MEDIA_ARCHIVE_QUEUE.set(self.queue.qsize())
+        return True
+
+    def full_path(self, path: str) -> str:
+        return os.path.join(self.root, path)
+
+    async def start(self, application):
+        """Запуск фоновых задач (после Application.start)"""
+        self.bot = application.bot
+        os.makedirs(os.path.join(self.root, 'tmp'), exist_ok=True)
+        self.usage = await asyncio.to_thread(self.db.get_media_usage)
+        MEDIA_ARCHIVE_BYTES.set(self.usage)
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.concurrency)]
+        if self.catch_up:
+            self._tasks.append(loop.create_task(self._catch_up()))
+        logger.info(f"✅ Архив медиафайлов: {self.root}, {self.usage / 1024 / 1024:.1f} из "
+                    f"{self.quota_bytes / 1024 / 1024:.0f} МБ")
+
+    async def stop(self):
+        """Остановка фоновых задач; необработанные файлы найдет сверка при следующем запуске"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self):
+        while True:
+            file_id, file_unique_id = await self.queue.get()
+            MEDIA_ARCHIVE_QUEUE.set(self.queue.qsize())
+            try:
+                result = await self.archive(file_id, file_unique_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Сбой сети или диска: файл остается неархивированным до следующей сверки
+                logger.warning(f"⚠️ Не удалось сохранить медиафайл в архив: {e}")
+                result = 'error'
+            finally:
+                self.queue.task_done()
+            MEDIA_ARCHIVE_FILES.labels(result).inc()
+
+    async def archive(self, file_id: str, file_unique_id: Optional[str] = None) -> str:
+        """
+        Скачивание одного файла в архив
+
+        Returns:
+            'stored' - сохранен, 'duplicate' - уже был в архиве,
+            'failed' - Telegram не отдает файл (запись с пустым путем, повторно не скачивается)
+        """
+        if file_unique_id and await asyncio.to_thread(self.db.has_media, file_unique_id):
+            await asyncio.to_thread(self.db.link_media, file_id, file_unique_id)
+            self._recorded += 1
+            return 'duplicate'
+        try:
+            telegram_file = await self.bot.get_file(file_id)
+        except BadRequest as e:
+            # Файл удален или больше 20 МБ (предел Bot API)
+            logger.warning(f"⚠️ Медиафайл недоступен для архива: {e}")
+            await asyncio.to_thread(self.db.save_media, file_unique_id or file_id, file_id)
+            self._recorded += 1
+            return 'failed'
+        file_unique_id = telegram_file.file_unique_id
+        if await asyncio.to_thread(self.db.has_media, file_unique_id):
+            await asyncio.to_thread(self.db.link_media, file_id, file_unique_id)
+            self._recorded += 1
+            return 'duplicate'
+
+        temp_path = os.path.join(self.root, 'tmp', f"{file_unique_id}.part")
+        await telegram_file.download_to_drive(temp_path)
+        extension = os.path.splitext(telegram_file.file_path or '')[1]
+        path, sha256, size, added = await asyncio.to_thread(self._store, temp_path, extension)
+        await asyncio.to_thread(self.db.save_media, file_unique_id, file_id, path, sha256, size)
+        self._recorded += 1
+        if added:
+            self.usage += size
+            MEDIA_ARCHIVE_BYTES.set(self.usage)
+            if self.usage > self.quota_bytes:
+                await self.evict()
+        return 'stored'
+
+    def _store(self, temp_path: str, extension: str):
+        """Перенос скачанного файла по адресу содержимого; одинаковое содержимое хранится один раз"""
+        digest = hashlib.sha256()
+        with open(temp_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        sha256 = digest.hexdigest()
+        size = os.path.getsize(temp_path)
+        path = os.path.join(sha256[:2], sha256 + extension)
+        full_path = self.full_path(path)
+        if os.path.exists(full_path):
+            os.remove(temp_path)
+            return path, sha256, size, False
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        os.replace(temp_path, full_path)
+        return path, sha256, size, True
+
+    async def evict(self):
+        """Удаление давно не использованных файлов, пока архив больше квоты"""
+        async with self._evict_lock:
+            # Точный размер из базы: файлы могли добавить и другие процессы бота
+            self.usage = await asyncio.to_thread(self.db.get_media_usage)
+            evicted = 0
+            while self.usage > self.quota_bytes:
+                batch = await asyncio.to_thread(self.db.get_lru_media, EVICT_BATCH)
+                if not batch:
+                    break
+                for file_unique_id, path, size in batch:
+                    if self.usage <= self.quota_bytes:
+                        break
+                    if await asyncio.to_thread(self.db.evict_media, file_unique_id):
+                        try:
+                            os.remove(self.full_path(path))
+                        except FileNotFoundError:
+                            pass
+                        self.usage -= size
+                        evicted += 1
+            MEDIA_ARCHIVE_BYTES.set(self.usage)
+            if evicted:
+                logger.info(f"🗑 Архив медиафайлов: вытеснено {evicted} файлов, "
+                            f"размер {self.usage / 1024 / 1024:.1f} МБ")
+
+    async def _catch_up(self):
+        """Сверка запросов с архивом: файлы, не попавшие в очередь (переполнение, перезапуск)"""
+        total = 0
+        while True:
+            file_ids = await asyncio.to_thread(self.db.get_unarchived_media, CATCH_UP_BATCH)
+            if not file_ids:
+                break
+            recorded = self._recorded
+            for file_id in file_ids:
+                await self.queue.put((file_id, None))
+            MEDIA_ARCHIVE_QUEUE.set(self.queue.qsize())
+            await self.queue.join()
+            if self._recorded == recorded:
+                # Ни один файл не записан (нет сети) - продолжим при следующем запуске
+                logger.warning("⚠️ Сверка архива медиафайлов прервана: файлы не скачиваются")
+                return
+            total += len(file_ids)
+        if total:
+            logger.info(f"✅ Сверка архива медиафайлов: обработано {total} файлов")
+
+def local_copy(db: Storage, file_id: str, root: str = MEDIA_ARCHIVE_DIR) -> Optional[str]:
+    """Путь сохраненной копии файла (с отметкой использования) или None"""
+    if not root:
+        return None
+    path = db.use_media(file_id)
+    if path is None:
+        return None
+    full_path = os.path.join(root, path)
+    return full_path if os.path.exists(full_path) else None
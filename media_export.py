@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Выгрузка медиафайлов запросов за период в ZIP-архивы
+
+Запросы выбираются по индексу времени регистрации (Storage.iter_users).
+Файл берется из локального архива (media_archive.py), а если его там нет -
+скачивается из Telegram; скачивания идут параллельно (MEDIA_EXPORT_CONCURRENCY),
+но в архив файлы пишутся в порядке регистрации. В памяти одновременно не
+больше MEDIA_EXPORT_CONCURRENCY скачанных файлов: архив пишется на диск,
+локальные копии переписываются в него потоково.
+
+Архив больше ограничения Telegram на документ делится на части - каждая часть
+самостоятельный ZIP со своим manifest.csv (файл, пользователь, запрос, источник;
+недоступные файлы тоже перечисляются). Готовая часть сразу отдается на отправку,
+пока собирается следующая.
+"""
+import io
+import os
+import csv
+import shutil
+import asyncio
+import contextlib
+import logging
+import zipfile
+from collections import deque
+from typing import Awaitable, Callable, List, NamedTuple, Optional, Tuple
+
+from storage import Storage
+from file_export import TELEGRAM_DOCUMENT_LIMIT, csv_cell
+from media_archive import local_copy
+
+logger = logging.getLogger(__name__)
+
+MEDIA_EXPORT_CONCURRENCY = int(os.getenv('MEDIA_EXPORT_CONCURRENCY', '8'))
+
+MEDIA_TYPES = ('photo', 'voice', 'video_note')
+EXTENSIONS = {'photo': '.jpg', 'voice': '.ogg', 'video_note': '.mp4'}
+
+MANIFEST_HEADERS = ['Файл', 'Telegram ID', 'Имя', 'Фамилия', 'Телефон', 'Дата регистрации',
+                    'Тип запроса', 'Запрос', 'Источник']
+
+# Запас части под manifest.csv и центральный каталог ZIP
+PART_RESERVE = 1024 * 1024
+# Заголовки ZIP на один файл (локальный, центральный каталог, дескриптор данных, zip64) без имени
+ZIP_ENTRY_OVERHEAD = 30 + 46 + 24 + 40
+
+class MediaEntry(NamedTuple):
+    """Один файл запроса: имя в архиве и строка пользователя"""
+    name: str
+    file_id: str
+    user: Tuple
+
+def collect_entries(db: Storage, date_from: Optional[str] = None, date_to: Optional[str] = None) -> List[MediaEntry]:
+    """Файлы запросов пользователей, зарегистрированных в период (даты YYYY-MM-DD, date_to включительно)"""
+    users = [user for user in db.iter_users(date_from, date_to) if user[8] and user[7] in MEDIA_TYPES]
+    # Файлы альбомов всех пользователей периода - одним запросом
+    albums = db.get_request_files_by_telegram_ids([user[1] for user in users if user[7] == 'photo'])
+    entries = []
+    for user in users:
+        request_type, file_id = user[7], user[8]
+        album = albums.get(user[1], [])
+        prefix = f"{str(user[5])[:10]}_{user[1]}"
+        extension = EXTENSIONS[request_type]
+        if len(album) > 1:
+            entries.extend(MediaEntry(f"{prefix}_{position + 1}{extension}", album_file_id, user)
+                           for position, album_file_id in enumerate(album))
+        else:
+            entries.append(MediaEntry(f"{prefix}{extension}", file_id, user))
+    return entries
+
+class PartedZipWriter:
+    """ZIP-архивы на диске, разделенные на части не больше part_limit байт"""
+
+    def __init__(self, directory: str, base_name: str, part_limit: int = TELEGRAM_DOCUMENT_LIMIT):
+        self.directory = directory
+        self.base_name = base_name
+        self.part_limit = part_limit - PART_RESERVE
+        self.parts = 0
+        self.path = None
+        self._zip = None
+        self._size = 0
+        self._manifest = []
+
+    def _part_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"{self.base_name}_{number}.zip")
+
+    def _open(self):
+        self.parts += 1
+        self.path = self._part_path(self.parts)
+        self._zip = zipfile.ZipFile(self.path, 'w', zipfile.ZIP_STORED, allowZip64=True)
+        self._size = 0
+        self._manifest = []
+
+    def add(self, entry: MediaEntry, source: str, data=None, path: Optional[str] = None) -> Optional[str]:
+        """
+        Запись файла (data - содержимое, path - файл на диске; без них - только строка manifest)
+
+        Returns:
+            Путь завершенной части, если для файла пришлось начать новую
+
+        Raises:
+            FileNotFoundError: файла path уже нет (архив ничего не записал)
+        """
+        # Файл открывается до записи в архив: если его успели удалить, архив не меняется,
+        # а после открытия удаление уже не мешает дочитать
+        with open(path, 'rb') if path else contextlib.nullcontext() as source_file:
+            size = len(data) if data is not None else os.fstat(source_file.fileno()).st_size if path else 0
+            entry_size = size + ZIP_ENTRY_OVERHEAD + 2 * len(entry.name.encode())
+            finished = None
+            if self._zip is not None and self._size and self._size + entry_size > self.part_limit:
+                finished = self.close()
+            if self._zip is None:
+                self._open()
+            if data is not None or path:
+                # Медиафайлы уже сжаты - хранятся без сжатия
+                with self._zip.open(entry.name, 'w', force_zip64=size > 0x7fffffff) as target:
+                    if data is not None:
+                        target.write(data)
+                    else:
+                        shutil.copyfileobj(source_file, target, 1024 * 1024)
+                self._size += entry_size
+        user = entry.user
+        self._manifest.append([entry.name if source != 'недоступен' else '', user[1], user[2], user[3] or '',
+                               user[4], user[5], user[7], user[6], source])
+        return finished
+
+    def close(self) -> Optional[str]:
+        """Завершение текущей части (manifest.csv и центральный каталог); путь части или None"""
+        if self._zip is None:
+            return None
+        manifest = io.StringIO()
+        writer = csv.writer(manifest)
+        writer.writerow(MANIFEST_HEADERS)
+        writer.writerows([csv_cell(value) for value in row] for row in self._manifest)
+        # utf-8-sig - чтобы Excel корректно открыл кириллицу
+        self._zip.writestr('manifest.csv', manifest.getvalue().encode('utf-8-sig'), zipfile.ZIP_DEFLATED)
+        self._zip.close()
+        self._zip = None
+        return self.path
+
+async def export_media(db: Storage, bot, directory: str, send_part: Callable[[str, int], Awaitable[None]],
+                       date_from: Optional[str] = None, date_to: Optional[str] = None,
+                       concurrency: int = MEDIA_EXPORT_CONCURRENCY) -> Tuple[int, int, int]:
+    """
+    Выгрузка медиафайлов запросов за период
+
+    send_part(путь, номер) вызывается для каждой готовой части; часть удаляется
+    после отправки. Следующая часть собирается, пока отправляется предыдущая.
+
+    Returns:
+        (файлов в архиве, недоступных файлов, частей)
+    """
+    entries = await asyncio.to_thread(collect_entries, db, date_from, date_to)
+    if not entries:
+        return 0, 0, 0
+    period = f"{date_from or 'начало'}_{date_to or 'сейчас'}"
+    writer = PartedZipWriter(directory, f"media_{period}")
+
+    async def fetch(entry: MediaEntry):
+        """Локальная копия (путь) или содержимое из Telegram"""
+        path = await asyncio.to_thread(local_copy, db, entry.file_id)
+        if path:
+            return 'архив', None, path
+        return await download(entry)
+
+    async def download(entry: MediaEntry):
+        """Содержимое файла из Telegram"""
+        try:
+            telegram_file = await bot.get_file(entry.file_id)
+            return 'telegram', await telegram_file.download_as_bytearray(), None
+        except Exception as e:
+            logger.warning(f"⚠️ Медиафайл {entry.name} недоступен: {e}")
+            return 'недоступен', None, None
+
+    sending = None
+    parts = 0
+
+    async def hand_over(path: str):
+        """Отправка готовой части после предыдущей (порядок частей сохраняется)"""
+        nonlocal sending, parts
+        if sending is not None:
+            await sending
+        parts += 1
+        number = parts
+
+        async def send():
+            try:
+                await send_part(path, number)
+            finally:
+                os.remove(path)
+
+        sending = asyncio.get_running_loop().create_task(send())
+
+    # Скользящее окно скачиваний: не больше concurrency файлов в памяти, запись - по порядку
+    pending = deque()
+    exported = missing = 0
+
+    async def write_next():
+        nonlocal exported, missing
+        entry, task = pending.popleft()
+        source, data, path = await task
+        try:
+            finished = await asyncio.to_thread(writer.add, entry, source, data, path)
+        except FileNotFoundError:
+            # Локальную копию вытеснили из архива (MediaArchive.evict) после local_copy
+            source, data, path = await download(entry)
+            finished = await asyncio.to_thread(writer.add, entry, source, data, path)
+        if source == 'недоступен':
+            missing += 1
+        else:
+            exported += 1
+        if finished:
+            await hand_over(finished)
+
+    try:
+        for entry in entries:
+            pending.append((entry, asyncio.ensure_future(fetch(entry))))
+            if len(pending) >= concurrency:
+                await write_next()
+        while pending:
+            await write_next()
+        last = await asyncio.to_thread(writer.close)
+        if last:
+            await hand_over(last)
+        if sending is not None:
+            await sending
+    finally:
+        for _, task in pending:
+            task.cancel()
+        if sending is not None:
+            sending.cancel()
+    return exported, missing, parts
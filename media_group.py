@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Сборка альбомов (media group) в один запрос
+
+Альбом из нескольких фото Telegram доставляет отдельными сообщениями с общим
+media_group_id, без признака последней части. Части собираются в буфере по
+media_group_id: группа считается полной, когда MEDIA_GROUP_WAIT секунд не
+приходило новых частей (или набралось MEDIA_GROUP_MAX_PARTS - больше в альбоме
+не бывает). После этого обработчик получает все части сразу: одна запись в
+базу и один ответ пользователю вместо записи и ответа на каждое фото.
+
+Части одного альбома приходят подряд от одного пользователя; в режиме
+webhook_supervisor.py они попадают в один процесс, поэтому буфер - в памяти
+процесса. При остановке бота собранные части обрабатываются сразу (flush).
+"""
+import os
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List
+
+from telegram import Message
+
+logger = logging.getLogger(__name__)
+
+MEDIA_GROUP_WAIT = float(os.getenv('MEDIA_GROUP_WAIT', '1.0'))
+# Telegram: не больше 10 элементов в альбоме
+MEDIA_GROUP_MAX_PARTS = 10
+
+class _Group:
+    __slots__ = ('messages', 'timer')
+
+    def __init__(self):
+        self.messages: List[Message] = []
+        self.timer = None
+
+class MediaGroupBuffer:
+    """Буфер частей альбомов с отложенной обработкой группы целиком"""
+
+    def __init__(self, on_group: Callable[[List[Message]], Awaitable[None]], wait: float = MEDIA_GROUP_WAIT):
+        self.on_group = on_group
+        self.wait = wait
+        self._groups: Dict[str, _Group] = {}
+        self._tasks = set()
+
+    def __contains__(self, media_group_id) -> bool:
+        return media_group_id in self._groups
+
+    def add(self, message: Message) -> bool:
+        """Добавление части альбома; True - это первая часть группы"""
+        group = self._groups.get(message.media_group_id)
+        first = group is None
+        if first:
+            group = self._groups[message.media_group_id] = _Group()
+        else:
+            group.timer.cancel()
+        group.messages.append(message)
+        if len(group.messages) >= MEDIA_GROUP_MAX_PARTS:
+            self._release(message.media_group_id)
+        else:
+            group.timer = asyncio.get_running_loop().call_later(self.wait, self._release, message.media_group_id)
+        return first
+
+    def _release(self, media_group_id):
+        group = self._groups.pop(media_group_id, None)
+        if group is None:
+            return
+        if group.timer:
+            group.timer.cancel()
+        # Части могли прийти не по порядку - порядок альбома задают message_id
+        messages = sorted(group.messages, key=lambda message: message.message_id)
+        task = asyncio.get_running_loop().create_task(self._run(messages))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, messages: List[Message]):
+        try:
+            await self.on_group(messages)
+        except Exception as e:
+            logger.exception(f"❌ Ошибка при обработке альбома {messages[0].media_group_id}: {e}")
+
+    async def flush(self):
+        """Обработка всех собранных групп без ожидания (остановка бота)"""
+        for media_group_id in list(self._groups):
+            self._release(media_group_id)
+        if self._tasks:
+            await asyncio.gather(*self._tasks)
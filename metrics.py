@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+Легковесный реестр метрик с выдачей в текстовом формате Prometheus
+
+Запись метрики на горячем пути - это поиск корзины bisect и пара
+арифметических операций без блокировок (меньше микросекунды). Метрики
+пишутся из потока бота и фоновых потоков; при одновременной записи в одну
+и ту же метрику из разных потоков редкое приращение может потеряться, для
+мониторинга это допустимо.
+
+Метрики отдаются HTTP-сервером на METRICS_HOST:METRICS_PORT (/metrics).
+Использование:
+  python metrics.py        - замер накладных расходов записи
+"""
+import os
+import time
+import inspect
+import logging
+import functools
+import threading
+from bisect import bisect_left
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from tracing import record_span
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм по умолчанию, секунды
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Registry:
+    """Набор метрик, выдаваемых вместе"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus 0.0.4"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+class _Timer:
+    """Замер длительности: контекстный менеджер и декоратор (обычных и async функций)"""
+
+    __slots__ = ('_child', '_started')
+
+    def __init__(self, child):
+        self._child = child
+        self._started = 0.0
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter() - self._started
+        self._child.observe(duration)
+        if self._child.span:
+            record_span(*self._child.span, self._started, duration)
+
+    def __call__(self, func):
+        child = self._child
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    duration = time.perf_counter() - started
+                    child.observe(duration)
+                    if child.span:
+                        record_span(*child.span, started, duration)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                duration = time.perf_counter() - started
+                child.observe(duration)
+                if child.span:
+                    record_span(*child.span, started, duration)
+        return wrapper
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+class _GaugeChild:
+    __slots__ = ('value', '_function')
+
+    def __init__(self):
+        self.value = 0
+        self._function = None
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set_function(self, function):
+        """Значение вычисляется вызовом function при каждой выдаче метрик"""
+        self._function = function
+
+    def get(self):
+        if self._function is None:
+            return self.value
+        try:
+            return self._function()
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка вычисления метрики: {e}")
+            return float('nan')
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', 'span')
+
+    def __init__(self, bounds, span=None):
+        self.bounds = bounds
+        # (вид, имя) интервала трассы, который пишется при замере через time()
+        self.span = span
+        # Последняя корзина - значения больше всех границ (+Inf)
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def time(self) -> _Timer:
+        return _Timer(self)
+
+class _Metric:
+    type_name = ''
+
+    def __init__(self, name: str, documentation: str, labelnames=(), registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self._children[()] = self._new_child(())
+        registry.register(self)
+
+    def _new_child(self, key):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """
+        Метрика с конкретными значениями меток
+
+        На горячем пути лучше один раз сохранить результат labels() и
+        дальше пользоваться им - так не тратится время на поиск в словаре.
+        """
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name}: ожидаются метки {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child(key))
+        return child
+
+    def _items(self):
+        return sorted(self._children.items())
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def _new_child(self, key):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def collect(self):
+        for key, child in self._items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"
+
+class Gauge(_Metric):
+    type_name = 'gauge'
+
+    def _new_child(self, key):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._default.set(value)
+
+    def set_function(self, function):
+        self._default.set_function(function)
+
+    def collect(self):
+        for key, child in self._items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.get())}"
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS,
+                 registry: Registry = REGISTRY, span_kind: str = None):
+        self.buckets = tuple(sorted(buckets))
+        # Замеры через time() также пишутся интервалами трассы span_kind
+        self.span_kind = span_kind
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self, key=()):
+        span = (self.span_kind, ':'.join(key) or self.name) if self.span_kind else None
+        return _HistogramChild(self.buckets, span)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def time(self) -> _Timer:
+        return self._default.time()
+
+    def collect(self):
+        for key, child in self._items():
+            counts = list(child.counts)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, (('le', _format_value(float(bound))),))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(child.sum)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+# Метрики бота
+HANDLER_SECONDS = Histogram('bot_handler_duration_seconds', 'Длительность обработчиков бота', ['handler'])
+HANDLER_ERRORS = Counter('bot_handler_errors_total', 'Исключения в обработчиках бота', ['handler'])
+UPDATE_QUEUE_DEPTH = Gauge('bot_update_queue_depth', 'Необработанные обновления в очереди бота')
+DB_QUERY_SECONDS = Histogram('db_query_duration_seconds', 'Длительность запросов к SQLite', ['query'],
+                             span_kind='db')
+TELEGRAM_API_SECONDS = Histogram('telegram_api_duration_seconds', 'Длительность вызовов Telegram Bot API',
+                                 ['method'], buckets=DEFAULT_BUCKETS + (60.0,))
+TELEGRAM_API_ERRORS = Counter('telegram_api_errors_total', 'Ошибки вызовов Telegram Bot API', ['method', 'error'])
+SHEETS_SECONDS = Histogram('sheets_export_duration_seconds', 'Длительность выгрузки в Google Sheets',
+                           ['operation'], buckets=DEFAULT_BUCKETS + (60.0, 300.0), span_kind='sheets')
+SHEETS_OUTBOX_DEPTH = Gauge('sheets_outbox_depth', 'Изменения, ожидающие синхронизации с Google Sheets')
+BACKUP_SIZE_BYTES = Gauge('backup_size_bytes', 'Размер последней резервной копии', ['kind', 'stage'])
+BACKUP_SECONDS = Histogram('backup_duration_seconds', 'Длительность создания и отправки резервной копии',
+                           ['kind'], buckets=(1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0))
+BACKUP_FAILURES = Counter('backup_failures_total', 'Неудачные запуски резервного копирования')
+EVENT_LOOP_LAG = Gauge('bot_event_loop_lag_seconds', 'Задержка цикла событий бота при последней проверке')
+WATCHDOG_SKIPPED = Counter('bot_watchdog_skipped_total', 'Пропущенные сигналы watchdog по причинам', ['reason'])
+DUPLICATE_UPDATES = Counter('bot_duplicate_updates_total', 'Повторно доставленные обновления, отсеянные до обработчиков',
+                            ['key'])
+# Архив медиафайлов (media_archive.py)
+MEDIA_ARCHIVE_FILES = Counter('media_archive_files_total', 'Файлы, обработанные архивом медиафайлов, по результату',
+                              ['result'])
+MEDIA_ARCHIVE_BYTES = Gauge('media_archive_bytes', 'Размер архива медиафайлов (оценка процесса)')
+MEDIA_ARCHIVE_QUEUE = Gauge('media_archive_queue_depth', 'Файлы, ожидающие скачивания в архив')
+# Журнал событий (event_journal.py)
+EVENT_JOURNAL_EVENTS = Counter('event_journal_events_total', 'События, записанные в журнал, по типам', ['event'])
+EVENT_JOURNAL_FLUSH_SECONDS = Histogram('event_journal_flush_duration_seconds',
+                                        'Запись группы событий журнала на диск с fsync')
+EVENT_JOURNAL_BUFFER = Gauge('event_journal_buffered_events', 'События журнала, ожидающие записи на диск')
+# Режим нескольких процессов (webhook_supervisor.py)
+WEBHOOK_UPDATES = Counter('webhook_updates_total', 'Обновления, принятые webhook и переданные процессу', ['worker'])
+WEBHOOK_REJECTED = Counter('webhook_rejected_total', 'Отклоненные запросы webhook по причинам', ['reason'])
+WORKER_QUEUE_DEPTH = Gauge('webhook_worker_queue_depth', 'Обновления в очереди процесса-обработчика', ['worker'])
+WORKER_HEARTBEAT_AGE = Gauge('webhook_worker_heartbeat_age_seconds',
+                             'Время с последнего сигнала жизни процесса-обработчика', ['worker'])
+WORKER_RESTARTS = Counter('webhook_worker_restarts_total', 'Перезапуски процессов-обработчиков по причинам',
+                          ['worker', 'reason'])
+
+def instrument_handler(func):
+    """Декоратор обработчика бота: гистограмма длительности, счетчик исключений и интервал трассы"""
+    timing = HANDLER_SECONDS.labels(func.__name__)
+    errors = HANDLER_ERRORS.labels(func.__name__)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        error = None
+        try:
+            return await func(*args, **kwargs)
+        except Exception as e:
+            errors.inc()
+            error = type(e).__name__
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            timing.observe(duration)
+            record_span('handler', func.__name__, started, duration, error)
+    return wrapper
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_http_server(port: int = None, host: str = None):
+    """
+    Запуск HTTP-сервера метрик в фоновом потоке
+
+    По умолчанию METRICS_PORT (0 или пусто - сервер не запускается) и
+    METRICS_HOST (127.0.0.1 - метрики доступны только локально).
+    """
+    if port is None:
+        port = int(os.getenv('METRICS_PORT') or 0)
+    if not port:
+        return None
+    host = host or os.getenv('METRICS_HOST', '127.0.0.1')
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+    logger.info(f"📈 Метрики доступны на http://{host}:{server.server_port}/metrics")
+    return server
+
+def main():
+    registry = Registry()
+    histogram = Histogram('bench_seconds', 'Замер', ['name'], registry=registry).labels('x')
+    counter = Counter('bench_total', 'Замер', ['name'], registry=registry).labels('x')
+    iterations = 1_000_000
+    # Время включает цикл и вызов лямбды - это оценка сверху
+    for label, record in (('Histogram.observe', lambda: histogram.observe(0.003)),
+                          ('Counter.inc', lambda: counter.inc())):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            record()
+        elapsed = time.perf_counter() - started
+        print(f"{label}: {elapsed / iterations * 1e9:.0f} нс на запись")
+
+if __name__ == "__main__":
+    main()
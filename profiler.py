@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Профилирование работающего бота по команде администратора
+
+Сэмплирующий профилировщик: отдельный поток с заданным интервалом снимает
+стеки всех потоков процесса (sys._current_frames) - цикла событий бота,
+потоков asyncio.to_thread, синхронизации и резервного копирования. Код бота
+не инструментируется, поэтому накладные расходы малы и профилировать можно
+под реальной нагрузкой без перезапуска.
+
+Результат - файл в формате collapsed stacks (строка "поток;функция;...;функция N"),
+который принимают flamegraph.pl и speedscope, и сводка самых частых функций.
+Отдельно - снимок выделений памяти (tracemalloc): места с наибольшим объемом
+и приростом за окно наблюдения.
+
+Проверка на месте: python profiler.py [секунды]
+"""
+import os
+import sys
+import time
+import asyncio
+import threading
+import tracemalloc
+from collections import Counter
+
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '10'))
+PROFILE_MAX_SECONDS = int(os.getenv('PROFILE_MAX_SECONDS', '300'))
+
+# Функции ожидания: поток в них простаивает, в сводке горячих мест они не нужны
+IDLE_FUNCTIONS = {
+    'select', 'poll', 'epoll', 'wait', '_wait_for_tstate_lock', 'sleep', 'get', 'accept',
+    '_worker', 'run_forever', '_run_once',
+}
+
+# Одновременно работает только один профилировщик
+_active = threading.Lock()
+
+class ProfilerBusyError(RuntimeError):
+    """Профилирование уже запущено"""
+
+def is_running() -> bool:
+    return _active.locked()
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class SamplingProfiler:
+    """Сэмплирующий профилировщик всех потоков процесса"""
+
+    def __init__(self, interval: float = None):
+        self.interval = (interval if interval is not None else PROFILE_INTERVAL_MS / 1000)
+        self.stacks = Counter()
+        self.samples = 0
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        self._labels = {}
+
+    def _label(self, code) -> str:
+        # Подпись кадра строится один раз на объект кода
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = _frame_label(code)
+        return label
+
+    def _sample(self, own_id: int):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(self._label(frame.f_code))
+                frame = frame.f_back
+            labels.append(names.get(thread_id, f"thread-{thread_id}"))
+            self.stacks[';'.join(reversed(labels))] += 1
+        self.samples += 1
+
+    def _run(self):
+        own_id = threading.get_ident()
+        started = time.perf_counter()
+        next_sample = started
+        while not self._stop.is_set():
+            self._sample(own_id)
+            next_sample += self.interval
+            delay = next_sample - time.perf_counter()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                # Не успеваем - не пытаемся догнать пачкой снимков
+                next_sample = time.perf_counter()
+        self.elapsed = time.perf_counter() - started
+
+    def start(self):
+        if not _active.acquire(blocking=False):
+            raise ProfilerBusyError("Профилирование уже запущено")
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        _active.release()
+
+    def collapsed(self) -> str:
+        """Стеки в формате collapsed stacks (flamegraph.pl, speedscope)"""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top(self, limit: int = 15) -> list:
+        """
+        Самые частые функции без учета простоя
+
+        Returns:
+            list: (функция, доля снимков на вершине стека, доля снимков в стеке)
+        """
+        own = Counter()
+        total = Counter()
+        busy = 0
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')[1:]
+            if not frames or frames[-1].split(' ', 1)[0] in IDLE_FUNCTIONS:
+                continue
+            busy += count
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        if not busy:
+            return []
+        return [(frame, count / busy, total[frame] / busy) for frame, count in own.most_common(limit)]
+
+    def summary(self, limit: int = 15) -> str:
+        lines = [f"🔥 Профиль: {self.elapsed:.1f} с, {self.samples} снимков "
+                 f"(интервал {self.interval * 1000:g} мс), потоков в стеках: "
+                 f"{len({stack.split(';', 1)[0] for stack in self.stacks})}"]
+        top = self.top(limit)
+        if not top:
+            lines.append("Все потоки простаивали")
+            return "\n".join(lines)
+        lines.append("Горячие функции (на вершине стека / в стеке, без простоя):")
+        for frame, own_share, total_share in top:
+            lines.append(f"{own_share * 100:5.1f}% / {total_share * 100:5.1f}%  {frame}")
+        return "\n".join(lines)
+
+async def profile_for(seconds: float, interval: float = None) -> SamplingProfiler:
+    """Профилирование на заданное время, не блокируя цикл событий"""
+    profiler = SamplingProfiler(interval)
+    profiler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        await asyncio.to_thread(profiler.stop)
+    return profiler
+
+async def memory_snapshot(seconds: float, limit: int = 15, frames: int = 1) -> str:
+    """
+    Снимок выделений памяти: места с наибольшим объемом и приростом за окно
+
+    tracemalloc замедляет выделение памяти, поэтому включается только на время
+    наблюдения (если он не был включен заранее, например PYTHONTRACEMALLOC=1).
+    Снимки и их сравнение на большой куче занимают секунды, поэтому идут в
+    отдельном потоке, а не в цикле событий.
+    """
+    if not _active.acquire(blocking=False):
+        raise ProfilerBusyError("Профилирование уже запущено")
+    started_here = not tracemalloc.is_tracing()
+    try:
+        if started_here:
+            tracemalloc.start(frames)
+        before = await asyncio.to_thread(tracemalloc.take_snapshot)
+        await asyncio.sleep(seconds)
+        after = await asyncio.to_thread(tracemalloc.take_snapshot)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        if started_here:
+            tracemalloc.stop()
+        _active.release()
+    return await asyncio.to_thread(_format_memory, before, after, current, peak, seconds, limit, started_here)
+
+def _format_memory(before, after, current: int, peak: int, seconds: float, limit: int, started_here: bool) -> str:
+    """Отчет по двум снимкам tracemalloc: наибольший прирост и наибольший объем"""
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__),
+               tracemalloc.Filter(False, '<frozen importlib._bootstrap>')]
+    after = after.filter_traces(filters)
+    before = before.filter_traces(filters)
+
+    lines = [f"🧠 Память за {seconds:g} с: отслежено {current / 1024 / 1024:.1f} МБ, пик {peak / 1024 / 1024:.1f} МБ",
+             "", "Наибольший прирост:"]
+    for stat in after.compare_to(before, 'lineno')[:limit]:
+        if stat.size_diff <= 0:
+            break
+        frame = stat.traceback[0]
+        lines.append(f"{stat.size_diff / 1024:+9.1f} КБ ({stat.count_diff:+d})  "
+                     f"{os.path.basename(frame.filename)}:{frame.lineno}")
+    if started_here:
+        lines.append("(учитываются только выделения за время наблюдения)")
+    lines += ["", "Наибольший объем:"]
+    for stat in after.statistics('lineno')[:limit]:
+        frame = stat.traceback[0]
+        lines.append(f"{stat.size / 1024:9.1f} КБ ({stat.count})  {os.path.basename(frame.filename)}:{frame.lineno}")
+    return "\n".join(lines)
+
+def main():
+    """Профилирование нагрузочного цикла - проверка накладных расходов и формата"""
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+
+    def busy_work():
+        total = 0
+        for i in range(3_000_000):
+            total += i * i
+        return total
+
+    async def run():
+        started = time.perf_counter()
+        await asyncio.to_thread(busy_work)
+        print(f"Работа без профилировщика: {time.perf_counter() - started:.2f} с")
+        started = time.perf_counter()
+        task = asyncio.to_thread(busy_work)
+        profiler_task = asyncio.create_task(profile_for(seconds))
+        await task
+        work_seconds = time.perf_counter() - started
+        profiler = await profiler_task
+        print(f"Работа под профилировщиком: {work_seconds:.2f} с\n")
+        print(profiler.summary())
+        print(profiler.collapsed().splitlines()[0])
+        print()
+        print(await memory_snapshot(0.5, limit=5))
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    main()
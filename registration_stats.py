@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Статистика регистраций для /stats
+
+Число регистраций по дням (UTC) и типам запроса хранится в сводной таблице
+registration_stats, которую ведут триггеры users (+1 при регистрации,
+перенос между строками при смене типа запроса). /stats читает только
+сводку: ответ зависит от числа дней в периоде, а не от числа пользователей.
+
+Сводка для уже существующих пользователей строится один раз при обновлении
+схемы; после ручной правки базы ее можно пересчитать.
+Использование:
+  python registration_stats.py backfill  - пересчитать сводку по users
+  python registration_stats.py check     - сверить сводку с полным просмотром users
+
+График - PNG со столбцами по дням (по месяцам для длинных периодов), цвет -
+тип запроса; рисуется без сторонних библиотек.
+"""
+import sys
+import zlib
+import struct
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+# Именованные периоды /stats: число дней до сегодня включительно (None - за все время)
+PERIODS = {
+    'сегодня': 1, 'today': 1,
+    'неделя': 7, 'week': 7,
+    'месяц': 30, 'month': 30,
+    'все': None, 'all': None,
+}
+DEFAULT_PERIOD = 'неделя'
+
+# Тип запроса: подпись, квадрат легенды и цвет столбца
+TYPE_STYLES = {
+    'text': ('Текст', '🟦', (66, 133, 244)),
+    'photo': ('Фото', '🟩', (52, 168, 83)),
+    'voice': ('Голосовые', '🟨', (251, 188, 5)),
+    'video_note': ('Видеокружки', '🟪', (156, 39, 176)),
+    'unknown': ('Другое', '🟥', (234, 67, 53)),
+    '': ('Без запроса', '⬜', (200, 200, 200)),
+}
+OTHER_STYLE = ('Другое', '🟫', (121, 85, 72))
+
+# Дольше этого периода статистика и график - по месяцам
+MONTHLY_AFTER_DAYS = 62
+
+CHART_WIDTH = 800
+CHART_HEIGHT = 400
+CHART_MARGIN = 20
+GRID_COLOR = (225, 225, 225)
+AXIS_COLOR = (90, 90, 90)
+
+def period_dates(days: Optional[int], today: date) -> Tuple[Optional[str], str]:
+    """Границы именованного периода (YYYY-MM-DD, включительно)"""
+    date_from = (today - timedelta(days=days - 1)).isoformat() if days else None
+    return date_from, today.isoformat()
+
+def _style(request_type: str):
+    return TYPE_STYLES.get(request_type, OTHER_STYLE)
+
+def _bucket(day: str, monthly: bool) -> str:
+    return day[:7] if monthly else day
+
+def _buckets(date_from: date, date_to: date, monthly: bool) -> List[str]:
+    """Все дни (месяцы) периода, включая дни без регистраций"""
+    buckets = []
+    current = date_from
+    while current <= date_to:
+        bucket = _bucket(current.isoformat(), monthly)
+        if not buckets or buckets[-1] != bucket:
+            buckets.append(bucket)
+        current += timedelta(days=1)
+    return buckets
+
+def _bounds(rows: List[Tuple[str, str, int]], date_from: Optional[str],
+            date_to: Optional[str]) -> Tuple[date, date, bool]:
+    first = date.fromisoformat(date_from or rows[0][0])
+    last = date.fromisoformat(date_to or rows[-1][0])
+    return first, last, (last - first).days >= MONTHLY_AFTER_DAYS
+
+def _format_bucket(bucket: str) -> str:
+    year, month, *day = bucket.split('-')
+    return f"{day[0]}.{month}" if day else f"{month}.{year}"
+
+def format_stats(rows: List[Tuple[str, str, int]], title: str,
+                 date_from: Optional[str] = None, date_to: Optional[str] = None) -> str:
+    """Текст ответа /stats: итог, типы запроса и регистрации по дням (месяцам)"""
+    if not rows:
+        return f"📊 {title}\n\nРегистраций нет."
+    by_type = Counter()
+    for _, request_type, users in rows:
+        by_type[request_type] += users
+    total = sum(by_type.values())
+    lines = [f"📊 {title}", f"Всего регистраций: {total}", "", "По типам запроса:"]
+    for request_type, users in by_type.most_common():
+        label, square, _ = _style(request_type)
+        lines.append(f"{square} {label}: {users} ({users * 100 / total:.0f}%)")
+
+    first, last, monthly = _bounds(rows, date_from, date_to)
+    by_bucket = Counter()
+    for day, _, users in rows:
+        by_bucket[_bucket(day, monthly)] += users
+    lines += ["", "По месяцам:" if monthly else "По дням:"]
+    lines += [f"{_format_bucket(bucket)}: {by_bucket[bucket]}" for bucket in _buckets(first, last, monthly)]
+    return "\n".join(lines)
+
+def _grid_step(maximum: int) -> int:
+    """Шаг линий сетки 1, 2, 5, 10, 20, 50... - не больше пяти линий"""
+    step = 1
+    while True:
+        for multiplier in (1, 2, 5):
+            if maximum / (step * multiplier) <= 5:
+                return step * multiplier
+        step *= 10
+
+def render_chart(rows: List[Tuple[str, str, int]], date_from: Optional[str] = None,
+                 date_to: Optional[str] = None) -> Tuple[bytes, int]:
+    """
+    PNG со столбцами регистраций по дням (месяцам), разделенными по типам запроса
+
+    Returns:
+        (содержимое PNG, шаг линий сетки в регистрациях)
+    """
+    first, last, monthly = _bounds(rows, date_from, date_to)
+    buckets = _buckets(first, last, monthly)
+    stacks: Dict[str, Dict[str, int]] = defaultdict(dict)
+    for day, request_type, users in rows:
+        bucket = stacks[_bucket(day, monthly)]
+        bucket[request_type] = bucket.get(request_type, 0) + users
+    maximum = max((sum(stack.values()) for stack in stacks.values()), default=0) or 1
+    step = _grid_step(maximum)
+    top = -(-maximum // step) * step
+
+    width, height, margin = CHART_WIDTH, CHART_HEIGHT, CHART_MARGIN
+    pixels = bytearray(b'\xff' * (width * height * 3))
+
+    def fill(x0: int, y0: int, x1: int, y1: int, color):
+        """Прямоугольник [x0, x1) x [y0, y1)"""
+        row = bytes(color) * (x1 - x0)
+        for y in range(max(y0, 0), min(y1, height)):
+            start = (y * width + x0) * 3
+            pixels[start:start + len(row)] = row
+
+    plot_height = height - 2 * margin
+    bottom = height - margin
+    for value in range(step, top + 1, step):
+        y = bottom - value * plot_height // top
+        fill(margin, y, width - margin, y + 1, GRID_COLOR)
+
+    slot = (width - 2 * margin) / len(buckets)
+    bar = max(int(slot * 0.7), 1)
+    order = list(TYPE_STYLES)
+    for index, bucket in enumerate(buckets):
+        x0 = margin + int(index * slot + (slot - bar) / 2)
+        y = bottom
+        stack = stacks.get(bucket, {})
+        for request_type in sorted(stack, key=lambda value: order.index(value) if value in order else len(order)):
+            bar_height = stack[request_type] * plot_height // top
+            fill(x0, y - bar_height, x0 + bar, y, _style(request_type)[2])
+            y -= bar_height
+    fill(margin, bottom, width - margin, bottom + 1, AXIS_COLOR)
+    fill(margin, margin, margin + 1, bottom + 1, AXIS_COLOR)
+    return _png(width, height, pixels), step
+
+def _png(width: int, height: int, pixels: bytearray) -> bytes:
+    """Кодирование RGB-изображения в PNG (строки без фильтра)"""
+    stride = width * 3
+    raw = b''.join(b'\x00' + bytes(pixels[y * stride:(y + 1) * stride]) for y in range(height))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw, 6))
+            + chunk(b'IEND', b''))
+
+def legend(rows: List[Tuple[str, str, int]]) -> str:
+    """Подписи цветов графика для типов, встречающихся в периоде"""
+    types = {request_type for _, request_type, _ in rows}
+    order = list(TYPE_STYLES)
+    return ' '.join(f"{_style(t)[1]} {_style(t)[0]}"
+                    for t in sorted(types, key=lambda value: order.index(value) if value in order else len(order)))
+
+def check(db) -> bool:
+    """Сверка сводки с полным просмотром users"""
+    expected = Counter()
+    for user in db.iter_users():
+        expected[(str(user[5])[:10], user[7] or '')] += 1
+    actual = {(day, request_type): users for day, request_type, users in db.get_registration_stats()}
+    differences = {key for key in expected.keys() | actual.keys() if expected.get(key, 0) != actual.get(key, 0)}
+    for day, request_type in sorted(differences)[:20]:
+        print(f"  ❌ {day} {request_type or '(без запроса)'}: в сводке {actual.get((day, request_type), 0)}, "
+              f"в users {expected.get((day, request_type), 0)}")
+    print(f"Пользователей: {sum(expected.values())}, строк сводки: {len(actual)}, расхождений: {len(differences)}")
+    return not differences
+
+def main():
+    from dotenv import load_dotenv
+    load_dotenv()
+    from storage import create_storage
+
+    if len(sys.argv) != 2 or sys.argv[1] not in ('backfill', 'check'):
+        print("Использование: python registration_stats.py backfill|check")
+        sys.exit(1)
+    db = create_storage()
+    try:
+        if sys.argv[1] == 'backfill':
+            print(f"✅ Сводка регистраций пересчитана: {db.rebuild_registration_stats()} строк")
+        elif check(db):
+            print("✅ Сводка совпадает с таблицей users")
+        else:
+            sys.exit(1)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Восстановление базы данных из резервной копии по каталогу
+
+Архив берется из локального файла (--file) или скачивается из Telegram по
+file_id из каталога (через BOT_API_BASE_URL, если задан). Сжатие снимается
+потоково, контрольные суммы архива и базы сверяются с каталогом, база
+проверяется PRAGMA integrity_check и атомарно подменяется. Предыдущая база
+сохраняется как *.before_restore.
+
+Если каталог потерян вместе с сервером, копию можно восстановить из файлов,
+сохраненных из чата резервных копий (restore-files): контрольная сумма
+сверяется со строкой SHA-256 из подписи последней части.
+
+Перед восстановлением остановите бота: sudo ./deploy.sh stop
+
+Использование:
+  python restore_backup.py list
+  python restore_backup.py restore [ID|latest] [--db PATH] [--file АРХИВ ...]
+  python restore_backup.py restore-files ЧАСТЬ ... [--base ЧАСТЬ ...] [--sha256 HEX] [--db PATH]
+"""
+import os
+import re
+import sys
+import time
+import shutil
+import sqlite3
+import hashlib
+import argparse
+import tempfile
+import requests
+from dotenv import load_dotenv
+
+from backup_catalog import BackupCatalog
+from backup_delta import open_archive, rebuild, file_sha256, COPY_CHUNK_SIZE
+from backup_service import DB_PATH, format_size
+
+# Загрузка переменных окружения
+load_dotenv()
+
+def get_catalog_path(db_path):
+    backup_dir = os.getenv('BACKUP_DIR') or os.path.join(os.path.dirname(os.path.abspath(db_path)), 'backups')
+    return os.path.join(backup_dir, 'backup_catalog.db')
+
+def _bot_api_urls(bot_token):
+    """Адреса методов и файлов Bot API: https://api.telegram.org или локальный сервер из BOT_API_BASE_URL"""
+    api_base = os.getenv('BOT_API_BASE_URL', 'https://api.telegram.org/bot')
+    file_base = re.sub(r'/bot$', '/file/bot', api_base)
+    return f"{api_base}{bot_token}", f"{file_base}{bot_token}"
+
+def _download_parts(entry, target_path, bot_token):
+    """Скачивание всех частей архива из Telegram в один файл"""
+    bot_url, file_url = _bot_api_urls(bot_token)
+    with open(target_path, 'wb') as target:
+        for file_id in entry['file_ids']:
+            response = requests.get(f"{bot_url}/getFile", params={'file_id': file_id}, timeout=60)
+            response.raise_for_status()
+            file_path = response.json()['result']['file_path']
+            if os.path.isabs(file_path) and os.path.exists(file_path):
+                # Локальный сервер в режиме --local отдает путь к файлу на диске
+                with open(file_path, 'rb') as part:
+                    shutil.copyfileobj(part, target, COPY_CHUNK_SIZE)
+                continue
+            with requests.get(f"{file_url}/{file_path}", stream=True, timeout=60) as download:
+                download.raise_for_status()
+                for chunk in download.iter_content(COPY_CHUNK_SIZE):
+                    target.write(chunk)
+
+def _join_parts(paths, target_path):
+    """Склеивает части архива (*.partNNN) по порядку номеров"""
+    with open(target_path, 'wb') as target:
+        for path in sorted(paths):
+            with open(path, 'rb') as part:
+                shutil.copyfileobj(part, target, COPY_CHUNK_SIZE)
+
+def fetch_archive(entry, work_dir, local_files, bot_token):
+    """
+    Получает архив копии в work_dir и проверяет его контрольную сумму
+
+    Части архива (*.partNNN) из local_files склеиваются по порядку номеров.
+    """
+    archive_path = os.path.join(work_dir, entry['filename'])
+    matching = sorted(path for path in local_files
+                      if os.path.basename(path) == entry['filename']
+                      or os.path.basename(path).startswith(f"{entry['filename']}.part"))
+
+    if matching:
+        _join_parts(matching, archive_path)
+    elif bot_token and entry['file_ids']:
+        print(f"⬇️ Скачивание {entry['filename']} из Telegram ({entry['parts']} ч.)...")
+        _download_parts(entry, archive_path, bot_token)
+    else:
+        raise FileNotFoundError(f"Нет файла архива {entry['filename']} (укажите --file или BOT_TOKEN)")
+
+    if file_sha256(archive_path) != entry['sha256']:
+        raise ValueError(f"Контрольная сумма архива {entry['filename']} не совпадает с каталогом")
+    return archive_path
+
+def _archive_name(paths):
+    """Имя архива по его частям: base_20240101.db.zst.part001 -> base_20240101.db.zst"""
+    names = {re.sub(r'\.part\d+$', '', os.path.basename(path)) for path in paths}
+    if len(names) != 1:
+        raise ValueError(f"Части разных архивов: {', '.join(sorted(names))}")
+    return names.pop()
+
+def stream_sha256(archive_path):
+    """Контрольная сумма распакованного содержимого архива"""
+    digest = hashlib.sha256()
+    with open_archive(archive_path) as source:
+        for chunk in iter(lambda: source.read(COPY_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def check_integrity(path):
+    """PRAGMA integrity_check восстановленной базы"""
+    with sqlite3.connect(path) as conn:
+        result = conn.execute("PRAGMA integrity_check").fetchall()
+    if result != [('ok',)]:
+        raise ValueError(f"Восстановленная база повреждена: {result[:5]}")
+
+def decompress_to(archive_path, target_path):
+    """Потоковая распаковка архива, возвращает sha256 результата"""
+    digest = hashlib.sha256()
+    with open_archive(archive_path) as source, open(target_path, 'wb') as target:
+        for chunk in iter(lambda: source.read(COPY_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            target.write(chunk)
+    return digest.hexdigest()
+
+def swap_database(restored_path, db_path):
+    """
+    Атомарная подмена базы
+
+    Текущая база сохраняется жесткой ссылкой *.before_restore, ее -wal/-shm
+    переносятся рядом (иначе SQLite применит старый журнал к новой базе).
+    """
+    backup_path = f"{db_path}.before_restore"
+    if os.path.exists(db_path):
+        if os.path.exists(backup_path):
+            os.remove(backup_path)
+        os.link(db_path, backup_path)
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.replace(db_path + suffix, backup_path + suffix)
+    os.replace(restored_path, db_path)
+
+def restore(catalog, entry, db_path, local_files=(), bot_token=None):
+    """
+    Восстанавливает базу из записи каталога
+
+    Returns:
+        Длительность этапов восстановления, секунды
+    """
+    timings = {}
+    started = time.perf_counter()
+    chain = [entry]
+    if entry['kind'] == 'delta':
+        base_entry = catalog.find_by_filename(entry['base_filename'])
+        if not base_entry:
+            raise ValueError(f"В каталоге нет базовой копии {entry['base_filename']}")
+        chain.insert(0, base_entry)
+
+    # Временный файл в каталоге базы - чтобы подмена была атомарным переименованием
+    db_dir = os.path.dirname(os.path.abspath(db_path))
+    restored_path = os.path.join(db_dir, f".{os.path.basename(db_path)}.restore")
+    with tempfile.TemporaryDirectory(prefix="naumovado_restore_") as work_dir:
+        archives = [fetch_archive(item, work_dir, local_files, bot_token) for item in chain]
+        timings['fetch_and_verify_archive'] = time.perf_counter() - started
+
+        step = time.perf_counter()
+        try:
+            if entry['kind'] == 'delta':
+                # rebuild проверяет соответствие базовой копии и целостность результата
+                rebuild(archives[0], restored_path, archives[1])
+                db_sha256 = file_sha256(restored_path)
+            else:
+                db_sha256 = decompress_to(archives[0], restored_path)
+            timings['decompress'] = time.perf_counter() - step
+
+            if db_sha256 != entry['db_sha256']:
+                raise ValueError("Контрольная сумма восстановленной базы не совпадает с каталогом")
+
+            step = time.perf_counter()
+            check_integrity(restored_path)
+            timings['integrity_check'] = time.perf_counter() - step
+
+            step = time.perf_counter()
+            swap_database(restored_path, db_path)
+            timings['swap'] = time.perf_counter() - step
+        finally:
+            if os.path.exists(restored_path):
+                os.remove(restored_path)
+
+    timings['total'] = time.perf_counter() - started
+    return timings
+
+def restore_files(files, db_path, base_files=(), sha256=None):
+    """
+    Восстанавливает базу из файлов архива без каталога
+
+    files - части полной копии или разностной копии (тогда base_files - части
+    ее базовой копии). sha256 из подписи последней части сверяется с
+    распакованным содержимым files; соответствие базовой копии разностной
+    rebuild проверяет сам.
+
+    Returns:
+        Длительность этапов восстановления, секунды
+    """
+    timings = {}
+    started = time.perf_counter()
+    db_dir = os.path.dirname(os.path.abspath(db_path))
+    restored_path = os.path.join(db_dir, f".{os.path.basename(db_path)}.restore")
+    with tempfile.TemporaryDirectory(prefix="naumovado_restore_") as work_dir:
+        archive_path = os.path.join(work_dir, _archive_name(files))
+        _join_parts(files, archive_path)
+        base_path = None
+        if base_files:
+            base_path = os.path.join(work_dir, _archive_name(base_files))
+            if base_path == archive_path:
+                raise ValueError("Базовая и разностная копии - один и тот же архив")
+            _join_parts(base_files, base_path)
+        timings['fetch_and_verify_archive'] = time.perf_counter() - started
+
+        step = time.perf_counter()
+        try:
+            if base_path:
+                if sha256 and stream_sha256(archive_path) != sha256.lower():
+                    raise ValueError("Контрольная сумма разностной копии не совпадает с SHA-256 из подписи")
+                rebuild(base_path, restored_path, archive_path)
+            else:
+                db_sha256 = decompress_to(archive_path, restored_path)
+                if sha256 and db_sha256 != sha256.lower():
+                    raise ValueError("Контрольная сумма восстановленной базы не совпадает с SHA-256 из подписи")
+            timings['decompress'] = time.perf_counter() - step
+
+            step = time.perf_counter()
+            check_integrity(restored_path)
+            timings['integrity_check'] = time.perf_counter() - step
+
+            step = time.perf_counter()
+            swap_database(restored_path, db_path)
+            timings['swap'] = time.perf_counter() - step
+        finally:
+            if os.path.exists(restored_path):
+                os.remove(restored_path)
+
+    timings['total'] = time.perf_counter() - started
+    return timings
+
+def list_backups(catalog):
+    entries = catalog.list()
+    if not entries:
+        print("📭 Каталог резервных копий пуст")
+        return
+    print(f"{'ID':>5}  {'Создана':19}  {'Тип':5}  {'Размер':>10}  {'Частей':>6}  Файл")
+    for entry in entries:
+        print(f"{entry['id']:>5}  {entry['created_at']:19}  {entry['kind']:5}  "
+              f"{format_size(entry['compressed_size'] or 0):>10}  {entry['parts']:>6}  {entry['filename']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Восстановление базы из резервной копии")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('list', help="показать каталог копий")
+    restore_parser = subparsers.add_parser('restore', help="восстановить базу")
+    restore_parser.add_argument('backup', nargs='?', default='latest', help="ID копии из каталога или latest")
+    restore_parser.add_argument('--db', default=DB_PATH, help="путь к восстанавливаемой базе (по умолчанию DB_PATH)")
+    restore_parser.add_argument('--file', nargs='*', default=[], help="локальные файлы архивов/частей")
+    files_parser = subparsers.add_parser('restore-files', help="восстановить базу из файлов архива без каталога")
+    files_parser.add_argument('files', nargs='+', help="части полной или разностной копии")
+    files_parser.add_argument('--base', nargs='*', default=[], help="части базовой копии (для разностной)")
+    files_parser.add_argument('--sha256', help="SHA-256 из подписи последней части копии")
+    files_parser.add_argument('--db', default=DB_PATH, help="путь к восстанавливаемой базе (по умолчанию DB_PATH)")
+    parser.add_argument('--catalog', help="путь к каталогу копий")
+    args = parser.parse_args()
+
+    db_path = getattr(args, 'db', DB_PATH)
+
+    if args.command == 'restore-files':
+        print(f"🔄 Восстановление {_archive_name(args.files)} в {db_path}")
+        if not args.sha256:
+            print("⚠️ Без --sha256 проверяется только целостность базы")
+        action = lambda: restore_files(args.files, db_path, args.base, args.sha256)
+    else:
+        catalog = BackupCatalog(args.catalog or get_catalog_path(db_path))
+
+        if args.command == 'list':
+            list_backups(catalog)
+            return 0
+
+        entry = catalog.latest() if args.backup == 'latest' else catalog.get(int(args.backup))
+        if not entry:
+            print("❌ Резервная копия не найдена в каталоге")
+            return 1
+
+        print(f"🔄 Восстановление {entry['filename']} ({entry['kind']}, {entry['created_at']}) в {db_path}")
+        action = lambda: restore(catalog, entry, db_path, args.file, os.getenv('BOT_TOKEN'))
+    try:
+        timings = action()
+    except Exception as e:
+        print(f"❌ Ошибка восстановления: {e}")
+        return 1
+
+    print(f"✅ База восстановлена за {timings['total']:.1f} с "
+          f"(получение {timings['fetch_and_verify_archive']:.1f} с, распаковка {timings['decompress']:.1f} с, "
+          f"проверка {timings['integrity_check']:.1f} с)")
+    print(f"ℹ️ Предыдущая база сохранена как {db_path}.before_restore")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -37,6 +37,7 @@ echo "📋 Настройки:"
 echo "   Максимальный размер логов: 10 МБ"
 echo "   Время хранения: 7 дней"
 echo "   Сжатие: включено"
+echo "   Ограничение частоты: 10000 записей за 30 секунд"
 echo ""
 echo "📋 Команды для управления логами:"
 echo "   Просмотр размера логов:"
@@ -49,5 +50,8 @@ echo ""
 echo "   Просмотр логов бота:"
 echo "     sudo ./deploy.sh logs"
 echo ""
+echo "   Только ошибки бота (формат LOG_FORMAT=kv):"
+echo "     sudo journalctl -u naumova-bot -o cat | grep 'level=ERROR'"
+echo ""
 echo "   Просмотр размера логов бота:"
 echo "     sudo journalctl -u naumova-bot --disk-usage" 
\ No newline at end of file
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Фоновая синхронизация базы данных с Google Sheets
+
+Триггеры на таблице users пишут изменения в таблицу sheets_outbox.
+Воркер периодически забирает пачку изменений, схлопывает повторные изменения
+одного пользователя и отправляет их в таблицу одним batchUpdate/append.
+"""
+import os
+import time
+import logging
+import threading
+
+from storage import Storage
+
+logger = logging.getLogger(__name__)
+
+class SheetsSyncService:
+    """Сервис непрерывной синхронизации изменений пользователей в Google Sheets"""
+
+    def __init__(self, db: Storage, interval: float = None, batch_size: int = None):
+        self.db = db
+        self.interval = interval or float(os.getenv('SHEETS_SYNC_INTERVAL', '5'))
+        self.batch_size = batch_size or int(os.getenv('SHEETS_SYNC_BATCH', '500'))
+        self.sheets_service = None
+
+    def sync_once(self) -> int:
+        """
+        Обработка одной пачки изменений из outbox
+
+        Returns:
+            Количество обработанных записей outbox (0 - очередь пуста или ошибка)
+        """
+        batch = self.db.get_outbox_batch(self.batch_size)
+        if not batch:
+            return 0
+
+        max_id = batch[-1][0]
+        # Схлопываем повторные изменения одного пользователя, сохраняя порядок
+        telegram_ids = list(dict.fromkeys(row[1] for row in batch))
+        users = self.db.get_users_by_telegram_ids(telegram_ids)
+
+        if not self.sheets_service.sync_users(users):
+            return 0
+
+        self.db.delete_outbox_entries(max_id)
+        logger.info(f"🔄 Outbox: {len(batch)} изменений -> {len(users)} пользователей")
+        return len(batch)
+
+    def start(self) -> bool:
+        """Запускает фоновый поток синхронизации"""
+        try:
+            # Импорт здесь, чтобы модуль можно было использовать без google-библиотек
+            from google_sheets_service import GoogleSheetsService
+
+            # Отдельный экземпляр сервиса: клиент Google API не потокобезопасен
+            self.sheets_service = GoogleSheetsService()
+        except Exception as e:
+            logger.error(f"❌ Синхронизация с Google Sheets не запущена: {e}")
+            return False
+
+        def run_sync():
+            while True:
+                try:
+                    processed = self.sync_once()
+                except Exception as e:
+                    logger.error(f"❌ Ошибка синхронизации с Google Sheets: {e}")
+                    processed = 0
+
+                # Если пачка была полной - сразу забираем следующую
+                if processed < self.batch_size:
+                    time.sleep(self.interval)
+
+        sync_thread = threading.Thread(target=run_sync, name="sheets-sync", daemon=True)
+        sync_thread.start()
+
+        logger.info(f"✅ Синхронизация с Google Sheets запущена (каждые {self.interval:g} с)")
+        return True
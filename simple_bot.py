@@ -3,49 +3,89 @@
 Telegram bot for NaumovaDO business coach
 """
 import os
+import time
+import asyncio
 import logging
-from datetime import datetime
+import tempfile
+import warnings
+import functools
+import contextlib
+from datetime import datetime, timezone
+from typing import Optional
 from dotenv import load_dotenv
-from telegram import Update, ReplyKeyboardRemove, BotCommand, BotCommandScopeChat
+from telegram import Update, ReplyKeyboardRemove, BotCommand, BotCommandScopeChat, InputMediaPhoto
+from telegram.error import BadRequest
+from telegram.request import HTTPXRequest
+from telegram.warnings import PTBUserWarning
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, CallbackQueryHandler,
-    filters, ContextTypes, ConversationHandler
+    filters, ContextTypes, ConversationHandler, ApplicationHandlerStop
 )
 
-from database import Database
+from storage import Storage, create_storage
+from conversation_persistence import StoragePersistence
+from update_dedup import UpdateDeduplicator
+from media_group import MediaGroupBuffer
+from media_archive import MediaArchive, MEDIA_ARCHIVE_DIR, local_copy
+from user_search import normalize_phone
 from keyboards import get_contact_keyboard, get_request_actions_keyboard
-from backup_service import BackupService
-from google_sheets_service import GoogleSheetsService
+from sheets_sync import SheetsSyncService
+from logging_setup import setup_logging
+from metrics import (
+    instrument_handler, start_http_server, TELEGRAM_API_SECONDS, TELEGRAM_API_ERRORS,
+    UPDATE_QUEUE_DEPTH, SHEETS_OUTBOX_DEPTH
+)
+import profiler
+from health_watchdog import HealthProbe, note_get_updates
+from tracing import trace_update, record_span, recent_traces, find_trace, format_trace
 
 # Загрузка переменных окружения
 load_dotenv()
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
 # Состояния разговора
 WAITING_CONTACT, WAITING_REQUEST = range(2)
 
-# Инициализация базы данных
-db = Database()
-
 # Получение переменных окружения
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 ADMINS = [int(admin_id.strip()) for admin_id in os.getenv('ADMINS', '').split(',') if admin_id.strip()]
 BACKUPTO = os.getenv('BACKUPTO')
+# Число пользователей в ответе /find
+FIND_LIMIT = 20
+# Адрес Bot API (локальный сервер Bot API, проверка запуска check_startup.py)
+BOT_API_BASE_URL = os.getenv('BOT_API_BASE_URL')
+# Без запущенной синхронизации с Google Sheets записи outbox старше этого срока удаляются (раз в час)
+SHEETS_OUTBOX_MAX_AGE_HOURS = float(os.getenv('SHEETS_OUTBOX_MAX_AGE_HOURS', '24'))
+SHEETS_OUTBOX_CLEAR_INTERVAL = 3600
 
-# Путь к базе данных
-DB_PATH = "/opt/telegram_bots/NaumovaDO_biznesscouch/naumovado.db"
-
-# Инициализация сервиса резервных копий
+# Хранилище и сервис резервных копий создаются в startup(), а не при импорте модуля
+db: Optional[Storage] = None
 backup_service = None
-if BOT_TOKEN and BACKUPTO:
-    backup_service = BackupService(BOT_TOKEN, BACKUPTO, DB_PATH)
 
+def startup() -> None:
+    """
+    Явный этап запуска: логирование, хранилище (STORAGE_BACKEND) и сервис резервных копий
+    
+    Повторный вызов ничего не делает.
+    """
+    global db, backup_service
+    if db is not None:
+        return
+    
+    # Запись лога через очередь в фоновом потоке (см. logging_setup.py)
+    setup_logging()
+    db = create_storage()
+    
+    db_file = db.get_db_file_path()
+    if BOT_TOKEN and BACKUPTO and db_file:
+        # Модуль резервных копий тянет HTTP-клиент - загружаем, только если копии настроены
+        from backup_service import BackupService
+        backup_service = BackupService(BOT_TOKEN, BACKUPTO, db_file)
+    elif BACKUPTO and not db_file:
+        logger.warning("⚠️ Резервные копии в Telegram делаются только для SQLite, для PostgreSQL используйте pg_dump")
+
+@instrument_handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обработчик команды /start"""
     user = update.effective_user
@@ -57,7 +97,11 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             "Используйте команды из меню бота (кнопка 'Меню' рядом со строкой ввода):\n"
             "• /show_users - показать всех пользователей\n"
             "• /show_today - показать сегодняшние регистрации\n"
-            "• /export_sheets - выгрузить базу в Excel\n\n"
+            "• /stats [период] [график] - статистика регистраций\n"
+            "• /find <телефон или имя> - найти пользователя\n"
+            "• /export_sheets - выгрузить базу в Google Sheets\n"
+            "• /export_file - выгрузить базу в файл Excel/CSV\n"
+            "• /export_media - выгрузить медиафайлы запросов в ZIP\n\n"
             "Или нажмите /help для получения справки."
         )
         return ConversationHandler.END
@@ -71,13 +115,15 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     
     return WAITING_CONTACT
 
+@instrument_handler
 async def handle_contact(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обработчик получения контакта"""
     user = update.effective_user
     contact = update.message.contact
     
     # Сохраняем пользователя в базу данных
-    success = db.add_user(
+    success = await asyncio.to_thread(
+        db.add_user,
         telegram_id=user.id,
         first_name=contact.first_name or user.first_name,
         last_name=contact.last_name or user.last_name,
@@ -85,6 +131,10 @@ async def handle_contact(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     )
     
     if success:
+        record_event(context.application, 'contact', user.id,
+                     first_name=contact.first_name or user.first_name,
+                     last_name=contact.last_name or user.last_name,
+                     phone=normalize_phone(contact.phone_number))
         await update.message.reply_text(
             "✅ Контакт успешно получен!\n\n"
             "Теперь, пожалуйста, введите ваш запрос в свободной форме.\n"
@@ -99,6 +149,15 @@ async def handle_contact(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         return WAITING_CONTACT
 
+async def ask_contact_again(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Текст вместо контакта - напоминание о кнопке"""
+    await update.message.reply_text(
+        "Пожалуйста, поделитесь контактом, используя кнопку ниже.",
+        reply_markup=get_contact_keyboard()
+    )
+    return WAITING_CONTACT
+
+@instrument_handler
 async def handle_request(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обработчик получения запроса пользователя"""
     user = update.effective_user
@@ -106,30 +165,41 @@ async def handle_request(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     # Определяем тип контента и формируем описание
     request_type = None
     file_id = None
+    media = None
     
     if update.message.text:
         request_content = f"Текст: {update.message.text}"
         request_type = "text"
+    elif update.message.photo and update.message.media_group_id:
+        # Часть альбома: запрос сохраняется и ответ отправляется, когда придут все фото (handle_media_group)
+        context.application.media_groups.add(update.message)
+        return ConversationHandler.END
     elif update.message.photo:
         request_content = f"Фото: {update.message.caption or 'Без описания'}"
         request_type = "photo"
-        file_id = update.message.photo[-1].file_id  # Берем последнее (самое качественное) фото
+        media = update.message.photo[-1]  # Берем последнее (самое качественное) фото
     elif update.message.voice:
         request_content = f"Голосовое сообщение: {update.message.caption or 'Без описания'}"
         request_type = "voice"
-        file_id = update.message.voice.file_id
+        media = update.message.voice
     elif update.message.video_note:
         request_content = f"Видеокружок: {update.message.caption or 'Без описания'}"
         request_type = "video_note"
-        file_id = update.message.video_note.file_id
+        media = update.message.video_note
     else:
         request_content = "Неизвестный тип контента"
         request_type = "unknown"
+    if media is not None:
+        file_id = media.file_id
     
     # Сохраняем запрос в базу данных
-    success = db.update_user_request(user.id, request_content, request_type, file_id)
+    success = await asyncio.to_thread(db.update_user_request, user.id, request_content, request_type, file_id)
     
     if success:
+        record_event(context.application, 'request', user.id,
+                     request=request_content, request_type=request_type, file_id=file_id)
+        if media is not None:
+            archive_media(context.application, [media])
         await update.message.reply_text(
             "🙏 Спасибо! Ваш запрос принят и будет обработан в ближайшее время.",
             reply_markup=get_request_actions_keyboard()
@@ -141,8 +211,57 @@ async def handle_request(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         return WAITING_REQUEST
 
-async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработчик callback запросов"""
+def record_event(application, event: str, telegram_id: int, **fields) -> None:
+    """Событие пользователя - в журнал (см. event_journal.py), без ожидания записи на диск"""
+    if application.journal is not None:
+        application.journal.record(event, telegram_id, **fields)
+
+def archive_media(application, media_list) -> None:
+    """Файлы запроса - в очередь архива медиафайлов (см. media_archive.py), без ожидания скачивания"""
+    if application.media_archive is not None:
+        for media in media_list:
+            application.media_archive.enqueue(media.file_id, media.file_unique_id)
+
+@instrument_handler
+async def handle_media_group(application, messages) -> None:
+    """Сохранение альбома одним запросом и один ответ на все фото (см. media_group.py)"""
+    message = messages[0]
+    caption = next((part.caption for part in messages if part.caption), None)
+    photos = [part.photo[-1] for part in messages]
+    file_ids = [photo.file_id for photo in photos]
+    request_content = f"Альбом ({len(file_ids)} фото): {caption or 'Без описания'}"
+    
+    success = await asyncio.to_thread(
+        db.update_user_request, message.from_user.id, request_content, "photo", file_ids=file_ids
+    )
+    
+    if success:
+        record_event(application, 'request', message.from_user.id, request=request_content,
+                     request_type="photo", file_id=file_ids[0], file_ids=file_ids)
+        archive_media(application, photos)
+        await message.reply_text(
+            "🙏 Спасибо! Ваш запрос принят и будет обработан в ближайшее время.",
+            reply_markup=get_request_actions_keyboard()
+        )
+    else:
+        await message.reply_text(
+            "❌ Произошла ошибка при сохранении запроса. Отправьте /start и попробуйте еще раз."
+        )
+
+async def collect_media_group(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Следующие части альбома - в буфер, мимо разговора (первую часть принимает handle_request)"""
+    if update.message.media_group_id in context.application.media_groups:
+        context.application.media_groups.add(update.message)
+        raise ApplicationHandlerStop
+
+@instrument_handler
+async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """
+    Кнопки под принятым запросом: изменить запрос или завершить
+    
+    Обработчик входит в разговор (точка входа и fallback), поэтому возвращаемое
+    состояние действительно применяется, а событие в журнале соответствует переходу.
+    """
     query = update.callback_query
     await query.answer()
     
@@ -152,14 +271,17 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             "Это может быть текст, фото, голосовое сообщение или видеокружок."
         )
         context.user_data['waiting_for_new_request'] = True
+        record_event(context.application, 'change_request', query.from_user.id)
         return WAITING_REQUEST
     
     elif query.data == "finish":
         await query.edit_message_text("✅ Спасибо за обращение! До свидания!")
+        record_event(context.application, 'finish', query.from_user.id)
         return ConversationHandler.END
     
 
 
+@instrument_handler
 async def show_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Команда для показа всех пользователей"""
     user = update.effective_user
@@ -168,7 +290,7 @@ async def show_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("❌ У вас нет доступа к этой команде.")
         return
     
-    users = db.get_all_users()
+    users = await asyncio.to_thread(db.get_all_users)
     if users:
         message = "👥 Все пользователи:\n\n"
         for user_data in users:
@@ -196,6 +318,7 @@ async def show_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     else:
         await update.message.reply_text("📭 Пользователей пока нет.")
 
+@instrument_handler
 async def show_today_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Команда для показа сегодняшних регистраций"""
     user = update.effective_user
@@ -204,7 +327,7 @@ async def show_today_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("❌ У вас нет доступа к этой команде.")
         return
     
-    users = db.get_today_registrations()
+    users = await asyncio.to_thread(db.get_today_registrations)
     if users:
         message = f"📅 Регистрации за {datetime.now().strftime('%d.%m.%Y')}:\n\n"
         for user_data in users:
@@ -231,28 +354,135 @@ async def show_today_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     else:
         await update.message.reply_text("📭 Сегодня новых регистраций нет.")
 
+@instrument_handler
+async def find_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Поиск пользователей по телефону или имени: /find <начало телефона или имени>"""
+    user = update.effective_user
+    
+    if user.id not in ADMINS:
+        await update.message.reply_text("❌ У вас нет доступа к этой команде.")
+        return
+    
+    query = ' '.join(context.args)
+    if not query:
+        await update.message.reply_text(
+            "Использование: /find <телефон или имя>\n"
+            "Например: /find +7 999 123, /find 89991234567, /find Иван, /find Иванов Пет"
+        )
+        return
+    
+    users = await asyncio.to_thread(db.find_users, query, FIND_LIMIT + 1)
+    if not users:
+        await update.message.reply_text(f"🔍 По запросу «{query}» никого не найдено.")
+        return
+    
+    message = f"🔍 Найдено по запросу «{query}»:\n\n"
+    for user_data in users[:FIND_LIMIT]:
+        message += f"ID: {user_data[1]}\n"
+        message += f"Имя: {user_data[2]} {user_data[3] or ''}\n"
+        message += f"Телефон: {user_data[4]}\n"
+        message += f"Регистрация: {user_data[5]}\n"
+        message += f"Запрос: {user_data[6] or 'Не указан'}\n"
+        message += "─" * 30 + "\n"
+    if len(users) > FIND_LIMIT:
+        message += f"Показаны первые {FIND_LIMIT}, уточните запрос"
+    
+    for i in range(0, len(message), 4096):
+        await update.message.reply_text(message[i:i+4096])
+
+@instrument_handler
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Команда статистики регистраций по сводной таблице (см. registration_stats.py)"""
+    user = update.effective_user
+    
+    if user.id not in ADMINS:
+        await update.message.reply_text("❌ У вас нет доступа к этой команде.")
+        return
+    
+    # Модули команд администратора загружаются при первом вызове, а не при запуске бота
+    import registration_stats
+    
+    args = [arg.lower() for arg in context.args or []]
+    chart = 'график' in args or 'chart' in args
+    args = [arg for arg in args if arg not in ('график', 'chart')]
+    # Сводка ведется по дням UTC, как и время регистрации
+    today = datetime.now(timezone.utc).date()
+    try:
+        if not args or args[0] in registration_stats.PERIODS:
+            period = args[0] if args else registration_stats.DEFAULT_PERIOD
+            date_from, date_to = registration_stats.period_dates(registration_stats.PERIODS[period], today)
+            title = f"Регистрации: {period}"
+        else:
+            date_from = parse_date_arg(args[0])
+            date_to = parse_date_arg(args[1]) if len(args) > 1 else today.isoformat()
+            title = f"Регистрации с {args[0]} по {args[1] if len(args) > 1 else 'сегодня'}"
+    except ValueError as e:
+        await update.message.reply_text(
+            f"❌ {e}\n\n"
+            "Использование: /stats [сегодня|неделя|месяц|все] [график]\n"
+            "или /stats с ДД.ММ.ГГГГ [по ДД.ММ.ГГГГ] [график]"
+        )
+        return
+    
+    rows = await asyncio.to_thread(db.get_registration_stats, date_from, date_to)
+    message = registration_stats.format_stats(rows, title, date_from, date_to)
+    for i in range(0, len(message), 4096):
+        await update.message.reply_text(message[i:i+4096])
+    
+    if chart and rows:
+        image, step = await asyncio.to_thread(registration_stats.render_chart, rows, date_from, date_to)
+        await update.message.reply_photo(
+            photo=image,
+            caption=f"{registration_stats.legend(rows)}\nЛинии сетки - через каждые {step} регистраций"
+        )
+
+async def send_request_media(bot, chat_id, request_type: str, files: list, caption: str):
+    """Отправка файлов одного запроса (file_id или открытые файлы); несколько фото - альбомом"""
+    if len(files) > 1:
+        await bot.send_media_group(chat_id=chat_id, media=[
+            InputMediaPhoto(media, caption=caption if position == 0 else None)
+            for position, media in enumerate(files)
+        ])
+    elif request_type == "photo":
+        await bot.send_photo(chat_id=chat_id, photo=files[0], caption=caption)
+    elif request_type == "voice":
+        await bot.send_voice(chat_id=chat_id, voice=files[0], caption=caption)
+    elif request_type == "video_note":
+        await bot.send_video_note(chat_id=chat_id, video_note=files[0])
+        await bot.send_message(chat_id=chat_id, text=caption)
+
 async def send_media_files(bot, chat_id, users):
     """Отправка медиафайлов администратору"""
+    # Файлы альбомов всех пользователей списка - одним запросом, не блокируя цикл событий
+    albums = await asyncio.to_thread(
+        db.get_request_files_by_telegram_ids,
+        [user_data[1] for user_data in users if user_data[8] and user_data[7] == "photo"]
+    )
     for user_data in users:
         if user_data[8]:  # file_id
             try:
                 caption = f"📎 Медиафайл от пользователя {user_data[2]} {user_data[3] or ''} (ID: {user_data[1]})"
                 
-                if user_data[7] == "photo":
-                    await bot.send_photo(chat_id=chat_id, photo=user_data[8], caption=caption)
-                elif user_data[7] == "voice":
-                    await bot.send_voice(chat_id=chat_id, voice=user_data[8], caption=caption)
-                elif user_data[7] == "video_note":
-                    await bot.send_video_note(chat_id=chat_id, video_note=user_data[8])
-                    await bot.send_message(chat_id=chat_id, text=caption)
+                album = albums.get(user_data[1], [])
+                files = album if len(album) > 1 else [user_data[8]]
+                try:
+                    await send_request_media(bot, chat_id, user_data[7], files, caption)
+                except BadRequest:
+                    # Telegram больше не отдает файл - отправляем копии из архива медиафайлов
+                    copies = [local_copy(db, file_id) for file_id in files]
+                    if not all(copies):
+                        raise
+                    with contextlib.ExitStack() as stack:
+                        await send_request_media(bot, chat_id, user_data[7],
+                                                 [stack.enter_context(open(path, 'rb')) for path in copies], caption)
                 
                 # Небольшая задержка между отправками
-                import asyncio
                 await asyncio.sleep(0.5)
                 
             except Exception as e:
                 logger.error(f"Ошибка при отправке медиафайла для пользователя {user_data[1]}: {e}")
 
+@instrument_handler
 async def export_to_sheets_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Команда экспорта данных в Google Sheets"""
     user = update.effective_user
@@ -264,11 +494,14 @@ async def export_to_sheets_command(update: Update, context: ContextTypes.DEFAULT
     await update.message.reply_text("🔄 Начинаю экспорт данных в Google Sheets...")
     
     try:
+        # Клиент Google API загружается при первой выгрузке, а не при запуске бота
+        from google_sheets_service import GoogleSheetsService
+        
         # Инициализируем сервис Google Sheets
-        sheets_service = GoogleSheetsService()
+        sheets_service = await asyncio.to_thread(GoogleSheetsService)
         
         # Получаем информацию о таблице
-        sheet_info = sheets_service.get_sheet_info()
+        sheet_info = await asyncio.to_thread(sheets_service.get_sheet_info)
         if sheet_info:
             await update.message.reply_text(
                 f"📊 Таблица: {sheet_info.get('title', 'Неизвестно')}\n"
@@ -276,7 +509,7 @@ async def export_to_sheets_command(update: Update, context: ContextTypes.DEFAULT
             )
         
         # Получаем всех пользователей из базы
-        users = db.get_all_users()
+        users = await asyncio.to_thread(db.get_all_users)
         await update.message.reply_text(f"👥 Найдено {len(users)} пользователей в базе данных")
         
         if not users:
@@ -284,7 +517,7 @@ async def export_to_sheets_command(update: Update, context: ContextTypes.DEFAULT
             return
         
         # Экспортируем данные
-        success = sheets_service.export_users_to_sheets(users)
+        success = await asyncio.to_thread(sheets_service.export_users_to_sheets, users)
         
         if success:
             await update.message.reply_text("✅ Экспорт завершен успешно!")
@@ -296,9 +529,219 @@ async def export_to_sheets_command(update: Update, context: ContextTypes.DEFAULT
         logger.error(error_msg)
         await update.message.reply_text(error_msg)
 
+def parse_date_arg(value: str) -> str:
+    """Разбор даты из аргумента команды (ДД.ММ.ГГГГ или ГГГГ-ММ-ДД) в формат ГГГГ-ММ-ДД"""
+    for date_format in ("%d.%m.%Y", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, date_format).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    raise ValueError(f"Некорректная дата: {value}")
+
+@instrument_handler
+async def export_file_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Команда выгрузки базы в файл Excel/CSV без Google Sheets"""
+    user = update.effective_user
+    
+    if user.id not in ADMINS:
+        await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
+        return
+    
+    from file_export import export_users_to_file, TELEGRAM_DOCUMENT_LIMIT
+    
+    args = list(context.args or [])
+    file_format = "xlsx"
+    if args and args[0].lower() in ("xlsx", "csv"):
+        file_format = args.pop(0).lower()
+    
+    try:
+        date_from = parse_date_arg(args[0]) if len(args) > 0 else None
+        date_to = parse_date_arg(args[1]) if len(args) > 1 else None
+    except ValueError as e:
+        await update.message.reply_text(
+            f"❌ {e}\n\n"
+            "Использование: /export_file [csv|xlsx] [с ДД.ММ.ГГГГ] [по ДД.ММ.ГГГГ]"
+        )
+        return
+    
+    await update.message.reply_text("🔄 Готовлю файл выгрузки...")
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            # Запись файла - блокирующая операция, выполняем вне цикла событий
+            path, count = await asyncio.to_thread(
+                export_users_to_file, db, tmp_dir, file_format, date_from, date_to
+            )
+        except Exception as e:
+            error_msg = f"❌ Ошибка выгрузки: {str(e)}"
+            logger.error(error_msg)
+            await update.message.reply_text(error_msg)
+            return
+        
+        if count == 0:
+            await update.message.reply_text("ℹ️ Нет пользователей для выгрузки")
+            return
+        
+        if os.path.getsize(path) > TELEGRAM_DOCUMENT_LIMIT:
+            await update.message.reply_text(
+                "❌ Файл выгрузки превышает ограничение Telegram (50 МБ). "
+                "Укажите более узкий диапазон дат."
+            )
+            return
+        
+        with open(path, 'rb') as document:
+            await context.bot.send_document(
+                chat_id=update.message.chat_id,
+                document=document,
+                filename=os.path.basename(path),
+                caption=f"📁 Выгружено пользователей: {count}"
+            )
+
+@instrument_handler
+async def export_media_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Команда выгрузки медиафайлов запросов за период в ZIP-архивы (см. media_export.py)"""
+    user = update.effective_user
+    
+    if user.id not in ADMINS:
+        await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
+        return
+    
+    from media_export import export_media
+    
+    args = list(context.args or [])
+    try:
+        date_from = parse_date_arg(args[0]) if len(args) > 0 else None
+        date_to = parse_date_arg(args[1]) if len(args) > 1 else None
+    except ValueError as e:
+        await update.message.reply_text(
+            f"❌ {e}\n\n"
+            "Использование: /export_media [с ДД.ММ.ГГГГ] [по ДД.ММ.ГГГГ]"
+        )
+        return
+    
+    await update.message.reply_text("🔄 Собираю медиафайлы...")
+    chat_id = update.message.chat_id
+    
+    async def send_part(path: str, number: int):
+        with open(path, 'rb') as document:
+            await context.bot.send_document(
+                chat_id=chat_id,
+                document=document,
+                filename=os.path.basename(path),
+                caption=f"📦 Медиафайлы запросов, часть {number}",
+                read_timeout=300,
+                write_timeout=300
+            )
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            exported, missing, parts = await export_media(db, context.bot, tmp_dir, send_part, date_from, date_to)
+        except Exception as e:
+            error_msg = f"❌ Ошибка выгрузки медиафайлов: {str(e)}"
+            logger.error(error_msg)
+            await update.message.reply_text(error_msg)
+            return
+    
+    if exported == 0 and missing == 0:
+        await update.message.reply_text("ℹ️ Нет медиафайлов за указанный период")
+        return
+    message = f"✅ Выгружено медиафайлов: {exported}, частей: {parts}"
+    if missing:
+        message += f"\n⚠️ Недоступно в Telegram и в архиве: {missing} (перечислены в manifest.csv)"
+    await update.message.reply_text(message)
+
+async def send_profile(bot, chat_id: int, mode: str, seconds: int):
+    """Профилирование в фоне и отправка результата администратору"""
+    try:
+        if mode == 'mem':
+            summary = await profiler.memory_snapshot(seconds)
+        else:
+            result = await profiler.profile_for(seconds)
+            summary = result.summary()
+            await bot.send_document(
+                chat_id=chat_id,
+                document=result.collapsed().encode('utf-8'),
+                filename=f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.collapsed.txt",
+                caption="🔥 Стеки в формате collapsed (flamegraph.pl, speedscope.app)"
+            )
+    except Exception as e:
+        logger.exception("❌ Ошибка профилирования")
+        await bot.send_message(chat_id=chat_id, text=f"❌ Ошибка профилирования: {str(e)}")
+        return
+    
+    if len(summary) > 4000:
+        summary = summary[:4000] + "\n..."
+    await bot.send_message(chat_id=chat_id, text=summary)
+
+@instrument_handler
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Команда профилирования: /profile [секунды] - процессор, /profile mem [секунды] - память"""
+    user = update.effective_user
+    
+    if user.id not in ADMINS:
+        await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
+        return
+    
+    args = list(context.args or [])
+    mode = 'cpu'
+    if args and args[0].lower() in ('cpu', 'mem'):
+        mode = args.pop(0).lower()
+    try:
+        seconds = int(args[0]) if args else 30
+    except ValueError:
+        seconds = 0
+    if not 1 <= seconds <= profiler.PROFILE_MAX_SECONDS:
+        await update.message.reply_text(
+            f"❌ Использование: /profile [mem] [секунды от 1 до {profiler.PROFILE_MAX_SECONDS}]"
+        )
+        return
+    
+    if profiler.is_running():
+        await update.message.reply_text("⏳ Профилирование уже запущено, дождитесь результата")
+        return
+    
+    what = "выделения памяти" if mode == 'mem' else "процессор"
+    await update.message.reply_text(f"🔬 Профилирую {what} {seconds} с, результат придет отдельным сообщением")
+    # Обработчик не ждет окончания - обновления обрабатываются как обычно и попадают в профиль
+    context.application.create_task(
+        send_profile(context.bot, update.effective_chat.id, mode, seconds), update=update
+    )
+
+@instrument_handler
+async def trace_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Команда просмотра медленных трасс: /trace - последние, /trace <id> - подробно"""
+    user = update.effective_user
+    
+    if user.id not in ADMINS:
+        await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
+        return
+    
+    if not context.args:
+        traces = recent_traces()
+        if not traces:
+            await update.message.reply_text("ℹ️ Медленных обновлений с момента запуска не было")
+            return
+        message = "🐢 Последние медленные обновления:\n\n"
+        for data in traces:
+            message += f"{data['trace_id']} - {data['name']}, {data['duration_ms']:.0f} мс ({data['created']})\n"
+        message += "\nПодробности: /trace <id>"
+        await update.message.reply_text(message)
+        return
+    
+    # Поиск может читать файл трасс - вне цикла событий
+    data = await asyncio.to_thread(find_trace, context.args[0])
+    if data is None:
+        await update.message.reply_text(f"❌ Трасса {context.args[0]} не найдена")
+        return
+    
+    message = format_trace(data)
+    if len(message) > 4000:
+        message = message[:4000] + "\n..."
+    await update.message.reply_text(message)
+
 async def handle_admin_show_users(query, context):
     """Обработчик кнопки 'Все пользователи' для администраторов"""
-    users = db.get_all_users()
+    users = await asyncio.to_thread(db.get_all_users)
     if users:
         message = "👥 Все пользователи:\n\n"
         for user_data in users:
@@ -327,7 +770,7 @@ async def handle_admin_show_users(query, context):
 
 async def handle_admin_show_today(query, context):
     """Обработчик кнопки 'Сегодняшние' для администраторов"""
-    users = db.get_today_registrations()
+    users = await asyncio.to_thread(db.get_today_registrations)
     if users:
         message = f"📅 Регистрации за {datetime.now().strftime('%d.%m.%Y')}:\n\n"
         for user_data in users:
@@ -358,11 +801,14 @@ async def handle_admin_export_sheets(query, context):
     await query.edit_message_text("🔄 Начинаю экспорт данных в Google Sheets...")
     
     try:
+        # Клиент Google API загружается при первой выгрузке, а не при запуске бота
+        from google_sheets_service import GoogleSheetsService
+        
         # Инициализируем сервис Google Sheets
-        sheets_service = GoogleSheetsService()
+        sheets_service = await asyncio.to_thread(GoogleSheetsService)
         
         # Получаем информацию о таблице
-        sheet_info = sheets_service.get_sheet_info()
+        sheet_info = await asyncio.to_thread(sheets_service.get_sheet_info)
         if sheet_info:
             await query.edit_message_text(
                 f"📊 Таблица: {sheet_info.get('title', 'Неизвестно')}\n"
@@ -371,7 +817,7 @@ async def handle_admin_export_sheets(query, context):
             )
         
         # Получаем всех пользователей из базы
-        users = db.get_all_users()
+        users = await asyncio.to_thread(db.get_all_users)
         await query.edit_message_text(f"👥 Найдено {len(users)} пользователей в базе данных\n\n🔄 Экспортирую...")
         
         if not users:
@@ -379,7 +825,7 @@ async def handle_admin_export_sheets(query, context):
             return
         
         # Экспортируем данные
-        success = sheets_service.export_users_to_sheets(users)
+        success = await asyncio.to_thread(sheets_service.export_users_to_sheets, users)
         
         if success:
             await query.edit_message_text(
@@ -401,12 +847,16 @@ async def handle_admin_help(query, context):
         "🤖 Помощь по управлению ботом:\n\n"
         "👥 Все пользователи - показать всех зарегистрированных пользователей\n"
         "📅 Сегодняшние - показать регистрации за сегодня\n"
-        "📊 Выгрузить в Excel - экспортировать новых пользователей в Google Sheets\n"
+        "📈 /stats [сегодня|неделя|месяц|все] [график] - статистика регистраций\n"
+        "📊 Выгрузить в Google Sheets - экспортировать новых пользователей в Google Sheets\n"
+        "📁 /export_file - выгрузить базу в файл Excel/CSV\n"
+        "📦 /export_media - выгрузить медиафайлы запросов в ZIP\n"
         "❓ Помощь - показать эту справку\n\n"
         "💡 Используйте кнопки выше для управления ботом"
     )
     await query.edit_message_text(help_text)
 
+@instrument_handler
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Команда помощи"""
     user = update.effective_user
@@ -418,7 +868,13 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             "• /start - приветствие и инструкции\n"
             "• /show_users - показать всех пользователей\n"
             "• /show_today - показать сегодняшние регистрации\n"
-            "• /export_sheets - выгрузить базу в Excel\n"
+            "• /stats [сегодня|неделя|месяц|все|с ДД.ММ.ГГГГ по ДД.ММ.ГГГГ] [график] - статистика регистраций\n"
+            "• /find <телефон или имя> - найти пользователя\n"
+            "• /export_sheets - выгрузить базу в Google Sheets\n"
+            "• /export_file [csv|xlsx] [с ДД.ММ.ГГГГ] [по ДД.ММ.ГГГГ] - выгрузить базу в файл\n"
+            "• /export_media [с ДД.ММ.ГГГГ] [по ДД.ММ.ГГГГ] - медиафайлы запросов в ZIP\n"
+            "• /trace [id] - медленные обновления и их трассы\n"
+            "• /profile [mem] [секунды] - профиль процессора или памяти работающего бота\n"
             "• /help - показать эту справку\n\n"
             "💡 Все команды доступны в меню бота (кнопка 'Меню' рядом со строкой ввода)\n\n"
             "Для пользователей:\n"
@@ -448,7 +904,13 @@ async def setup_bot_commands(application):
         admin_commands = [
             BotCommand("show_users", "👥 Показать всех пользователей"),
             BotCommand("show_today", "📅 Сегодняшние регистрации"),
-            BotCommand("export_sheets", "📊 Выгрузить базу в Excel")
+            BotCommand("stats", "📈 Статистика регистраций"),
+            BotCommand("find", "🔍 Найти пользователя по телефону или имени"),
+            BotCommand("export_sheets", "📊 Выгрузить базу в Google Sheets"),
+            BotCommand("export_file", "📁 Выгрузить базу в файл Excel/CSV"),
+            BotCommand("export_media", "📦 Выгрузить медиафайлы запросов в ZIP"),
+            BotCommand("trace", "🐢 Трассы медленных обновлений"),
+            BotCommand("profile", "🔬 Профилирование работающего бота")
         ]
         
         # Устанавливаем базовые команды для всех пользователей
@@ -470,57 +932,231 @@ async def setup_bot_commands(application):
     except Exception as e:
         logger.error(f"❌ Ошибка настройки команд: {e}")
 
-def main() -> None:
-    """Основная функция запуска бота"""
-    if not BOT_TOKEN:
-        logger.error("Не указан токен бота в переменной BOT_TOKEN")
-        return
+class MetricsRequest(HTTPXRequest):
+    """HTTP-клиент бота с замером длительности и ошибок вызовов Bot API"""
     
-    # Создаем приложение
-    application = Application.builder().token(BOT_TOKEN).build()
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        error = None
+        try:
+            code, payload = await super().do_request(url, method, request_data, **kwargs)
+        except Exception as e:
+            error = type(e).__name__
+            TELEGRAM_API_ERRORS.labels(api_method, error).inc()
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            TELEGRAM_API_SECONDS.labels(api_method).observe(duration)
+            record_span('telegram', api_method, started, duration, error)
+        if code != 200:
+            TELEGRAM_API_ERRORS.labels(api_method, code).inc()
+        elif api_method == 'getUpdates':
+            note_get_updates()
+        return code, payload
+
+class TracingApplication(Application):
+    """Приложение, обрабатывающее каждое обновление в собственной трассе (см. tracing.py)"""
+    
+    # Отсев повторно доставленных обновлений (см. update_dedup.py), задается в build_application
+    deduplicator: Optional[UpdateDeduplicator] = None
+    # Сборка альбомов в один запрос (см. media_group.py), задается в build_application
+    media_groups: Optional[MediaGroupBuffer] = None
+    # Архив медиафайлов запросов (см. media_archive.py), задается в build_application
+    media_archive: Optional[MediaArchive] = None
+    # Журнал событий пользователей (см. event_journal.py), задается в build_application
+    journal: Optional['EventJournal'] = None
+    
+    async def process_update(self, update: object) -> None:
+        if not isinstance(update, Update):
+            await super().process_update(update)
+            return
+        if self.deduplicator is not None:
+            if self.deduplicator.is_duplicate(update):
+                return
+            if self.deduplicator.should_save():
+                self.create_task(self.deduplicator.save())
+        if update.callback_query:
+            kind = 'callback_query'
+        elif update.message:
+            kind = 'message'
+        else:
+            kind = 'update'
+        user = update.effective_user
+        with trace_update(kind, update_id=update.update_id, user_id=user.id if user else None):
+            await super().process_update(update)
+    
+    async def start(self) -> None:
+        await super().start()
+        if self.journal is not None:
+            await self.journal.start()
+        if self.media_archive is not None:
+            await self.media_archive.start(self)
+    
+    async def stop(self) -> None:
+        await super().stop()
+        if self.media_groups is not None:
+            await self.media_groups.flush()
+        if self.journal is not None:
+            await self.journal.stop()
+        if self.media_archive is not None:
+            await self.media_archive.stop()
+        if self.deduplicator is not None:
+            await self.deduplicator.save()
+
+def build_application(token: str, request=None, get_updates_request=None,
+                      dedup_key: str = 'update_dedup', journal_stream: str = 'events') -> Application:
+    """
+    Создание приложения бота со всеми обработчиками
+    
+    Args:
+        token: Токен бота
+        request, get_updates_request: HTTP-клиенты Bot API (по умолчанию с метриками);
+            бенчмарки подставляют сюда локальную замену API
+        dedup_key: Ключ состояния отсева повторов в хранилище (свой у каждого процесса)
+        journal_stream: Поток журнала событий - префикс его файлов (свой у каждого процесса)
+    """
+    builder = (
+        Application.builder()
+        .token(token)
+        .request(request or MetricsRequest(connection_pool_size=256))
+        .get_updates_request(get_updates_request or MetricsRequest())
+        .application_class(TracingApplication)
+    )
+    if BOT_API_BASE_URL:
+        builder = builder.base_url(BOT_API_BASE_URL)
+    if db is not None:
+        # Состояния разговоров - в хранилище: общие для всех процессов и переживают перезапуск
+        builder = builder.persistence(StoragePersistence(db))
+    application = builder.build()
+    if db is not None:
+        # Повторно доставленные обновления отсеиваются до обработчиков
+        application.deduplicator = UpdateDeduplicator(db, dedup_key)
+        application.deduplicator.load()
+    application.media_groups = MediaGroupBuffer(functools.partial(handle_media_group, application))
+    if db is not None and MEDIA_ARCHIVE_DIR:
+        application.media_archive = MediaArchive(db)
+    # Журнал тянет модули восстановления базы (sqlite3, argparse) - загружаем при сборке приложения
+    from event_journal import EventJournal, EVENT_JOURNAL_DIR
+    if EVENT_JOURNAL_DIR:
+        application.journal = EventJournal(stream=journal_stream)
     
     # Настраиваем команды бота через post_init
     application.post_init = setup_bot_commands
     
     # Создаем обработчик разговора для обычных пользователей
-    conv_handler = ConversationHandler(
-        entry_points=[CommandHandler("start", start)],
-        states={
-            WAITING_CONTACT: [
-                MessageHandler(filters.CONTACT, handle_contact),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, lambda u, c: u.message.reply_text(
-                    "Пожалуйста, поделитесь контактом, используя кнопку ниже.",
-                    reply_markup=get_contact_keyboard()
-                ))
-            ],
-            WAITING_REQUEST: [
-                MessageHandler(
-                    filters.TEXT | filters.PHOTO | filters.VOICE | filters.VIDEO_NOTE,
-                    handle_request
-                )
-            ]
-        },
-        fallbacks=[CommandHandler("start", start)]
-    )
+    # Кнопки под запросом переводят разговор в другое состояние - обрабатываются внутри разговора
+    request_actions = CallbackQueryHandler(handle_callback, pattern="^(change_request|finish)$")
+    with warnings.catch_warnings():
+        # Разговор ведется по пользователю и чату, а не по сообщению с кнопками (per_message=False) - так и задумано
+        warnings.filterwarnings('ignore', message="If 'per_message=False'", category=PTBUserWarning)
+        conv_handler = ConversationHandler(
+            entry_points=[CommandHandler("start", start), request_actions],
+            states={
+                WAITING_CONTACT: [
+                    MessageHandler(filters.CONTACT, handle_contact),
+                    MessageHandler(filters.TEXT & ~filters.COMMAND, ask_contact_again)
+                ],
+                WAITING_REQUEST: [
+                    MessageHandler(
+                        filters.TEXT | filters.PHOTO | filters.VOICE | filters.VIDEO_NOTE,
+                        handle_request
+                    )
+                ]
+            },
+            fallbacks=[CommandHandler("start", start), request_actions],
+            name="registration",
+            persistent=db is not None
+        )
     
     # Добавляем обработчики
+    # Части альбома, начатого в разговоре, собираются до обработчиков разговора
+    # (только новые сообщения: у отредактированных и постов каналов update.message пустой)
+    application.add_handler(MessageHandler(filters.UpdateType.MESSAGE & filters.PHOTO, collect_media_group), group=-1)
     application.add_handler(conv_handler)
-    application.add_handler(CallbackQueryHandler(handle_callback))
     application.add_handler(CommandHandler("show_users", show_users_command))
     application.add_handler(CommandHandler("show_today", show_today_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("find", find_command))
     application.add_handler(CommandHandler("export_sheets", export_to_sheets_command))
+    application.add_handler(CommandHandler("export_file", export_file_command))
+    application.add_handler(CommandHandler("export_media", export_media_command))
+    application.add_handler(CommandHandler("trace", trace_command))
+    application.add_handler(CommandHandler("profile", profile_command))
     application.add_handler(CommandHandler("help", help_command))
     
+    # Метрики для Prometheus
+    UPDATE_QUEUE_DEPTH.set_function(application.update_queue.qsize)
+    
+    return application
+
+async def clear_stale_outbox(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Удаление старых записей outbox, когда синхронизация с Google Sheets не запущена"""
+    removed = await asyncio.to_thread(db.delete_stale_outbox_entries, SHEETS_OUTBOX_MAX_AGE_HOURS)
+    if removed:
+        logger.info(f"🧹 Outbox Google Sheets: удалено {removed} записей старше {SHEETS_OUTBOX_MAX_AGE_HOURS:g} ч")
+
+def start_background_services(application) -> None:
+    """
+    Фоновые задачи бота: резервные копии и синхронизация с Google Sheets
+    
+    При нескольких процессах (webhook_supervisor.py) запускаются только в одном из них.
+    """
     # Запускаем сервис резервных копий
     if backup_service:
         logger.info("🔄 Инициализация сервиса резервных копий...")
-        backup_service.start_scheduler()
-        logger.info("✅ Сервис резервных копий запущен")
+        if backup_service.schedule(application):
+            logger.info("✅ Сервис резервных копий запущен")
     else:
         logger.warning("⚠️ Сервис резервных копий не инициализирован (отсутствует токен или BACKUPTO)")
     
+    # Запускаем непрерывную синхронизацию с Google Sheets
+    if os.getenv('GoogleSheetsID'):
+        sync_started = SheetsSyncService(db).start()
+    else:
+        sync_started = False
+        logger.info("ℹ️ Синхронизация с Google Sheets отключена (не задан GoogleSheetsID)")
+    if not sync_started:
+        # Триггеры пишут в outbox при каждом изменении, а разбирать его некому - очередь чистится
+        # по возрасту: записи, которые ждет синхронизация другого экземпляра бота с той же базой,
+        # она забирает за секунды
+        application.job_queue.run_repeating(
+            clear_stale_outbox, interval=SHEETS_OUTBOX_CLEAR_INTERVAL, first=0, name='sheets-outbox-clear'
+        )
+    
+    SHEETS_OUTBOX_DEPTH.set_function(db.get_outbox_size)
+    
+    # Сверка архива медиафайлов с запросами при запуске
+    if application.media_archive is not None:
+        application.media_archive.catch_up = True
+
+def main() -> None:
+    """Основная функция запуска бота"""
+    startup()
+    
+    if not BOT_TOKEN:
+        logger.error("Не указан токен бота в переменной BOT_TOKEN")
+        return
+    
+    # Создаем приложение
+    application = build_application(BOT_TOKEN)
+    start_background_services(application)
+    
+    # Метрики для Prometheus (если задан METRICS_PORT)
+    start_http_server()
+    
+    # Проверка здоровья и сигналы watchdog systemd (см. health_watchdog.py)
+    health_probe = HealthProbe(db)
+    
+    async def post_init(app):
+        await setup_bot_commands(app)
+        await health_probe.start(app)
+    
+    application.post_init = post_init
+    application.post_stop = health_probe.stop
+    
     # Запускаем бота
-    print("🤖 Бот запущен...")
+    logger.info("🤖 Бот запущен...")
     
     # Команды бота можно настроить вручную через BotFather или через API после запуска
     # Для автоматической настройки команд используйте BotFather: /setcommands
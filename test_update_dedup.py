@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Проверка отсева повторных обновлений: окно update_id и кольцо сообщений
+"""
+
+from update_dedup import UpdateWindow, MessageRing
+
+SIZE = 64
+
+def test_duplicate_update_id():
+    """Повтор update_id отсеивается, новые id проходят"""
+    window = UpdateWindow(SIZE)
+    assert window.add(1000)
+    assert window.add(1001)
+    assert not window.add(1000)
+    assert not window.add(1001)
+    # Пропущенный id ниже границы, но в окне, - еще не обработан
+    assert window.add(999)
+    assert not window.add(999)
+    print("✅ Повтор update_id отсеивается")
+
+def test_window_edge():
+    """Самый старый id окна (high - size + 1) помнится, следующий ниже - начало новой последовательности"""
+    window = UpdateWindow(SIZE)
+    high = 1000
+    assert window.add(high - SIZE + 1)
+    assert window.add(high)
+    assert not window.add(high - SIZE + 1)
+    assert window.high == high
+
+    # high - size уже вне окна: окно начинается заново с этого id
+    assert window.add(high - SIZE)
+    assert window.high == high - SIZE
+    assert not window.add(high - SIZE)
+    print("✅ Граница окна обрабатывается точно")
+
+def test_jump_above_window():
+    """Скачок выше окна сбрасывает карту: id, попавшие на те же позиции, не считаются повтором"""
+    window = UpdateWindow(SIZE)
+    for update_id in range(100, 100 + SIZE):
+        assert window.add(update_id)
+    high = 100 + SIZE - 1 + 10 * SIZE
+    assert window.add(high)
+    assert window.high == high
+    # Позиции прежних id очищены
+    assert window.add(high - 1)
+    assert window.add(high - SIZE + 1)
+    assert not window.add(high)
+
+    # Небольшой скачок очищает только новые позиции окна
+    window.add(high + 1)
+    assert not window.add(high - 1)
+    assert window.add(high + 5)
+    assert window.add(high + 3)
+    print("✅ Скачок выше окна очищает карту")
+
+def test_far_below_window():
+    """id намного ниже окна - новая последовательность: граница переносится, id принимается"""
+    window = UpdateWindow(SIZE)
+    assert window.add(5_000_000)
+    assert window.add(5_000_001)
+    assert window.add(17)
+    assert window.high == 17
+    assert not window.add(17)
+    assert window.add(18)
+    # Старая последовательность забыта: ее id теперь выше границы
+    assert window.add(5_000_001)
+    assert window.high == 5_000_001
+    print("✅ id ниже окна начинает новую последовательность")
+
+def test_load_with_other_size():
+    """Состояние, сохраненное с другим размером окна: все, что не выше границы, считается обработанным"""
+    saved = UpdateWindow(SIZE)
+    for update_id in (500, 510, 520):
+        saved.add(update_id)
+    data = saved.dump()
+
+    same = UpdateWindow.load(data, SIZE)
+    assert same.high == 520
+    assert not same.add(510)
+    assert same.add(515)
+
+    other = UpdateWindow.load(data, SIZE * 2)
+    assert other.size == SIZE * 2 and other.high == 520
+    assert not other.add(515)
+    assert not other.add(520 - 2 * SIZE + 1)
+    assert other.add(521)
+
+    empty = UpdateWindow.load(UpdateWindow(SIZE).dump(), SIZE * 2)
+    assert empty.high is None
+    assert empty.add(1)
+    print("✅ Сохраненное состояние загружается при любом размере окна")
+
+def test_message_ring_eviction():
+    """Кольцо помнит последние capacity ключей, самый старый вытесняется"""
+    ring = MessageRing(3)
+    for message_id in (1, 2, 3):
+        assert ring.add((10, message_id))
+    assert not ring.add((10, 2))
+    assert ring.add((11, 2))
+    # (10, 1) вытеснен четвертым ключом
+    assert ring.add((10, 1))
+    assert len(ring.keys) == 3
+    assert not ring.add((10, 3))
+    assert not ring.add((11, 2))
+    # (10, 2) вытеснен возвращением (10, 1)
+    assert ring.add((10, 2))
+    print("✅ Кольцо сообщений вытесняет самые старые ключи")
+
+if __name__ == "__main__":
+    test_duplicate_update_id()
+    test_window_edge()
+    test_jump_above_window()
+    test_far_below_window()
+    test_load_with_other_size()
+    test_message_ring_eviction()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Трассировка обработки обновлений
+
+Каждое входящее обновление получает идентификатор трассы (contextvars, поэтому
+трасса видна и в потоках asyncio.to_thread). Внутри трассы записываются
+интервалы: обработчик, запросы к базе, вызовы Bot API и Google API.
+
+Выборка решается в начале трассы (TRACE_SAMPLE_RATE): интервалы пишутся только
+для попавших в выборку обновлений. Трассы дольше TRACE_SLOW_MS сохраняются в
+файл TRACE_FILE (JSON-строки, с ротацией) и доступны администратору командой
+/trace <id>. Идентификатор трассы добавляется в записи лога (trace_id).
+"""
+import os
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+import contextvars
+from collections import deque
+from datetime import datetime
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '1.0'))
+SLOW_MS = float(os.getenv('TRACE_SLOW_MS', '1000'))
+TRACE_FILE = os.getenv('TRACE_FILE', 'slow_traces.jsonl')
+TRACE_FILE_MAX_BYTES = int(os.getenv('TRACE_FILE_MAX_BYTES', str(5 * 1024 * 1024)))
+TRACE_FILE_BACKUPS = int(os.getenv('TRACE_FILE_BACKUPS', '3'))
+
+_current = contextvars.ContextVar('naumovado_trace', default=None)
+# Последние медленные трассы - чтобы /trace не читал файл
+_recent = deque(maxlen=100)
+_writer = None
+
+class Trace:
+    """Трасса одного обновления"""
+
+    __slots__ = ('trace_id', 'name', 'attrs', 'started', 'created', 'sampled', 'spans', 'duration')
+
+    def __init__(self, name: str, attrs: dict, sampled: bool):
+        self.trace_id = os.urandom(6).hex()
+        self.name = name
+        self.attrs = attrs
+        self.sampled = sampled
+        self.started = time.perf_counter()
+        self.created = time.time()
+        # (вид, имя, начало от старта трассы, длительность, ошибка)
+        self.spans = []
+        self.duration = None
+
+    def to_dict(self) -> dict:
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'created': datetime.fromtimestamp(self.created).isoformat(timespec='milliseconds'),
+            'duration_ms': round(self.duration * 1000, 3),
+            'attrs': self.attrs,
+            'spans': [
+                {'kind': kind, 'name': name, 'start_ms': round(start * 1000, 3),
+                 'duration_ms': round(duration * 1000, 3), 'error': error}
+                for kind, name, start, duration, error in self.spans
+            ],
+        }
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+def record_span(kind: str, name: str, started: float, duration: float, error: str = None):
+    """Запись интервала в текущую трассу (started - значение time.perf_counter())"""
+    trace = _current.get()
+    if trace is not None and trace.sampled:
+        trace.spans.append((kind, name, started - trace.started, duration, error))
+
+class Span:
+    """Интервал трассы как контекстный менеджер: with Span('google', 'values.get'): ..."""
+
+    __slots__ = ('kind', 'name', 'started')
+
+    def __init__(self, kind: str, name: str):
+        self.kind = kind
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record_span(self.kind, self.name, self.started, time.perf_counter() - self.started,
+                    exc_type.__name__ if exc_type else None)
+
+class trace_update:
+    """
+    Контекст трассы обновления
+
+    with trace_update('message', update_id=1, user_id=2):
+        ...
+    """
+
+    __slots__ = ('trace', '_token')
+
+    def __init__(self, name: str, **attrs):
+        self.trace = Trace(name, attrs, SAMPLE_RATE >= 1 or random.random() < SAMPLE_RATE)
+
+    def __enter__(self) -> Trace:
+        self._token = _current.set(self.trace)
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+        trace = self.trace
+        trace.duration = time.perf_counter() - trace.started
+        if trace.duration * 1000 < SLOW_MS:
+            return
+        if not trace.sampled:
+            logger.warning(f"🐢 Медленное обновление {trace.name} ({trace.duration * 1000:.0f} мс), "
+                           f"трасса не записана: не попала в выборку", extra={'trace_id': trace.trace_id})
+            return
+        data = trace.to_dict()
+        _recent.append(data)
+        _get_writer().info(json.dumps(data, ensure_ascii=False, default=str))
+        logger.warning(f"🐢 Медленное обновление {trace.name} ({trace.duration * 1000:.0f} мс)",
+                       extra={'trace_id': trace.trace_id})
+
+def _get_writer() -> logging.Logger:
+    """Логгер файла медленных трасс: запись через очередь, ротация по размеру"""
+    global _writer
+    if _writer is None:
+        # logging_setup импортирует этот модуль - импорт здесь, чтобы не было цикла
+        from logging_setup import NonBlockingQueueHandler
+
+        writer = logging.getLogger('naumovado.slow_traces')
+        writer.propagate = False
+        writer.setLevel(logging.INFO)
+        file_handler = logging.handlers.RotatingFileHandler(
+            TRACE_FILE, maxBytes=TRACE_FILE_MAX_BYTES, backupCount=TRACE_FILE_BACKUPS, encoding='utf-8'
+        )
+        handler = NonBlockingQueueHandler(queue.Queue(maxsize=1000))
+        writer.addHandler(handler)
+        listener = logging.handlers.QueueListener(handler.queue, file_handler)
+        listener.start()
+        atexit.register(listener.stop)
+        _writer = writer
+    return _writer
+
+def recent_traces(limit: int = 10) -> list:
+    """Последние медленные трассы, новые первыми"""
+    return list(_recent)[::-1][:limit]
+
+def find_trace(trace_id: str) -> Optional[dict]:
+    """Поиск трассы в памяти, затем в файле и его ротированных копиях"""
+    for data in reversed(_recent):
+        if data['trace_id'] == trace_id:
+            return data
+    marker = f'"trace_id": "{trace_id}"'
+    paths = [TRACE_FILE] + [f"{TRACE_FILE}.{index}" for index in range(1, TRACE_FILE_BACKUPS + 1)]
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if marker in line:
+                    return json.loads(line)
+    return None
+
+def format_trace(data: dict, max_spans: int = 40) -> str:
+    """Текстовое представление трассы для сообщения администратору"""
+    attrs = ', '.join(f"{key}={value}" for key, value in data['attrs'].items() if value is not None)
+    lines = [f"🔎 Трасса {data['trace_id']}: {data['name']} ({attrs})",
+             f"{data['created']}, всего {data['duration_ms']:.1f} мс", ""]
+    by_kind = {}
+    for span in data['spans']:
+        by_kind[span['kind']] = by_kind.get(span['kind'], 0) + span['duration_ms']
+    if by_kind:
+        lines.append("По видам: " + ', '.join(f"{kind} {total:.1f} мс" for kind, total in
+                                              sorted(by_kind.items(), key=lambda item: -item[1])))
+    for span in data['spans'][:max_spans]:
+        error = f" ❌ {span['error']}" if span['error'] else ""
+        lines.append(f"+{span['start_ms']:.1f} мс  {span['kind']} {span['name']}  {span['duration_ms']:.1f} мс{error}")
+    if len(data['spans']) > max_spans:
+        lines.append(f"... еще {len(data['spans']) - max_spans} интервалов")
+    return "\n".join(lines)
+
+class TraceIdFilter(logging.Filter):
+    """Добавляет trace_id текущей трассы в записи лога"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        trace = _current.get()
+        if trace is not None and not hasattr(record, 'trace_id'):
+            record.trace_id = trace.trace_id
+        return True
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Отсев повторно доставленных обновлений
+
+После перезапуска или сбоя сети Telegram может доставить уже обработанное
+обновление еще раз (getUpdates без подтвержденного offset, повтор webhook).
+Повтор отсеивается до всех обработчиков одной проверкой в памяти:
+  - по update_id: битовая карта последних DEDUP_WINDOW идентификаторов
+    (update_id растут) и верхняя граница - самый большой увиденный id;
+    id ниже окна означает, что Telegram начал новую последовательность
+    (после недели без обновлений update_id выбирается случайно): окно
+    начинается заново с этого id, а настоящий повтор такого старого
+    обновления отсеет проверка по сообщению;
+  - по (chat_id, message_id) нового сообщения: кольцо последних
+    DEDUP_MESSAGES ключей.
+Память фиксирована: DEDUP_WINDOW / 8 байт карты и кольцо ключей.
+
+Граница и карта сохраняются в хранилище (bot_state) не чаще раза в
+DEDUP_SAVE_INTERVAL секунд и при остановке, поэтому повтор отсеивается и
+после перезапуска. Обновление, пришедшее за время между последним
+сохранением и аварийным завершением, после перезапуска будет обработано еще раз.
+"""
+import os
+import time
+import struct
+import asyncio
+import logging
+
+from metrics import DUPLICATE_UPDATES
+
+logger = logging.getLogger(__name__)
+
+DEDUP_WINDOW = int(os.getenv('DEDUP_WINDOW', '65536'))
+DEDUP_MESSAGES = int(os.getenv('DEDUP_MESSAGES', '16384'))
+DEDUP_SAVE_INTERVAL = float(os.getenv('DEDUP_SAVE_INTERVAL', '1'))
+
+# Заголовок сохраненного состояния: размер окна и верхняя граница
+_HEADER = struct.Struct('<Iq')
+
+class UpdateWindow:
+    """Множество увиденных update_id: битовая карта окна ниже верхней границы"""
+
+    def __init__(self, size: int = DEDUP_WINDOW):
+        self.size = size
+        self.bits = bytearray((size + 7) // 8)
+        self.high = None
+
+    def _clear(self, first: int, last: int):
+        """Сброс битов идентификаторов first..last (новые позиции окна)"""
+        if last - first + 1 >= self.size:
+            self.bits[:] = bytes(len(self.bits))
+            return
+        for update_id in range(first, last + 1):
+            position = update_id % self.size
+            self.bits[position >> 3] &= ~(1 << (position & 7)) & 0xFF
+
+    def add(self, update_id: int) -> bool:
+        """Отметка update_id; False - он уже был"""
+        if self.high is None or update_id > self.high:
+            if self.high is not None:
+                self._clear(self.high + 1, update_id)
+            self.high = update_id
+        elif update_id <= self.high - self.size:
+            # Новая последовательность update_id - прежние границу и карту не сравнить с ней
+            self.bits[:] = bytes(len(self.bits))
+            self.high = update_id
+        position = update_id % self.size
+        mask = 1 << (position & 7)
+        if self.bits[position >> 3] & mask:
+            return False
+        self.bits[position >> 3] |= mask
+        return True
+
+    def dump(self) -> bytes:
+        return _HEADER.pack(self.size, -1 if self.high is None else self.high) + bytes(self.bits)
+
+    @classmethod
+    def load(cls, data: bytes, size: int = DEDUP_WINDOW) -> 'UpdateWindow':
+        window = cls(size)
+        saved_size, high = _HEADER.unpack_from(data)
+        if high < 0:
+            return window
+        window.high = high
+        if saved_size == size and len(data) == _HEADER.size + len(window.bits):
+            window.bits[:] = data[_HEADER.size:]
+        # Другой размер окна: известна только граница, все, что не выше нее, считается обработанным
+        else:
+            window.bits[:] = b'\xff' * len(window.bits)
+        return window
+
+class MessageRing:
+    """Последние capacity ключей (chat_id, message_id)"""
+
+    def __init__(self, capacity: int = DEDUP_MESSAGES):
+        self.ring = [None] * capacity
+        self.keys = set()
+        self.position = 0
+
+    def add(self, key) -> bool:
+        """Запоминание ключа; False - он уже есть"""
+        if key in self.keys:
+            return False
+        old = self.ring[self.position]
+        if old is not None:
+            self.keys.discard(old)
+        self.ring[self.position] = key
+        self.keys.add(key)
+        self.position = (self.position + 1) % len(self.ring)
+        return True
+
+class UpdateDeduplicator:
+    """Отсев повторов перед обработчиками с сохранением состояния в хранилище"""
+
+    def __init__(self, db, state_key: str = 'update_dedup'):
+        self.db = db
+        self.state_key = state_key
+        self.updates = UpdateWindow()
+        self.messages = MessageRing()
+        self._dirty = False
+        self._saved_at = 0.0
+        self._saving = False
+
+    def load(self):
+        data = self.db.get_state(self.state_key)
+        if data:
+            try:
+                self.updates = UpdateWindow.load(data)
+                logger.info(f"ℹ️ Отсев повторов: последнее обработанное обновление {self.updates.high}")
+            except struct.error as e:
+                logger.warning(f"⚠️ Сохраненное состояние отсева повторов повреждено: {e}")
+
+    def is_duplicate(self, update) -> bool:
+        """Проверка и отметка обновления (telegram.Update)"""
+        if not self.updates.add(update.update_id):
+            DUPLICATE_UPDATES.labels('update_id').inc()
+            return True
+        self._dirty = True
+        message = update.message
+        if message is not None and not self.messages.add((message.chat_id, message.message_id)):
+            DUPLICATE_UPDATES.labels('message').inc()
+            return True
+        return False
+
+    def should_save(self) -> bool:
+        return self._dirty and not self._saving and time.monotonic() - self._saved_at >= DEDUP_SAVE_INTERVAL
+
+    async def save(self):
+        """Сохранение границы и карты (в потоке - запись в базу не задерживает обработку)"""
+        if self._saving or not self._dirty:
+            return
+        self._saving = True
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        try:
+            await asyncio.to_thread(self.db.set_state, self.state_key, self.updates.dump())
+        except Exception as e:
+            self._dirty = True
+            logger.error(f"❌ Не удалось сохранить состояние отсева повторов: {e}")
+        finally:
+            self._saving = False
+
+def main():
+    """Замер стоимости проверки обновления"""
+    window = UpdateWindow()
+    ring = MessageRing()
+    iterations = 1_000_000
+    started = time.perf_counter()
+    for update_id in range(iterations):
+        window.add(update_id)
+    print(f"UpdateWindow.add (новое): {(time.perf_counter() - started) / iterations * 1e9:.0f} нс")
+    started = time.perf_counter()
+    for update_id in range(iterations - DEDUP_WINDOW, iterations):
+        window.add(update_id)
+    print(f"UpdateWindow.add (повтор): {(time.perf_counter() - started) / DEDUP_WINDOW * 1e9:.0f} нс")
+    started = time.perf_counter()
+    for message_id in range(iterations):
+        ring.add((1, message_id))
+    print(f"MessageRing.add: {(time.perf_counter() - started) / iterations * 1e9:.0f} нс")
+    print(f"Память: карта {len(window.bits)} байт, кольцо {len(ring.ring)} ключей; "
+          f"сохраняемое состояние {len(window.dump())} байт")
+
+if __name__ == "__main__":
+    main()
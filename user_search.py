@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Нормализация телефонов и ключи поиска пользователей
+
+Телефон сохраняется в формате E.164 (+79991234567): Telegram присылает номер
+то с "+", то без, а вручную введенные номера бывают с пробелами, скобками и
+"8" в начале. Номера без кода страны дополняются PHONE_DEFAULT_COUNTRY.
+
+Для поиска по имени хранятся ключи (таблица user_names): имя, фамилия и
+"имя фамилия"/"фамилия имя" в casefold - SQLite сравнивает без учета
+регистра только латиницу. Поиск по префиксу - диапазон [префикс, префикс + U+10FFFF)
+по индексу, без просмотра всей таблицы.
+"""
+import os
+import re
+from typing import Optional, Set, Tuple
+
+PHONE_DEFAULT_COUNTRY = os.getenv('PHONE_DEFAULT_COUNTRY', '7')
+
+# Длина национального номера без кода страны (для PHONE_DEFAULT_COUNTRY)
+NATIONAL_NUMBER_LENGTH = 10
+
+# Больше любого символа в UTF-8 и в порядке сравнения "C" - верхняя граница диапазона префикса
+PREFIX_END = '\U0010ffff'
+
+# Ключей имени у одного пользователя не больше (см. name_keys)
+MAX_NAME_KEYS = 4
+
+_PHONE_CHARS = re.compile(r'^[+\d\s().-]+$')
+_E164 = re.compile(r'^\+\d{8,15}$')
+
+def normalize_phone(phone: Optional[str]) -> Optional[str]:
+    """
+    Телефон в формате E.164
+
+    Строка, не похожая на телефон, возвращается без изменений (только без
+    пробелов по краям) - исходные данные не теряются.
+    """
+    if phone is None:
+        return None
+    phone = phone.strip()
+    if not _PHONE_CHARS.match(phone):
+        return phone
+    digits = re.sub(r'\D', '', phone)
+    if not phone.startswith('+'):
+        if phone.startswith('00'):
+            # Международный префикс 00
+            digits = digits[2:]
+        elif len(digits) == NATIONAL_NUMBER_LENGTH + 1 and digits.startswith('8') and PHONE_DEFAULT_COUNTRY == '7':
+            # 8XXXXXXXXXX - российский номер в национальном формате
+            digits = '7' + digits[1:]
+        elif len(digits) == NATIONAL_NUMBER_LENGTH:
+            digits = PHONE_DEFAULT_COUNTRY + digits
+    if not 8 <= len(digits) <= 15:
+        return phone
+    return '+' + digits
+
+def name_keys(first_name: Optional[str], last_name: Optional[str]) -> Set[str]:
+    """Ключи поиска по имени: имя, фамилия и обе комбинации полного имени"""
+    first = ' '.join((first_name or '').split()).casefold()
+    last = ' '.join((last_name or '').split()).casefold()
+    keys = {key for key in (first, last) if key}
+    if first and last:
+        keys.add(f"{first} {last}")
+        keys.add(f"{last} {first}")
+    return keys
+
+def parse_query(text: str) -> Tuple[str, str]:
+    """
+    Запрос /find: ('phone', префикс E.164) или ('name', префикс ключа имени)
+
+    Запрос из цифр (с +, пробелами, скобками, дефисами) - телефон или его начало;
+    начало номера без кода страны дополняется PHONE_DEFAULT_COUNTRY.
+    """
+    text = ' '.join(text.split())
+    digits = re.sub(r'\D', '', text)
+    if _PHONE_CHARS.match(text) and len(digits) >= 3:
+        normalized = normalize_phone(text)
+        if _E164.match(normalized):
+            return 'phone', normalized
+        # Начало номера: "+7 999" -> "+7999", "8 999" -> "+7999", "999" -> "+7999"
+        if text.startswith('+'):
+            return 'phone', '+' + digits
+        if text.startswith('00'):
+            return 'phone', '+' + digits[2:]
+        if digits.startswith('8') and PHONE_DEFAULT_COUNTRY == '7':
+            return 'phone', '+7' + digits[1:]
+        if digits.startswith(PHONE_DEFAULT_COUNTRY):
+            return 'phone', '+' + digits
+        return 'phone', '+' + PHONE_DEFAULT_COUNTRY + digits
+    return 'name', text.casefold()
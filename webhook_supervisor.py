@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+"""
+Несколько процессов бота за одним webhook
+
+Один процесс бота обрабатывает обновления на одном ядре (GIL), поэтому под
+нагрузкой бот упирается в процессор. В этом режиме супервизор:
+  - принимает обновления Telegram по webhook (WEBHOOK_LISTEN:WEBHOOK_PORT,
+    путь WEBHOOK_PATH, секрет WEBHOOK_SECRET) и регистрирует webhook по
+    адресу WEBHOOK_URL;
+  - раздает обновления WEBHOOK_WORKERS процессам-обработчикам (по умолчанию
+    по числу ядер) по остатку от деления id пользователя: все обновления
+    одного пользователя попадают в один процесс в порядке поступления;
+  - следит за процессами: упавший или зависший (нет сигнала жизни дольше
+    WORKER_STALL_SECONDS) процесс перезапускается, его очередь сохраняется;
+  - по SIGHUP перезапускает процессы по одному (новая версия кода без
+    потери обновлений): процесс дообрабатывает свою очередь и завершается,
+    новые обновления ждут в очереди следующего.
+
+Общее состояние - в хранилище (storage.py): пользователи и состояния
+разговоров (conversation_persistence.py). Для нескольких процессов лучше
+PostgreSQL; SQLite в режиме WAL тоже работает, но записи идут по очереди.
+Резервные копии, синхронизация с Google Sheets и настройка команд бота
+работают только в процессе 0.
+
+Метрики: супервизора - на METRICS_PORT, процесса i - на METRICS_PORT + 1 + i.
+
+Запуск: python webhook_supervisor.py (вместо simple_bot.py)
+"""
+import os
+import sys
+import hmac
+import json
+import time
+import queue
+import signal
+import asyncio
+import logging
+import threading
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+
+from logging_setup import setup_logging
+from metrics import (
+    start_http_server, WEBHOOK_UPDATES, WEBHOOK_REJECTED, WORKER_QUEUE_DEPTH, WORKER_HEARTBEAT_AGE,
+    WORKER_RESTARTS
+)
+from health_watchdog import sd_notify, watchdog_seconds
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS') or 0) or os.cpu_count() or 1
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+# Публичный адрес webhook (за nginx); пусто - webhook регистрируется вручную
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+# Обновлений в очереди одного процесса; при переполнении Telegram получает 503 и повторит позже
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '10000'))
+WORKER_STALL_SECONDS = float(os.getenv('WORKER_STALL_SECONDS', '30'))
+WORKER_START_TIMEOUT = float(os.getenv('WORKER_START_TIMEOUT', '120'))
+WORKER_STOP_TIMEOUT = float(os.getenv('WORKER_STOP_TIMEOUT', '30'))
+
+# Интервал сигнала жизни процесса-обработчика, секунды
+HEARTBEAT_INTERVAL = 1.0
+# Процесс, упавший при запуске, перезапускается не чаще этого интервала, секунды
+RESTART_DELAY = 5.0
+
+def route_key(update: dict) -> int:
+    """Ключ распределения обновления: id пользователя, иначе id чата, иначе update_id"""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        for field in ('from', 'user', 'chat'):
+            source = value.get(field)
+            if isinstance(source, dict) and isinstance(source.get('id'), int):
+                return source['id']
+        # Ответ на опрос и подобные - вложенный объект с пользователем
+        for nested in value.values():
+            if isinstance(nested, dict) and isinstance(nested.get('user'), dict):
+                user_id = nested['user'].get('id')
+                if isinstance(user_id, int):
+                    return user_id
+    return update.get('update_id', 0)
+
+class _WorkerLogFilter(logging.Filter):
+    """Номер процесса-обработчика в записях лога"""
+
+    def __init__(self, index: int):
+        super().__init__()
+        self.index = index
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.worker = self.index
+        return True
+
+def worker_main(index: int, updates, heartbeat, metrics_port: int):
+    """Процесс-обработчик: приложение бота, получающее обновления из очереди супервизора"""
+    # Остановкой управляет супервизор (Ctrl+C в терминале приходит всей группе процессов)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Сообщения systemd отправляет только супервизор
+    for name in ('NOTIFY_SOCKET', 'WATCHDOG_USEC', 'WATCHDOG_PID'):
+        os.environ.pop(name, None)
+
+    import simple_bot
+    simple_bot.startup()
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(_WorkerLogFilter(index))
+    if metrics_port:
+        start_http_server(metrics_port)
+    asyncio.run(_serve_worker(index, updates, heartbeat))
+
+async def _heartbeat(heartbeat):
+    while True:
+        heartbeat.value = time.monotonic()
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+async def _serve_worker(index: int, updates, heartbeat):
+    import simple_bot
+    from telegram import Update
+
+    application = simple_bot.build_application(simple_bot.BOT_TOKEN, dedup_key=f'update_dedup:{index}',
+                                               journal_stream=f'events-{index}')
+    if index == 0:
+        simple_bot.start_background_services(application)
+    await application.initialize()
+    await application.start()
+    if index == 0:
+        await simple_bot.setup_bot_commands(application)
+
+    loop = asyncio.get_running_loop()
+    beat = loop.create_task(_heartbeat(heartbeat))
+    logger.info(f"🤖 Процесс-обработчик {index} запущен (pid {os.getpid()})")
+    try:
+        while True:
+            data = await loop.run_in_executor(None, updates.get)
+            if data is None:
+                # Плавная остановка: обновления, уже переданные приложению, дообрабатываются в stop()
+                break
+            try:
+                update = Update.de_json(json.loads(data), application.bot)
+            except Exception as e:
+                logger.error(f"❌ Не удалось разобрать обновление: {e}")
+                continue
+            await application.update_queue.put(update)
+    finally:
+        beat.cancel()
+        await application.stop()
+        await application.shutdown()
+        logger.info(f"🛑 Процесс-обработчик {index} остановлен")
+
+class WorkerSlot:
+    """Место процесса-обработчика: очередь обновлений и текущий процесс"""
+
+    def __init__(self, context, index: int):
+        self.context = context
+        self.index = index
+        self.updates = context.Queue(WEBHOOK_QUEUE_SIZE)
+        # Обновления кладут потоки HTTP-сервера, очередь заменяет поток надзора
+        self.lock = threading.Lock()
+        self.heartbeat = context.Value('d', 0.0, lock=False)
+        self.process = None
+        self.started_at = 0.0
+        self.received = WEBHOOK_UPDATES.labels(index)
+        WORKER_QUEUE_DEPTH.labels(index).set_function(lambda: self.updates.qsize())
+        WORKER_HEARTBEAT_AGE.labels(index).set_function(self.heartbeat_age)
+
+    @property
+    def ready(self) -> bool:
+        return self.heartbeat.value > 0
+
+    def heartbeat_age(self) -> float:
+        return time.monotonic() - self.heartbeat.value if self.ready else float('nan')
+
+    def start(self, metrics_port: int):
+        self.heartbeat.value = 0.0
+        self.started_at = time.monotonic()
+        self.process = self.context.Process(
+            target=worker_main, name=f"bot-worker-{self.index}",
+            args=(self.index, self.updates, self.heartbeat, metrics_port)
+        )
+        self.process.start()
+
+    def put(self, data: bytes, timeout: float) -> bool:
+        with self.lock:
+            try:
+                self.updates.put(data, timeout=timeout)
+            except queue.Full:
+                return False
+        self.received.inc()
+        return True
+
+    def replace_queue(self):
+        """
+        Новая очередь вместо очереди аварийно завершенного процесса
+
+        Процесс, убитый во время чтения, может оставить захваченной внутреннюю
+        блокировку очереди - тогда новый процесс не смог бы из нее читать.
+        Оставшиеся обновления переносятся в новую очередь в прежнем порядке.
+        """
+        with self.lock:
+            pending = []
+            while True:
+                try:
+                    # С таймаутом: поток отправки очереди может еще дописывать обновления
+                    pending.append(self.updates.get(timeout=0.2))
+                except (queue.Empty, OSError):
+                    break
+            self.updates.close()
+            self.updates = self.context.Queue(WEBHOOK_QUEUE_SIZE)
+            for data in pending:
+                if data is not None:
+                    self.updates.put(data)
+        if pending:
+            logger.info(f"📦 В очередь процесса {self.index} перенесено обновлений: {len(pending)}")
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    """Прием обновлений от Telegram"""
+
+    protocol_version = 'HTTP/1.1'
+    supervisor = None
+
+    def _reply(self, code: int):
+        self.send_response(code)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.path.split('?', 1)[0] != WEBHOOK_PATH:
+            WEBHOOK_REJECTED.labels('path').inc()
+            self._reply(404)
+            return
+        if WEBHOOK_SECRET and not hmac.compare_digest(
+                self.headers.get('X-Telegram-Bot-Api-Secret-Token', ''), WEBHOOK_SECRET):
+            WEBHOOK_REJECTED.labels('secret').inc()
+            self._reply(403)
+            return
+        try:
+            update = json.loads(body)
+            if not isinstance(update, dict):
+                raise ValueError("ожидается объект")
+        except ValueError as e:
+            logger.warning(f"⚠️ Некорректное обновление: {e}")
+            WEBHOOK_REJECTED.labels('invalid').inc()
+            self._reply(400)
+            return
+        if self.supervisor.dispatch(update, body):
+            self._reply(200)
+        else:
+            WEBHOOK_REJECTED.labels('queue_full').inc()
+            self._reply(503)
+
+    def log_message(self, format, *args):
+        pass
+
+class Supervisor:
+    """Процессы-обработчики, прием webhook и надзор"""
+
+    def __init__(self, workers: int = WEBHOOK_WORKERS, metrics_port: int = None):
+        self.context = multiprocessing.get_context('spawn')
+        self.slots = [WorkerSlot(self.context, index) for index in range(workers)]
+        self.metrics_port = metrics_port if metrics_port is not None else int(os.getenv('METRICS_PORT') or 0)
+        self.server = None
+        self.ready = False
+        self._stop = threading.Event()
+        self._reload = threading.Event()
+
+    def dispatch(self, update: dict, data: bytes) -> bool:
+        slot = self.slots[route_key(update) % len(self.slots)]
+        return slot.put(data, timeout=5)
+
+    def _worker_metrics_port(self, slot: WorkerSlot) -> int:
+        return self.metrics_port + 1 + slot.index if self.metrics_port else 0
+
+    def _start(self, slot: WorkerSlot):
+        slot.start(self._worker_metrics_port(slot))
+
+    def _restart(self, slot: WorkerSlot, reason: str):
+        WORKER_RESTARTS.labels(slot.index, reason).inc()
+        if slot.process.is_alive():
+            slot.process.kill()
+        slot.process.join()
+        slot.replace_queue()
+        self._start(slot)
+
+    def _check_workers(self):
+        now = time.monotonic()
+        for slot in self.slots:
+            if not slot.process.is_alive():
+                if not slot.ready and now - slot.started_at < RESTART_DELAY:
+                    continue
+                logger.error(f"❌ Процесс-обработчик {slot.index} завершился с кодом "
+                             f"{slot.process.exitcode}, перезапуск")
+                self._restart(slot, 'exit')
+            elif slot.ready and now - slot.heartbeat.value > WORKER_STALL_SECONDS:
+                logger.error(f"❌ Процесс-обработчик {slot.index} не отвечает "
+                             f"{now - slot.heartbeat.value:.0f} с, перезапуск")
+                self._restart(slot, 'stall')
+            elif not slot.ready and now - slot.started_at > WORKER_START_TIMEOUT:
+                logger.error(f"❌ Процесс-обработчик {slot.index} не запустился за {WORKER_START_TIMEOUT:g} с")
+                self._restart(slot, 'start_timeout')
+
+    def _wait(self, condition, timeout: float) -> bool:
+        """Ожидание условия без остановки сигналов watchdog"""
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                return False
+            self._notify()
+            time.sleep(0.1)
+        return True
+
+    def _stop_worker(self, slot: WorkerSlot) -> bool:
+        """Плавная остановка: процесс дообрабатывает очередь и завершается"""
+        with slot.lock:
+            slot.updates.put(None)
+        stopped = self._wait(lambda: not slot.process.is_alive(), WORKER_STOP_TIMEOUT)
+        if not stopped:
+            logger.warning(f"⚠️ Процесс-обработчик {slot.index} не остановился за {WORKER_STOP_TIMEOUT:g} с")
+            slot.process.kill()
+        slot.process.join()
+        return stopped
+
+    def rolling_restart(self):
+        """Перезапуск процессов по одному; очередь останавливаемого процесса ждет новый"""
+        logger.info("🔄 Поочередный перезапуск процессов-обработчиков...")
+        sd_notify("RELOADING=1")
+        for slot in self.slots:
+            if self._stop.is_set():
+                return
+            if self._stop_worker(slot):
+                WORKER_RESTARTS.labels(slot.index, 'reload').inc()
+            else:
+                WORKER_RESTARTS.labels(slot.index, 'reload_timeout').inc()
+                slot.replace_queue()
+            self._start(slot)
+            self._wait(lambda: slot.ready, WORKER_START_TIMEOUT)
+        sd_notify("READY=1")
+        logger.info("✅ Процессы-обработчики перезапущены")
+
+    def _notify(self):
+        if not self.ready:
+            return
+        alive = sum(slot.process.is_alive() and slot.ready for slot in self.slots)
+        notify = f"STATUS=Процессов-обработчиков: {alive} из {len(self.slots)}"
+        # Ни один процесс не работает долго - systemd перезапустит службу целиком
+        if alive and watchdog_seconds() is not None:
+            notify += "\nWATCHDOG=1"
+        sd_notify(notify)
+
+    def _set_webhook(self, token: str, base_url: str = None) -> bool:
+        from telegram import Bot, Update
+
+        async def set_webhook():
+            async with Bot(token, base_url=base_url or "https://api.telegram.org/bot") as bot:
+                await bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET, allowed_updates=Update.ALL_TYPES,
+                                      max_connections=WEBHOOK_MAX_CONNECTIONS)
+
+        try:
+            asyncio.run(set_webhook())
+            logger.info(f"✅ Webhook зарегистрирован: {WEBHOOK_URL}")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Не удалось зарегистрировать webhook: {e}")
+            return False
+
+    def run(self, token: str, base_url: str = None):
+        for slot in self.slots:
+            self._start(slot)
+        start_http_server(self.metrics_port)
+
+        _WebhookHandler.supervisor = self
+        self.server = ThreadingHTTPServer((WEBHOOK_LISTEN, WEBHOOK_PORT), _WebhookHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True, name="webhook").start()
+        logger.info(f"🌐 Webhook принимается на http://{WEBHOOK_LISTEN}:{self.server.server_port}{WEBHOOK_PATH}, "
+                    f"процессов-обработчиков: {len(self.slots)}")
+
+        if not self._wait(lambda: all(slot.ready or not slot.process.is_alive() for slot in self.slots),
+                          WORKER_START_TIMEOUT):
+            logger.warning("⚠️ Не все процессы-обработчики запустились, продолжаем")
+        if WEBHOOK_URL:
+            self._set_webhook(token, base_url)
+        else:
+            logger.warning("⚠️ WEBHOOK_URL не задан - webhook должен быть зарегистрирован вручную")
+        self.ready = True
+        sd_notify("READY=1")
+        logger.info("🤖 Бот запущен в режиме webhook...")
+
+        while not self._stop.wait(HEARTBEAT_INTERVAL):
+            if self._reload.is_set():
+                self._reload.clear()
+                self.rolling_restart()
+            self._check_workers()
+            self._notify()
+        self.shutdown()
+
+    def shutdown(self):
+        """Остановка: новые обновления не принимаются (Telegram повторит их позже), очереди дообрабатываются"""
+        sd_notify("STOPPING=1")
+        logger.info("🛑 Остановка процессов-обработчиков...")
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        for slot in self.slots:
+            with slot.lock:
+                slot.updates.put(None)
+        deadline = time.monotonic() + WORKER_STOP_TIMEOUT
+        for slot in self.slots:
+            slot.process.join(max(0.0, deadline - time.monotonic()))
+            if slot.process.is_alive():
+                logger.warning(f"⚠️ Процесс-обработчик {slot.index} не остановился, завершаем принудительно")
+                slot.process.kill()
+                slot.process.join()
+
+    def request_stop(self, *_):
+        self._stop.set()
+
+    def request_reload(self, *_):
+        self._reload.set()
+
+def main():
+    setup_logging()
+    token = os.getenv('BOT_TOKEN')
+    if not token:
+        logger.error("Не указан токен бота в переменной BOT_TOKEN")
+        sys.exit(1)
+
+    supervisor = Supervisor()
+    signal.signal(signal.SIGTERM, supervisor.request_stop)
+    signal.signal(signal.SIGINT, supervisor.request_stop)
+    signal.signal(signal.SIGHUP, supervisor.request_reload)
+    supervisor.run(token, os.getenv('BOT_API_BASE_URL'))
+
+if __name__ == "__main__":
+    main()